@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional, Tuple
+
+from metrics import ADMISSION_REJECTIONS, feature_from_path, registry
+from scheduler import upstream_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Per-feature budgets. Each feature is judged only against its own limits (plus the
+# shared pressure it actually depends on), so a saturated OCR path cannot shed gitops.
+DEFAULT_LIMITS = {
+    "screen-assist": {"max_in_flight": 8, "max_ocr_seconds": 60, "max_pending_llm": 8},
+    "refactor": {"max_in_flight": 16, "max_pending_llm": 32, "max_db_queue": 64},
+    "ask-qa": {"max_in_flight": 64, "max_pending_llm": 32},
+    "gitops": {"max_in_flight": 64, "max_pending_llm": 32},
+    "history": {"max_in_flight": 32, "max_db_queue": 64},
+}
+
+# How long a request may wait for capacity before it is rejected; 0 rejects immediately
+ADMISSION_DEFER_SECONDS = float(os.getenv("ADMISSION_DEFER_SECONDS", "0"))
+ADMISSION_RETRY_AFTER = float(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+# Starting guess for the cost of one OCR frame, refined from measurements
+OCR_FRAME_ESTIMATE = float(os.getenv("OCR_FRAME_ESTIMATE", "1.5"))
+OCR_WORKERS = os.cpu_count() or 1
+
+
+def _load_limits(raw: str) -> Dict[str, dict]:
+    """DEFAULT_LIMITS with the overrides in raw; an invalid override is ignored, never fatal."""
+    limits = {feature: dict(values) for feature, values in DEFAULT_LIMITS.items()}
+    try:
+        overrides = json.loads(raw)
+        if not isinstance(overrides, dict):
+            raise ValueError("expected an object of features")
+        for feature, values in overrides.items():
+            if not isinstance(values, dict):
+                raise ValueError(f"limits for '{feature}' are not an object")
+            limits.setdefault(feature, {}).update({name: float(value) for name, value in values.items()})
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Ignoring invalid ADMISSION_LIMITS: {e}")
+        return {feature: dict(values) for feature, values in DEFAULT_LIMITS.items()}
+    return limits
+
+
+# Override per feature, e.g. ADMISSION_LIMITS='{"screen-assist": {"max_ocr_seconds": 120}}'
+LIMITS: Dict[str, dict] = _load_limits(os.getenv("ADMISSION_LIMITS", "{}"))
+
+
+class OCRBudget:
+    """Estimated OCR CPU seconds admitted but not yet spent."""
+
+    def __init__(self, frame_estimate: float = OCR_FRAME_ESTIMATE, alpha: float = 0.2):
+        self.frame_estimate = frame_estimate
+        self.alpha = alpha
+        self.in_flight_seconds = 0.0
+
+    @contextmanager
+    def reserve(self, frames: int):
+        reservation = OCRReservation(self, frames)
+        self.in_flight_seconds += reservation.reserved
+        try:
+            yield reservation
+        finally:
+            self.in_flight_seconds = max(0.0, self.in_flight_seconds - reservation.reserved)
+
+    def record(self, seconds: float) -> None:
+        self.frame_estimate += self.alpha * (seconds - self.frame_estimate)
+
+
+class OCRReservation:
+    def __init__(self, budget: OCRBudget, frames: int):
+        self.budget = budget
+        self.per_frame = budget.frame_estimate
+        self.reserved = frames * self.per_frame
+
+    def frame_done(self, seconds: float) -> None:
+        self.budget.record(seconds)
+        released = min(self.per_frame, self.reserved)
+        self.reserved -= released
+        self.budget.in_flight_seconds = max(0.0, self.budget.in_flight_seconds - released)
+
+
+class AdmissionController:
+    def __init__(self, limits: Dict[str, dict] = LIMITS, defer_seconds: float = ADMISSION_DEFER_SECONDS):
+        self.limits = limits
+        self.defer_seconds = defer_seconds
+        self.in_flight: Dict[str, int] = defaultdict(int)
+        self.pending: Dict[str, int] = defaultdict(int)
+        self.ocr = OCRBudget()
+        self._changed: Optional[asyncio.Event] = None
+
+    @contextmanager
+    def track(self, resource: str):
+        """Count work waiting on a shared resource, e.g. the DB executor."""
+        self.pending[resource] += 1
+        try:
+            yield
+        finally:
+            self.pending[resource] -= 1
+            self._notify()
+
+    def _notify(self) -> None:
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def check(self, feature: str) -> Optional[Tuple[str, float]]:
+        """(reason, retry_after) if feature is over any of its budgets, else None."""
+        limits = self.limits.get(feature)
+        if not limits:
+            return None
+        if self.in_flight[feature] >= limits.get("max_in_flight", math.inf):
+            return "in_flight", ADMISSION_RETRY_AFTER
+        if self.ocr.in_flight_seconds >= limits.get("max_ocr_seconds", math.inf):
+            return "ocr_budget", self.ocr.in_flight_seconds / OCR_WORKERS
+        pending_llm = upstream_scheduler.queued().get(feature, 0)
+        if pending_llm >= limits.get("max_pending_llm", math.inf):
+            per_second = upstream_scheduler.requests.rate or 1.0
+            return "pending_llm", pending_llm / per_second
+        if self.pending["db"] >= limits.get("max_db_queue", math.inf):
+            return "db_queue", ADMISSION_RETRY_AFTER
+        return None
+
+    async def admit(self, feature: str) -> Optional[Tuple[str, float]]:
+        """Wait up to defer_seconds for capacity; return the rejection if there is none."""
+        deadline = time.monotonic() + self.defer_seconds
+        while True:
+            rejection = self.check(feature)
+            if rejection is None:
+                return None
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return rejection
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            try:
+                # Pending LLM calls drain without notifying us, so re-check periodically
+                await asyncio.wait_for(self._changed.wait(), timeout=min(left, 0.25))
+            except asyncio.TimeoutError:
+                pass
+
+    @asynccontextmanager
+    async def running(self, feature: str):
+        self.in_flight[feature] += 1
+        try:
+            yield
+        finally:
+            self.in_flight[feature] -= 1
+            self._notify()
+
+    def state(self) -> dict:
+        queued = upstream_scheduler.queued()
+        features = {}
+        for feature, limits in self.limits.items():
+            rejection = self.check(feature)
+            features[feature] = {
+                "in_flight": self.in_flight[feature],
+                "pending_llm": queued.get(feature, 0),
+                "limits": limits,
+                "shedding": rejection[0] if rejection else None,
+            }
+        return {
+            "features": features,
+            "ocr_seconds_in_flight": round(self.ocr.in_flight_seconds, 2),
+            "ocr_frame_estimate": round(self.ocr.frame_estimate, 3),
+            "db_queue": self.pending["db"],
+            "rejected": {f"{feature}:{reason}": int(count) for (feature, reason), count in ADMISSION_REJECTIONS.items()},
+        }
+
+
+admission = AdmissionController()
+
+registry.gauge("shadowai_in_flight_requests", "Requests currently admitted, per feature.", ("feature",),
+               lambda: {(feature,): count for feature, count in admission.in_flight.items()})
+registry.gauge("shadowai_llm_calls_queued", "LLM calls waiting for an upstream slot.", ("feature",),
+               lambda: {(feature,): count for feature, count in upstream_scheduler.queued().items()})
+registry.gauge("shadowai_ocr_seconds_in_flight", "Estimated OCR seconds admitted but not yet spent.", (),
+               lambda: {(): admission.ocr.in_flight_seconds})
+registry.gauge("shadowai_db_queue", "DB operations waiting on or running in the executor.", (),
+               lambda: {(): admission.pending["db"]})
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware that sheds load per feature with 503 + Retry-After."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        feature = feature_from_path(scope.get("path", ""))
+        if feature not in admission.limits:
+            await self.app(scope, receive, send)
+            return
+
+        rejection = await admission.admit(feature)
+        if rejection is not None:
+            reason, retry_after = rejection
+            ADMISSION_REJECTIONS.inc(feature=feature, reason=reason)
+            retry_after = max(1, math.ceil(retry_after))
+            logger.warning(f"[Admission] Shedding {scope.get('path')} ({reason}), retry after {retry_after}s")
+            body = json.dumps({"error": f"{feature} is overloaded ({reason}); retry later", "retry_after": retry_after})
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(retry_after).encode("latin-1")),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body.encode()})
+            return
+
+        async with admission.running(feature):
+            await self.app(scope, receive, send)
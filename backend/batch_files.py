@@ -0,0 +1,205 @@
+"""Source files in and out of /refactor/batch: zip/tar uploads or JSON lists, and result archives."""
+import io
+import json
+import os
+import posixpath
+import tarfile
+import time
+import zipfile
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterable, List, Optional
+
+# Limits per batch: files, size of one file, and total uncompressed bytes (zip bombs)
+REFACTOR_BATCH_MAX_FILES = int(os.getenv("REFACTOR_BATCH_MAX_FILES", "500"))
+REFACTOR_BATCH_MAX_FILE_BYTES = int(os.getenv("REFACTOR_BATCH_MAX_FILE_BYTES", str(512 * 1024)))
+REFACTOR_BATCH_MAX_BYTES = int(os.getenv("REFACTOR_BATCH_MAX_BYTES", str(50 * 1024 * 1024)))
+REFACTOR_BATCH_DIR = os.getenv(
+    "REFACTOR_BATCH_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "refactor_batches")
+)
+# Result archives are kept this long for download
+REFACTOR_BATCH_TTL = float(os.getenv("REFACTOR_BATCH_TTL", "3600"))
+
+ARCHIVE_FORMATS = {"zip": ".zip", "tar": ".tar.gz"}
+ARCHIVE_MEDIA_TYPES = {"zip": "application/zip", "tar": "application/gzip"}
+# Per-file status and summary; skipped files are listed here rather than copied
+MANIFEST_NAME = "refactor-manifest.json"
+
+# File extension for code converted with target_language (modern mode); others keep theirs
+EXTENSIONS = {
+    "javascript": ".js",
+    "typescript": ".ts",
+    "python": ".py",
+    "java": ".java",
+    "go": ".go",
+    "rust": ".rs",
+    "c#": ".cs",
+    "kotlin": ".kt",
+}
+
+
+class BatchInputError(ValueError):
+    """The upload or file list cannot be refactored as a batch."""
+
+
+@dataclass
+class SourceFile:
+    path: str
+    code: Optional[str]  # None when skipped
+    skipped: Optional[str] = None  # why it is not refactored
+
+
+def clean_path(name: str) -> Optional[str]:
+    """A relative POSIX path inside the archive, or None for absolute or escaping names."""
+    path = posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+    if path in ("", ".") or path.startswith("../") or path == ".." or ":" in path.split("/")[0]:
+        return None
+    return path
+
+
+def _source(path: str, data: bytes) -> SourceFile:
+    if len(data) > REFACTOR_BATCH_MAX_FILE_BYTES:
+        return SourceFile(path, None, f"larger than {REFACTOR_BATCH_MAX_FILE_BYTES} bytes")
+    if b"\0" in data:
+        return SourceFile(path, None, "binary")
+    try:
+        code = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return SourceFile(path, None, "not utf-8")
+    if not code.strip():
+        return SourceFile(path, None, "empty")
+    return SourceFile(path, code)
+
+
+def _check_count(count: int) -> None:
+    if count > REFACTOR_BATCH_MAX_FILES:
+        raise BatchInputError(f"more than {REFACTOR_BATCH_MAX_FILES} files")
+
+
+def _check_unique(files: List[SourceFile]) -> List[SourceFile]:
+    # Names that clean to the same path would overwrite each other's results
+    seen = set()
+    for source in files:
+        if source.path in seen:
+            raise BatchInputError(f"duplicate path {source.path!r}")
+        seen.add(source.path)
+    return files
+
+
+def read_upload(filename: str, fileobj: BinaryIO) -> List[SourceFile]:
+    """Files of a zip or (optionally compressed) tar upload, in archive order."""
+    files: List[SourceFile] = []
+    total = 0
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                path = clean_path(info.filename)
+                if info.is_dir() or path is None or path.startswith("__MACOSX/"):
+                    continue
+                _check_count(len(files) + 1)
+                total += info.file_size
+                if total > REFACTOR_BATCH_MAX_BYTES:
+                    raise BatchInputError(f"more than {REFACTOR_BATCH_MAX_BYTES} bytes uncompressed")
+                if info.file_size > REFACTOR_BATCH_MAX_FILE_BYTES:
+                    files.append(SourceFile(path, None, f"larger than {REFACTOR_BATCH_MAX_FILE_BYTES} bytes"))
+                    continue
+                # The declared size can lie; never read more than the limit allows
+                with archive.open(info) as f:
+                    files.append(_source(path, f.read(REFACTOR_BATCH_MAX_FILE_BYTES + 1)))
+        return _check_unique(files)
+
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.TarError:
+        raise BatchInputError(f"{filename or 'upload'} is not a zip or tar archive")
+    with archive:
+        for member in archive:
+            path = clean_path(member.name)
+            # Regular files only: links and devices are never followed
+            if not member.isfile() or path is None:
+                continue
+            _check_count(len(files) + 1)
+            total += member.size
+            if total > REFACTOR_BATCH_MAX_BYTES:
+                raise BatchInputError(f"more than {REFACTOR_BATCH_MAX_BYTES} bytes uncompressed")
+            if member.size > REFACTOR_BATCH_MAX_FILE_BYTES:
+                files.append(SourceFile(path, None, f"larger than {REFACTOR_BATCH_MAX_FILE_BYTES} bytes"))
+                continue
+            files.append(_source(path, archive.extractfile(member).read()))
+    return _check_unique(files)
+
+
+def read_list(entries: Iterable[dict]) -> List[SourceFile]:
+    """Files from a JSON list of {"path": ..., "code": ...}."""
+    files = []
+    for i, entry in enumerate(entries):
+        path = clean_path(str(entry.get("path") or f"file-{i}"))
+        if path is None:
+            raise BatchInputError(f"invalid path {entry.get('path')!r}")
+        files.append(_source(path, str(entry.get("code", "")).encode("utf-8")))
+        _check_count(len(files))
+    return _check_unique(files)
+
+
+def output_path(path: str, mode: str, target_language: str) -> str:
+    """Where a refactored file goes in the result archive: converted code gets the new extension."""
+    extension = EXTENSIONS.get(target_language.lower()) if mode == "modern" else None
+    if not extension:
+        return path
+    return posixpath.splitext(path)[0] + extension
+
+
+def output_collisions(paths: Iterable[str], mode: str, target_language: str) -> List[str]:
+    """Archive names two of these files could both be written to.
+
+    A file keeps its own path when its refactoring fails, so both names count for each.
+    """
+    owners: Dict[str, str] = {}
+    collisions = []
+    for path in paths:
+        for name in {path, output_path(path, mode, target_language)}:
+            if owners.setdefault(name, path) != path and name not in collisions:
+                collisions.append(name)
+    return collisions
+
+
+def archive_path(batch_id: str, fmt: str, directory: str = REFACTOR_BATCH_DIR) -> str:
+    return os.path.join(directory, f"{batch_id}{ARCHIVE_FORMATS[fmt]}")
+
+
+def write_archive(path: str, fmt: str, files: Iterable[tuple], manifest: dict) -> None:
+    """Write (path, text) pairs plus the manifest, then move the archive into place atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.partial-{os.getpid()}"
+    manifest_bytes = json.dumps(manifest, indent=2, default=str).encode("utf-8")
+    if fmt == "zip":
+        with zipfile.ZipFile(partial, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, text in files:
+                archive.writestr(name, text)
+            archive.writestr(MANIFEST_NAME, manifest_bytes)
+    else:
+        with tarfile.open(partial, "w:gz") as archive:
+            for name, data in [(name, text.encode("utf-8")) for name, text in files] + [(MANIFEST_NAME, manifest_bytes)]:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                archive.addfile(info, io.BytesIO(data))
+    os.replace(partial, path)
+
+
+def purge_archives(directory: str = REFACTOR_BATCH_DIR, ttl: float = REFACTOR_BATCH_TTL) -> int:
+    """Delete result archives older than the TTL; returns how many went."""
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - ttl
+    purged = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                purged += 1
+        except FileNotFoundError:
+            continue
+    return purged
@@ -0,0 +1,185 @@
+"""Request payloads for the load test, deterministic for a given seed."""
+import base64
+import io
+import random
+import uuid
+
+SNIPPETS = [
+    '''def total_price(items, tax):
+    t = 0
+    for i in range(len(items)):
+        t = t + items[i]["price"] * items[i]["qty"]
+    return t + t * tax
+''',
+    '''function fetchUser(id, cb) {
+  var xhr = new XMLHttpRequest();
+  xhr.open("GET", "/api/users/" + id);
+  xhr.onload = function () { cb(null, JSON.parse(xhr.responseText)); };
+  xhr.onerror = function () { cb(new Error("failed")); };
+  xhr.send();
+}
+''',
+    '''class Cache:
+    def __init__(self):
+        self.d = {}
+    def get(self, k):
+        if k in self.d.keys():
+            return self.d[k]
+        else:
+            return None
+    def put(self, k, v):
+        self.d[k] = v
+''',
+    '''import sqlite3
+def find_user(name):
+    conn = sqlite3.connect("app.db")
+    rows = conn.execute("SELECT * FROM users WHERE name = '" + name + "'").fetchall()
+    conn.close()
+    return rows
+''',
+]
+
+QUESTIONS = [
+    "Why does this function return the wrong total when tax is zero?",
+    "How can I make this faster for large inputs?",
+    "Is there a security problem in this code?",
+    "What does this code do, in simple terms?",
+    "How would you add error handling here?",
+]
+
+GIT_INSTRUCTIONS = [
+    "I committed to main by mistake, move the commit to a new branch",
+    "How do I squash my last three commits before opening a pull request?",
+    "Rebase my feature branch onto the latest main and resolve conflicts",
+    "Undo a pushed commit without rewriting history",
+    "Find which commit introduced a failing test",
+]
+
+GIT_ERRORS = [
+    "error: failed to push some refs to 'origin'\nhint: Updates were rejected because the tip of your current branch is behind",
+    "CONFLICT (content): Merge conflict in src/app.py\nAutomatic merge failed; fix conflicts and then commit the result.",
+    "fatal: refusing to merge unrelated histories",
+]
+
+SCENARIOS = ["error", "undo", "branch", "merge", "stash", "reset", "conflict"]
+
+
+def large_python_file(functions: int = 60, seed: int = 0) -> str:
+    """A module long enough to take the parallel large-file refactor path."""
+    rng = random.Random(seed)
+    parts = ['"""Generated module for load tests."""\nimport math\nimport os\n']
+    for i in range(functions):
+        a, b = rng.randint(1, 9), rng.randint(1, 9)
+        parts.append(
+            f"def compute_{i}(values):\n"
+            f"    result = 0\n"
+            f"    for v in values:\n"
+            f"        if v % {a} == 0:\n"
+            f"            result = result + v * {b}\n"
+            f"        else:\n"
+            f"            result = result - math.sqrt(abs(v))\n"
+            f"    return result\n"
+        )
+    return "\n\n".join(parts)
+
+
+def gitops_payload(i: int, rng: random.Random) -> dict:
+    kind = rng.random()
+    if kind < 0.3:
+        # Scenario buttons: served from the precomputed library
+        return {"scenario_type": rng.choice(SCENARIOS), "explain_terms": rng.random() < 0.5}
+    if kind < 0.5:
+        return {"scenario_type": "error", "error_message": rng.choice(GIT_ERRORS)}
+    # Vary the wording a little so only some requests hit the similarity cache
+    return {"instruction": f"{rng.choice(GIT_INSTRUCTIONS)} (ticket {rng.randint(1, 40)})", "explain_terms": rng.random() < 0.3}
+
+
+def ask_qa_payload(i: int, rng: random.Random) -> dict:
+    payload = {"question": f"{rng.choice(QUESTIONS)} (case {rng.randint(1, 50)})", "code": rng.choice(SNIPPETS)}
+    if rng.random() < 0.5:
+        # A handful of sessions asking follow-ups
+        payload["session_id"] = f"bench-session-{rng.randint(1, 8)}"
+    return payload
+
+
+def refactor_payload(i: int, rng: random.Random) -> dict:
+    if rng.random() < 0.2:
+        return {"code": large_python_file(seed=rng.randint(0, 3)), "mode": "clean", "incremental": rng.random() < 0.5}
+    return {"code": rng.choice(SNIPPETS) + f"\n# revision {uuid.UUID(int=rng.getrandbits(128)).hex[:8]}\n",
+            "mode": rng.choice(["clean", "optimize", "security"])}
+
+
+def history_query(i: int, rng: random.Random) -> dict:
+    return {"feature": rng.choice(["gitops", "ask-qa", "refactor", "screen-assist"]), "limit": rng.choice([10, 50])}
+
+
+MONO_FONTS = ["DejaVuSansMono.ttf", "LiberationMono-Regular.ttf", "FreeMono.ttf", "Menlo.ttc", "consola.ttf", "cour.ttf"]
+THEMES = {"light": ((255, 255, 255), (20, 20, 20)), "dark": ((30, 30, 30), (220, 220, 220))}
+
+
+def available_fonts() -> list:
+    """The monospace fonts from MONO_FONTS that Pillow can load here (requires Pillow)."""
+    from PIL import ImageFont
+
+    found = []
+    for name in MONO_FONTS:
+        try:
+            ImageFont.truetype(name, 12)
+        except OSError:
+            continue
+        found.append(name)
+    return found
+
+
+def render_code_screenshot(code: str, font: str = "DejaVuSansMono.ttf", font_size: int = 16, theme: str = "light",
+                           scale: float = 1.0, scroll: float = 0.0):
+    """Render code like an editor screenshot; returns (PNG bytes, the text of fully visible lines).
+
+    `scale` mimics display scaling (a 2x screen doubles every dimension) and `scroll`
+    shifts the view down by that many lines, so a fractional scroll leaves the top line cut.
+    """
+    from PIL import Image, ImageDraw, ImageFont
+
+    size = max(6, round(font_size * scale))
+    try:
+        pil_font = ImageFont.truetype(font, size)
+    except OSError:
+        pil_font = ImageFont.load_default()
+    lines = code.splitlines() or [""]
+    line_height = int(size * 1.4)
+    margin = int(20 * scale)
+    width = max(int(200 * scale), int(max(len(line) for line in lines) * size * 0.62) + 2 * margin)
+    height = line_height * len(lines) + 2 * margin
+    background, foreground = THEMES[theme]
+    image = Image.new("RGB", (width, height), background)
+    draw = ImageDraw.Draw(image)
+    for n, line in enumerate(lines):
+        draw.text((margin, margin + n * line_height), line, fill=foreground, font=pil_font)
+
+    offset = int(scroll * line_height)
+    if offset:
+        image = image.crop((0, offset, width, height))
+    # A line counts as visible only if none of it scrolled off the top
+    first_visible = next(n for n in range(len(lines) + 1) if n == len(lines) or margin + n * line_height >= offset)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue(), "\n".join(lines[first_visible:])
+
+
+def render_code_image(code: str, dark: bool = False, font_size: int = 16) -> str:
+    """A PNG data URL of code as it might appear on screen (requires Pillow)."""
+    png, _ = render_code_screenshot(code, font_size=font_size, theme="dark" if dark else "light")
+    return "data:image/png;base64," + base64.b64encode(png).decode()
+
+
+_screenshots = {}
+
+
+def screen_assist_payload(i: int, rng: random.Random) -> dict:
+    frames = []
+    for _ in range(rng.randint(2, 5)):
+        key = (rng.randrange(len(SNIPPETS)), rng.random() < 0.3)
+        if key not in _screenshots:
+            _screenshots[key] = render_code_image(SNIPPETS[key[0]], dark=key[1])
+        frames.append(_screenshots[key])
+    return {"image_base64_list": frames, "query": rng.choice(QUESTIONS), "session_id": f"bench-{i}", "is_final": True}
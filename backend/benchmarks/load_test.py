@@ -0,0 +1,238 @@
+"""Offline load test: the backend against a mock messages API and an in-memory Mongo.
+
+    cd backend
+    python -m benchmarks.load_test                      # every profile, default sizes
+    python -m benchmarks.load_test --profiles gitops,history --scale 2 --ttfb-ms 800
+    python -m benchmarks.load_test --app-url http://127.0.0.1:8000   # an already running app
+
+Starts benchmarks.mock_anthropic and benchmarks.serve_app as subprocesses (unless
+--app-url is given), drives each endpoint with its concurrency profile, and reports
+throughput, p50/p95/p99 latency, status codes and event-loop lag per profile.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks import fixtures
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class Profile:
+    name: str
+    method: str
+    path: str
+    concurrency: int
+    requests: int
+    payload: Callable[[int, random.Random], dict]
+    # For the mixed profile: (weight, profile) pairs to draw each request from
+    mix: List[tuple] = field(default_factory=list)
+
+
+PROFILES: Dict[str, Profile] = {
+    "gitops": Profile("gitops", "POST", "/gitops", concurrency=16, requests=160, payload=fixtures.gitops_payload),
+    "ask-qa": Profile("ask-qa", "POST", "/ask-qa", concurrency=16, requests=160, payload=fixtures.ask_qa_payload),
+    "refactor": Profile("refactor", "POST", "/refactor", concurrency=4, requests=24, payload=fixtures.refactor_payload),
+    "history": Profile("history", "GET", "/history", concurrency=32, requests=400, payload=fixtures.history_query),
+    "screen-assist": Profile("screen-assist", "POST", "/screen-assist", concurrency=2, requests=12, payload=fixtures.screen_assist_payload),
+}
+# Interactive traffic with a little OCR and bulk work in the background
+PROFILES["mixed"] = Profile("mixed", "", "", concurrency=24, requests=300, payload=None, mix=[
+    (0.35, PROFILES["gitops"]), (0.35, PROFILES["ask-qa"]), (0.15, PROFILES["history"]),
+    (0.1, PROFILES["refactor"]), (0.05, PROFILES["screen-assist"]),
+])
+
+
+def percentile(ordered: List[float], q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+
+
+async def send(client: httpx.AsyncClient, profile: Profile, i: int, rng: random.Random) -> tuple:
+    payload = profile.payload(i, rng)
+    start = time.perf_counter()
+    try:
+        if profile.method == "GET":
+            response = await client.get(profile.path, params=payload)
+        else:
+            response = await client.post(profile.path, json=payload)
+        status = response.status_code
+        # Routes report upstream failures in the body with a 200
+        if status == 200 and response.headers.get("content-type", "").startswith("application/json"):
+            body = response.json()
+            if isinstance(body, dict) and "error" in body:
+                status = "error-body"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    return profile.name, time.perf_counter() - start, status
+
+
+async def run_profile(client: httpx.AsyncClient, profile: Profile, scale: float, seed: int) -> dict:
+    total = max(1, int(profile.requests * scale))
+    rng = random.Random(seed)
+    # Draw every request up front so runs are repeatable regardless of timing
+    plan = []
+    for i in range(total):
+        target = profile
+        if profile.mix:
+            target = rng.choices([p for _, p in profile.mix], weights=[w for w, _ in profile.mix])[0]
+        plan.append((target, i, random.Random(rng.getrandbits(32))))
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in plan:
+        queue.put_nowait(item)
+    results = []
+
+    async def worker():
+        while not queue.empty():
+            target, i, request_rng = queue.get_nowait()
+            results.append(await send(client, target, i, request_rng))
+
+    await client.get("/__bench/loop-lag", params={"reset": "true"})
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(profile.concurrency)))
+    elapsed = time.perf_counter() - start
+    loop_lag = (await client.get("/__bench/loop-lag")).json()
+
+    by_endpoint = {}
+    for name in sorted({name for name, _, _ in results}):
+        latencies = sorted(latency for n, latency, _ in results if n == name)
+        statuses = Counter(str(status) for n, _, status in results if n == name)
+        by_endpoint[name] = {
+            "requests": len(latencies),
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": percentile(latencies, 0.5),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "statuses": dict(statuses),
+        }
+    return {"profile": profile.name, "concurrency": profile.concurrency, "elapsed_s": round(elapsed, 2),
+            "endpoints": by_endpoint, "event_loop_lag": loop_lag}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_until_ready(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url, timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health")).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+def start_stack(args) -> tuple:
+    mock_port, app_port = free_port(), free_port()
+    processes = [subprocess.Popen([
+        sys.executable, "-m", "benchmarks.mock_anthropic", "--port", str(mock_port),
+        "--ttfb-ms", str(args.ttfb_ms), "--jitter-ms", str(args.jitter_ms),
+        "--tokens-per-second", str(args.tokens_per_second), "--error-rate", str(args.error_rate),
+    ], cwd=BACKEND_DIR)]
+    env = dict(os.environ)
+    env["SHARED_STATE_BACKEND"] = args.shared_state
+    env["HISTORY_BACKEND"] = args.history_backend
+    if args.shared_state == "redis":
+        redis_port = free_port()
+        processes.append(subprocess.Popen([sys.executable, "-m", "benchmarks.redis_standin", "--port", str(redis_port)], cwd=BACKEND_DIR))
+        env["SHARED_STATE_URL"] = f"redis://127.0.0.1:{redis_port}/0"
+    if not args.production_limits:
+        # The mock has no rate limits; measure the backend, not the upstream budget
+        env.setdefault("LLM_REQUESTS_PER_MINUTE", "100000")
+        env.setdefault("LLM_TOKENS_PER_MINUTE", "1000000000")
+        env.setdefault("LLM_MAX_CONCURRENCY", "256")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    processes.append(subprocess.Popen([
+        sys.executable, "-m", "benchmarks.serve_app", "--port", str(app_port),
+        "--anthropic-url", f"http://127.0.0.1:{mock_port}",
+    ], cwd=BACKEND_DIR, env=env))
+    return f"http://127.0.0.1:{app_port}", processes
+
+
+def print_report(report: List[dict]) -> None:
+    header = f"{'profile':<14}{'endpoint':<15}{'req':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses"
+    print(header)
+    print("-" * len(header))
+    for run in report:
+        for name, stats in run["endpoints"].items():
+            print(f"{run['profile']:<14}{name:<15}{stats['requests']:>6}{stats['throughput_rps']:>9}"
+                  f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}  {stats['statuses']}")
+        lag = run["event_loop_lag"]
+        if lag.get("samples"):
+            print(f"{'':<14}event-loop lag p50 {lag['p50_ms']} ms, p95 {lag['p95_ms']} ms, p99 {lag['p99_ms']} ms, max {lag['max_ms']} ms")
+
+
+async def run(args) -> List[dict]:
+    processes = []
+    url = args.app_url
+    try:
+        if not url:
+            url, processes = start_stack(args)
+        await wait_until_ready(url, args.startup_timeout)
+        names = args.profiles.split(",") if args.profiles else list(PROFILES)
+        report = []
+        limits = httpx.Limits(max_connections=256, max_keepalive_connections=256)
+        async with httpx.AsyncClient(base_url=url, timeout=args.request_timeout, limits=limits) as client:
+            for n, name in enumerate(names):
+                print(f"Running profile {name}...", file=sys.stderr)
+                report.append(await run_profile(client, PROFILES[name], args.scale, args.seed + n))
+        return report
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", default="", help=f"comma-separated subset of {', '.join(PROFILES)}")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every profile's request count")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--app-url", default="", help="drive an already running backend instead of starting one")
+    parser.add_argument("--ttfb-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--shared-state", choices=["sqlite", "redis", "local"], default="sqlite",
+                        help="shared state backend; redis runs against benchmarks.redis_standin")
+    parser.add_argument("--history-backend", choices=["sqlite", "mongo"], default="sqlite",
+                        help="history store; mongo runs against the in-memory stand-in")
+    parser.add_argument("--production-limits", action="store_true", help="keep the real upstream rate limits")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=180.0)
+    parser.add_argument("--output", default="", help="also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
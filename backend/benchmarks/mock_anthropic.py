@@ -0,0 +1,151 @@
+"""Local stand-in for the Anthropic messages API.
+
+Answers POST /v1/messages with plausible responses after a configurable delay, with or
+without SSE streaming, so load tests run without the network or an API key:
+
+    python -m benchmarks.mock_anthropic --port 8100 --ttfb-ms 400 --tokens-per-second 80
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Where the refactor prompts put the code (large-file units, then whole files)
+UNIT_SOURCE = re.compile(r"Part to refactor \([^\n]*\):\n(.*)\Z", re.S)
+FILE_SOURCE = re.compile(r"Code to refactor:\n(.*?)\n\nKeep the total response", re.S)
+
+
+class MockSettings:
+    def __init__(self, ttfb_ms: float = 300.0, jitter_ms: float = 100.0, tokens_per_second: float = 100.0,
+                 error_rate: float = 0.0, output_tokens: int = 200):
+        self.ttfb_ms = ttfb_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.output_tokens = output_tokens
+
+    def ttfb(self) -> float:
+        return max(0.0, random.gauss(self.ttfb_ms, self.jitter_ms)) / 1000
+
+
+def prompt_text(body: dict) -> str:
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content or [])
+    return "\n".join(parts)
+
+
+def reply_for(body: dict, settings: MockSettings) -> str:
+    """Shape the answer like the real one closely enough for the routes' parsers."""
+    prompt = prompt_text(body)
+    code = UNIT_SOURCE.search(prompt) or FILE_SOURCE.search(prompt)
+    if code:
+        # Refactor prompt: one summary line, then the code echoed back in a block
+        return f"Renamed variables and simplified control flow.\n\n```\n{code.group(1).rstrip()}\n```"
+    words = ["the", "function", "returns", "a", "value", "after", "checking", "its", "input", "carefully"]
+    return " ".join(random.choice(words) for _ in range(settings.output_tokens)).capitalize() + "."
+
+
+def tool_input_for(name: str) -> dict:
+    """Input for a forced tool call; only gitops (gitops_answer) forces one."""
+    return {
+        "summary": "Create a branch and move the work onto it.",
+        "commands": ["git switch -c feature/work", "git push -u origin feature/work"],
+        "steps": ["Create the branch", "Push it"],
+        "warnings": ["Pushing publishes the branch"],
+        "beginner_explanation": "A branch is a separate line of work.",
+    }
+
+
+def usage_for(body: dict, text: str) -> dict:
+    return {"input_tokens": len(prompt_text(body)) // 4, "output_tokens": max(1, len(text) // 4)}
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI(title="Mock Anthropic messages API")
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        body = await request.json()
+        await asyncio.sleep(settings.ttfb())
+        if settings.error_rate and random.random() < settings.error_rate:
+            status = random.choice([429, 529])
+            return JSONResponse(
+                status_code=status,
+                headers={"retry-after": "1"} if status == 429 else {},
+                content={"type": "error", "error": {"type": "overloaded_error", "message": "mock overload"}},
+            )
+
+        forced_tool = (body.get("tool_choice") or {}).get("name")
+        if forced_tool:
+            tool_input = tool_input_for(forced_tool)
+            text = json.dumps(tool_input)
+            content = [{"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}", "name": forced_tool, "input": tool_input}]
+        else:
+            text = reply_for(body, settings)
+            content = [{"type": "text", "text": text}]
+        usage = usage_for(body, text)
+        message_id = f"msg_{uuid.uuid4().hex[:24]}"
+        generation_seconds = usage["output_tokens"] / settings.tokens_per_second
+
+        if not body.get("stream"):
+            await asyncio.sleep(generation_seconds)
+            return {
+                "id": message_id,
+                "type": "message",
+                "role": "assistant",
+                "model": body.get("model", "mock"),
+                "content": content,
+                "stop_reason": "tool_use" if forced_tool else "end_turn",
+                "usage": usage,
+            }
+
+        async def events():
+            def event(name: str, data: dict) -> str:
+                return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+            yield event("message_start", {"type": "message_start", "message": {
+                "id": message_id, "type": "message", "role": "assistant", "model": body.get("model", "mock"),
+                "content": [], "usage": {"input_tokens": usage["input_tokens"], "output_tokens": 0}}})
+            yield event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+            chunks = re.findall(r".{1,16}", text, re.S)
+            delay = generation_seconds / max(len(chunks), 1)
+            for chunk in chunks:
+                await asyncio.sleep(delay)
+                yield event("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": chunk}})
+            yield event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            yield event("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": usage["output_tokens"]}})
+            yield event("message_stop", {"type": "message_stop"})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--ttfb-ms", type=float, default=300.0, help="mean time to first byte")
+    parser.add_argument("--jitter-ms", type=float, default=100.0, help="standard deviation of the first-byte delay")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="generation speed after the first byte")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 429/529")
+    parser.add_argument("--output-tokens", type=int, default=200, help="length of free-text answers")
+    args = parser.parse_args()
+
+    import uvicorn
+    settings = MockSettings(args.ttfb_ms, args.jitter_ms, args.tokens_per_second, args.error_rate, args.output_tokens)
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""In-memory stand-in for the slice of pymongo the backend uses.
+
+Good enough for load tests: equality and range filters on dotted paths, $text search
+with a token-overlap score, sort/limit, projections and $set/$inc upserts. It is not a
+database; it exists so benchmarks need neither a Mongo server nor the network.
+"""
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+_WORD = re.compile(r"\w+")
+
+
+def _get(doc: dict, path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def _parent(doc: dict, path: str) -> dict:
+    for part in path.split(".")[:-1]:
+        doc = doc.setdefault(part, {})
+    return doc
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$text":
+            continue
+        value = _get(doc, key)
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            for op, operand in condition.items():
+                if value is None:
+                    return False
+                if op == "$gte" and not value >= operand:
+                    return False
+                if op == "$lte" and not value <= operand:
+                    return False
+                if op == "$gt" and not value > operand:
+                    return False
+                if op == "$lt" and not value < operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class Cursor:
+    def __init__(self, docs: List[dict]):
+        self._docs = docs
+        self._limit: Optional[int] = None
+
+    def sort(self, key, direction: int = 1):
+        if isinstance(key, list):
+            key, direction = key[0]
+        self._docs.sort(key=lambda d: (_get(d, key) is None, _get(d, key)), reverse=direction < 0)
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def __iter__(self):
+        docs = self._docs if self._limit is None else self._docs[:self._limit]
+        return iter([dict(d) for d in docs])
+
+
+class Collection:
+    def __init__(self, name: str):
+        self.name = name
+        self._docs: List[dict] = []
+        self._text_fields: List[str] = []
+        self._indexes: List[dict] = [{"name": "_id_"}]
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def list_indexes(self) -> Iterable[dict]:
+        return list(self._indexes)
+
+    def create_index(self, keys, name: Optional[str] = None, **kwargs) -> str:
+        keys = keys if isinstance(keys, list) else [(keys, 1)]
+        self._text_fields = [field for field, kind in keys if kind == "text"] or self._text_fields
+        name = name or "_".join(f"{field}_{kind}" for field, kind in keys)
+        self._indexes.append({"name": name, "key": dict(keys), **kwargs})
+        return name
+
+    def insert_one(self, doc: dict) -> InsertOneResult:
+        with self._lock:
+            self._next_id += 1
+            doc.setdefault("_id", f"{int(time.time()):08x}{self._next_id:016x}")
+            self._docs.append(doc)
+        return InsertOneResult(doc["_id"])
+
+    def _text_score(self, doc: dict, terms: Counter) -> float:
+        words = Counter()
+        for field in self._text_fields:
+            value = _get(doc, field)
+            if isinstance(value, str):
+                words.update(w.lower() for w in _WORD.findall(value))
+        if not words:
+            return 0.0
+        overlap = sum(min(count, words[term]) for term, count in terms.items())
+        # Mongo's textScore grows with matched terms and shrinks with document length
+        return overlap / (1 + len(words) ** 0.5) * 2
+
+    def _select(self, query: dict, projection: Optional[dict] = None) -> List[dict]:
+        query = query or {}
+        with self._lock:
+            docs = [d for d in self._docs if _matches(d, query)]
+        text = query.get("$text")
+        if text:
+            terms = Counter(w.lower() for w in _WORD.findall(text["$search"]))
+            scored = []
+            for doc in docs:
+                score = self._text_score(doc, terms)
+                if score > 0:
+                    scored.append({**doc, "score": score})
+            docs = scored
+        if projection:
+            keep = {key for key, value in projection.items() if value}
+            docs = [{k: v for k, v in d.items() if k in keep or k == "_id"} for d in docs]
+        return docs
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None, **kwargs) -> Cursor:
+        return Cursor(self._select(query or {}, projection))
+
+    def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None, sort=None, **kwargs) -> Optional[dict]:
+        cursor = Cursor(self._select(query or {}, projection))
+        if sort:
+            key, direction = sort[0]
+            if isinstance(direction, dict):  # {"$meta": "textScore"}
+                key, direction = "score", -1
+            cursor.sort(key, direction)
+        return next(iter(cursor.limit(1)), None)
+
+    def count_documents(self, query: dict) -> int:
+        return len(self._select(query))
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False) -> None:
+        with self._lock:
+            doc = next((d for d in self._docs if _matches(d, query)), None)
+            if doc is None:
+                if not upsert:
+                    return
+                self._next_id += 1
+                doc = {"_id": f"{int(time.time()):08x}{self._next_id:016x}", **query}
+                self._docs.append(doc)
+            for path, value in update.get("$set", {}).items():
+                _parent(doc, path)[path.split(".")[-1]] = value
+            for path, amount in update.get("$inc", {}).items():
+                parent = _parent(doc, path)
+                name = path.split(".")[-1]
+                parent[name] = parent.get(name, 0) + amount
+
+    def delete_many(self, query: dict) -> None:
+        with self._lock:
+            self._docs = [d for d in self._docs if not _matches(d, query)]
+
+
+class Database:
+    def __init__(self, name: str):
+        self.name = name
+        self._collections: Dict[str, Collection] = {}
+
+    def __getitem__(self, name: str) -> Collection:
+        return self._collections.setdefault(name, Collection(name))
+
+    def command(self, name: str, *args, **kwargs) -> dict:
+        return {"ok": 1.0}
+
+
+class StandInClient:
+    """Drop-in for pymongo.MongoClient(uri, **options)."""
+
+    def __init__(self, uri: str = "", **options):
+        self._databases: Dict[str, Database] = {}
+        self.admin = Database("admin")
+
+    def __getitem__(self, name: str) -> Database:
+        return self._databases.setdefault(name, Database(name))
@@ -0,0 +1,212 @@
+"""OCR throughput and accuracy on a synthetic corpus of code screenshots.
+
+    cd backend
+    python -m benchmarks.ocr_bench                      # compare against ocr_baseline.json
+    python -m benchmarks.ocr_bench --update-baseline    # record the current numbers
+    python -m benchmarks.ocr_bench --sizes 12 --themes dark --scrolls 0.5
+
+Renders the load-test snippets with Pillow for every combination of font, size, theme,
+display scale and scroll offset, runs each frame through the screen-assist OCR pipeline
+(decode, preprocess, Tesseract -> EasyOCR -> contour fallback, frame merge, clean_ocr_text)
+and reports frames/sec, ms per stage and character/line error rates per configuration.
+Exits 1 when a configuration regresses against the baseline, and 2 when there is no
+baseline to compare against, or a configuration that ran is missing from it (fonts depend
+on the host, so a baseline from another machine may not cover this run).
+"""
+import argparse
+import base64
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+from time import perf_counter
+from typing import Dict, List, Sequence
+
+from benchmarks import fixtures
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ocr_baseline.json")
+# Absolute slack on error rates and relative slack on frames/sec before a run counts as a regression
+CER_TOLERANCE = 0.02
+LINE_ERROR_TOLERANCE = 0.05
+FPS_TOLERANCE = 0.25
+STAGES = ["ocr.base64", "ocr.imdecode", "ocr.preprocess", "ocr.tesseract", "ocr.easyocr", "ocr.contour",
+          "ocr.merge_frames", "clean_ocr_text"]
+
+
+def corpus() -> List[str]:
+    # The short snippets plus a screenful of a longer module
+    return fixtures.SNIPPETS + ["\n".join(fixtures.large_python_file(functions=4).splitlines()[:30])]
+
+
+def normalize_lines(text: str) -> List[str]:
+    """Compare what OCR can see: collapse runs of whitespace and drop blank lines."""
+    return [re.sub(r"\s+", " ", line).strip() for line in text.splitlines() if line.strip()]
+
+
+def edit_distance(a: Sequence, b: Sequence) -> int:
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+def error_rates(truth: str, ocr: str) -> tuple:
+    """(character error rate, line error rate), each edit distance over the truth's length."""
+    truth_lines, ocr_lines = normalize_lines(truth), normalize_lines(ocr)
+    truth_text, ocr_text = "\n".join(truth_lines), "\n".join(ocr_lines)
+    cer = edit_distance(truth_text, ocr_text) / max(len(truth_text), 1)
+    line_error = edit_distance(truth_lines, ocr_lines) / max(len(truth_lines), 1)
+    return cer, line_error
+
+
+def configurations(args) -> List[dict]:
+    fonts = args.fonts.split(",") if args.fonts else fixtures.available_fonts()[:2] or ["default"]
+    combos = itertools.product(
+        fonts,
+        [int(s) for s in args.sizes.split(",")],
+        args.themes.split(","),
+        [float(s) for s in args.scales.split(",")],
+        [float(s) for s in args.scrolls.split(",")],
+    )
+    return [
+        {"name": f"{os.path.splitext(font)[0]}-{size}px-{theme}-x{scale:g}-scroll{scroll:g}",
+         "font": font, "font_size": size, "theme": theme, "scale": scale, "scroll": scroll}
+        for font, size, theme, scale, scroll in combos
+    ]
+
+
+def run_configuration(config: dict, snippets: List[str]) -> dict:
+    from routes.screen_assist import clean_ocr_text, timed_ocr_image
+    from token_diet import merge_ocr_frames
+    from tracing import Trace, _trace, span
+
+    frames = []
+    for code in snippets:
+        png, truth = fixtures.render_code_screenshot(
+            code, font=config["font"], font_size=config["font_size"], theme=config["theme"],
+            scale=config["scale"], scroll=config["scroll"],
+        )
+        frames.append(("data:image/png;base64," + base64.b64encode(png).decode(), truth))
+
+    # Collect the pipeline's own spans instead of timing stages a second time
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        start = perf_counter()
+        texts = [timed_ocr_image(image, idx)[0] for idx, (image, _) in enumerate(frames)]
+        with span("ocr.merge_frames"):
+            merged = "\n".join(merge_ocr_frames([t.strip() for t in texts if t.strip()]))
+        with span("clean_ocr_text"):
+            clean_ocr_text(merged, lang="python")
+        elapsed = perf_counter() - start
+        # Accuracy is scored per frame; the merge above may legitimately drop repeated lines
+        rates = [error_rates(truth, clean_ocr_text(text, lang="python")) for text, (_, truth) in zip(texts, frames)]
+    finally:
+        _trace.reset(token)
+
+    totals = trace.totals()
+    return {
+        "frames": len(frames),
+        "frames_per_sec": round(len(frames) / elapsed, 3),
+        "ms_per_frame": {name: round(totals[name][0] / len(frames), 2) for name in STAGES if name in totals},
+        "fallbacks": {name: totals[name][1] for name in ("ocr.easyocr", "ocr.contour") if name in totals},
+        "cer": round(sum(r[0] for r in rates) / len(rates), 4),
+        "line_error_rate": round(sum(r[1] for r in rates) / len(rates), 4),
+    }
+
+
+def regressions(results: Dict[str, dict], baseline: Dict[str, dict], check_speed: bool) -> List[str]:
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if result["cer"] > before["cer"] + CER_TOLERANCE:
+            found.append(f"{name}: CER {before['cer']:.3f} -> {result['cer']:.3f}")
+        if result["line_error_rate"] > before["line_error_rate"] + LINE_ERROR_TOLERANCE:
+            found.append(f"{name}: line error rate {before['line_error_rate']:.3f} -> {result['line_error_rate']:.3f}")
+        if check_speed and result["frames_per_sec"] < before["frames_per_sec"] * (1 - FPS_TOLERANCE):
+            found.append(f"{name}: frames/sec {before['frames_per_sec']:.2f} -> {result['frames_per_sec']:.2f}")
+    return found
+
+
+def unmatched(results: Dict[str, dict], baseline: Dict[str, dict]) -> List[str]:
+    """Configurations that ran but have nothing in the baseline to be compared with."""
+    return sorted(set(results) - set(baseline))
+
+
+def print_report(results: Dict[str, dict]) -> None:
+    header = f"{'configuration':<48}{'fps':>8}{'CER':>8}{'LER':>8}  ms/frame by stage"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        stages = ", ".join(f"{stage.split('.')[-1]} {ms}" for stage, ms in r["ms_per_frame"].items())
+        fallbacks = f"  fallbacks {r['fallbacks']}" if r["fallbacks"] else ""
+        print(f"{name:<48}{r['frames_per_sec']:>8}{r['cer']:>8}{r['line_error_rate']:>8}  {stages}{fallbacks}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fonts", default="", help="comma-separated font files (default: first two monospace fonts found)")
+    parser.add_argument("--sizes", default="12,16")
+    parser.add_argument("--themes", default="light,dark")
+    parser.add_argument("--scales", default="1,2", help="display scaling factors")
+    parser.add_argument("--scrolls", default="0,0.5", help="scroll offsets in lines")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="overwrite the baseline with this run")
+    parser.add_argument("--no-speed-check", action="store_true", help="only fail on accuracy (e.g. on different hardware)")
+    parser.add_argument("--output", default="", help="also write the results as JSON to this path")
+    args = parser.parse_args()
+
+    if not args.update_baseline and not os.path.exists(args.baseline):
+        # A check with nothing to compare against must not pass silently
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one.", file=sys.stderr)
+        sys.exit(2)
+
+    # The OCR route pulls in the job store; keep its database out of the tree
+    os.environ.setdefault("JOBS_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="shadowai-ocr-bench-"), "jobs.db"))
+
+    snippets = corpus()
+    results = {}
+    for config in configurations(args):
+        print(f"Running {config['name']}...", file=sys.stderr)
+        results[config["name"]] = {"config": config, **run_configuration(config, snippets)}
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    found = regressions(results, baseline, check_speed=not args.no_speed_check)
+    missing = sorted(set(baseline) - set(results))
+    if missing:
+        print(f"Not run this time (in baseline): {', '.join(missing)}")
+    uncompared = unmatched(results, baseline)
+    if uncompared:
+        print(f"Not in the baseline, so not compared: {', '.join(uncompared)}", file=sys.stderr)
+    if found:
+        print(f"\nOCR REGRESSION against {args.baseline}:")
+        for line in found:
+            print(f"  {line}")
+        sys.exit(1)
+    if uncompared:
+        # Passing on a partial comparison would hide regressions in the configurations left out
+        print("Record a baseline for this host with --update-baseline.", file=sys.stderr)
+        sys.exit(2)
+    print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
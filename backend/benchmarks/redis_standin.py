@@ -0,0 +1,119 @@
+"""Minimal in-memory server speaking the Redis protocol, for SHARED_STATE_BACKEND=redis.
+
+    python -m benchmarks.redis_standin --port 6390
+    SHARED_STATE_BACKEND=redis SHARED_STATE_URL=redis://127.0.0.1:6390/0 gunicorn ...
+
+Supports the commands shared_state.RedisState sends (PING, AUTH, SELECT, GET, SET with
+EX/PX/NX, DEL) plus DBSIZE and FLUSHDB. Not a database; it exists so multi-worker
+tests need no Redis install.
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+
+class Store:
+    def __init__(self):
+        self.values: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+
+def encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Exception):
+        return b"-ERR %s\r\n" % str(reply).encode()
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, str):
+        return b"+%s\r\n" % reply.encode()
+    return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+
+def execute(store: Store, args) -> object:
+    command = args[0].upper()
+    if command == b"PING":
+        return "PONG"
+    if command in (b"AUTH", b"SELECT"):
+        return "OK"
+    if command == b"GET":
+        return store.get(args[1])
+    if command == b"SET":
+        key, value, options = args[1], args[2], [a.upper() for a in args[3:]]
+        expires_at = None
+        if b"PX" in options:
+            expires_at = time.monotonic() + int(options[options.index(b"PX") + 1]) / 1000
+        elif b"EX" in options:
+            expires_at = time.monotonic() + int(options[options.index(b"EX") + 1])
+        if b"NX" in options and store.get(key) is not None:
+            return None
+        store.values[key] = (value, expires_at)
+        return "OK"
+    if command == b"DEL":
+        return sum(1 for key in args[1:] if store.values.pop(key, None) is not None)
+    if command == b"DBSIZE":
+        return len(store.values)
+    if command == b"FLUSHDB":
+        store.values.clear()
+        return "OK"
+    return ValueError(f"unknown command '{command.decode()}'")
+
+
+async def read_command(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, as typed into telnet
+        return line.split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        size = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+def create_server(store: Store):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                args = await read_command(reader)
+                if args is None:
+                    break
+                if args:
+                    writer.write(encode(execute(store, args)))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def serve(host: str, port: int) -> None:
+    server = await asyncio.start_server(create_server(Store()), host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Response serialization and compression cost per endpoint, without running the server.
+
+    cd backend
+    python -m benchmarks.serialization_bench
+    python -m benchmarks.serialization_bench --endpoints history,refactor --number 200
+
+For a representative payload of each endpoint, times the previous path (stringify ids and
+timestamps, jsonable_encoder, json.dumps as FastAPI's JSONResponse does) against the
+orjson one the app now uses, and reports bytes on the wire raw, gzipped and brotli'd
+(when the brotli package is installed) with the time each encoding takes.
+"""
+import argparse
+import copy
+import json
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+from fastapi.encoders import jsonable_encoder
+
+from benchmarks import fixtures
+from responses import brotli, compress, dumps
+
+
+class ObjectId:
+    """Stands in for bson.ObjectId: str() gives the hex id, and jsonable_encoder cannot handle it."""
+
+    __slots__ = ("hex",)
+
+    def __init__(self, n: int):
+        self.hex = f"{n:024x}"
+
+    def __str__(self):
+        return self.hex
+
+
+def history_payload(rng: random.Random) -> dict:
+    now = datetime.utcnow()
+    docs = []
+    for i in range(200):
+        feature = rng.choice(["gitops", "ask-qa", "refactor"])
+        code = rng.choice(fixtures.SNIPPETS)
+        docs.append({
+            "_id": ObjectId(i),
+            "feature": feature,
+            "input": f"{rng.choice(fixtures.QUESTIONS)}\n{code}",
+            "claude_prompt": f"Answer the following question about the code.\n\n{code}",
+            "claude_response": f"Here is what the code does.\n\n```python\n{code}\n```\n" * 2,
+            "timestamp": now - timedelta(minutes=i),
+            "response_time_ms": rng.uniform(300, 4000),
+            "metadata": {"model": "claude-3-5-haiku", "routing": {"tier": "fast", "latency_ms": 812.4},
+                         "token_diet": {"tokens_before": 420, "tokens_after": 380, "tokens_saved": 40, "truncated": False}},
+        })
+    return {"results": docs}
+
+
+def refactor_payload(rng: random.Random) -> dict:
+    code = fixtures.large_python_file(functions=120)
+    units = [{"name": f"compute_{i}", "kind": "function", "status": "ok", "summary": "Simplified the loop."} for i in range(120)]
+    return {"refactored": f"Refactored 120 units in parallel (clean mode).\n\n```python\n{code}```", "units": units,
+            "recomputed": [u["name"] for u in units], "elapsed_ms": 5321.4}
+
+
+def ask_qa_payload(rng: random.Random) -> dict:
+    return {"response": "A brief explanation of the code.\n\n```python\n" + "\n".join(fixtures.SNIPPETS[:3]) + "\n```\n"}
+
+
+def gitops_payload(rng: random.Random) -> dict:
+    return {"summary": "Undo the last commit but keep its changes staged.", "commands": ["git reset --soft HEAD~1"],
+            "steps": ["Check git log", "Run git reset --soft HEAD~1", "Review git status"],
+            "warnings": ["Rewrites history if the commit was pushed"],
+            "beginner_explanation": "HEAD is the commit you are on.", "explain_terms_enabled": True}
+
+
+def stats_payload(rng: random.Random) -> dict:
+    series = [{"bucket": (datetime(2026, 1, 1) + timedelta(minutes=i)).isoformat(), "count": rng.randint(1, 50),
+               "cache_hits": rng.randint(0, 10), "cache_hit_ratio": 0.2,
+               "latency_ms": {"avg": 812.0, "p50": 700.1, "p95": 2100.4, "p99": 3900.2}, "tokens": {"input": 4000, "output": 9000}}
+              for i in range(60)]
+    return {"granularity": "minute", "groups": series[:3], "series": series}
+
+
+PAYLOADS: Dict[str, Callable[[random.Random], dict]] = {
+    "history": history_payload,
+    "refactor": refactor_payload,
+    "ask-qa": ask_qa_payload,
+    "gitops": gitops_payload,
+    "history-stats": stats_payload,
+}
+
+
+def before(payload: dict, endpoint: str) -> bytes:
+    """What the app did until now: /history stringified ids and timestamps in a loop first."""
+    if endpoint == "history":
+        payload = {"results": [dict(r) for r in payload["results"]]}
+        for r in payload["results"]:
+            r["_id"] = str(r["_id"])
+            r["timestamp"] = r["timestamp"].isoformat()
+    content = jsonable_encoder(payload)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def after(payload: dict, endpoint: str) -> bytes:
+    # /history returns an ORJSONResponse itself; the others still pass through jsonable_encoder
+    return dumps(payload if endpoint == "history" else jsonable_encoder(payload))
+
+
+def per_call_us(fn: Callable[[], object], number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def measure(endpoint: str, payload: dict, number: int) -> dict:
+    old_body, new_body = before(copy.deepcopy(payload), endpoint), after(payload, endpoint)
+    if json.loads(old_body) != json.loads(new_body):
+        raise SystemExit(f"{endpoint}: orjson output differs from the previous serializer")
+    result = {
+        "before_us": per_call_us(lambda: before(payload, endpoint), number),
+        "after_us": per_call_us(lambda: after(payload, endpoint), number),
+        "bytes": {"identity": (len(new_body), 0.0)},
+    }
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    for encoding in encodings:
+        size = len(compress(new_body, encoding))
+        result["bytes"][encoding] = (size, per_call_us(lambda: compress(new_body, encoding), max(number // 10, 1)))
+    return result
+
+
+def print_report(results: Dict[str, dict]) -> None:
+    encodings = list(next(iter(results.values()))["bytes"])
+    header = f"{'endpoint':<16}{'before us':>11}{'orjson us':>11}{'speedup':>9}" + "".join(
+        f"{e + ' bytes':>17}" + (f"{e + ' us':>12}" if e != "identity" else "") for e in encodings
+    )
+    print(header)
+    print("-" * len(header))
+    for endpoint, r in results.items():
+        line = f"{endpoint:<16}{r['before_us']:>11.1f}{r['after_us']:>11.1f}{r['before_us'] / r['after_us']:>8.1f}x"
+        for encoding in encodings:
+            size, us = r["bytes"][encoding]
+            line += f"{size:>17}" + (f"{us:>12.1f}" if encoding != "identity" else "")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default=",".join(PAYLOADS), help=f"comma-separated: {', '.join(PAYLOADS)}")
+    parser.add_argument("--number", type=int, default=100, help="calls per timing repeat")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {}
+    for endpoint in args.endpoints.split(","):
+        if endpoint not in PAYLOADS:
+            parser.error(f"unknown endpoint {endpoint}")
+        print(f"Measuring {endpoint}...", file=sys.stderr)
+        results[endpoint] = measure(endpoint, PAYLOADS[endpoint](random.Random(args.seed)), args.number)
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Run the backend against local stand-ins, with an event-loop lag probe.
+
+    python -m benchmarks.serve_app --port 8000 --anthropic-url http://127.0.0.1:8100
+
+History goes to a temporary SQLite file (or, with HISTORY_BACKEND=mongo, to an in-memory
+Mongo stand-in) and upstream calls go to the mock messages server, so nothing leaves the
+machine. GET /__bench/loop-lag reports (and with ?reset=true clears) how late the event
+loop ran a 10 ms timer.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+
+LOOP_PROBE_INTERVAL = 0.01
+
+
+class LoopLagProbe:
+    def __init__(self, interval: float = LOOP_PROBE_INTERVAL, window: int = 100000):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+
+    async def run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - expected))
+
+    def report(self, reset: bool = False) -> dict:
+        ordered = sorted(self.samples)
+        if reset:
+            self.samples.clear()
+        if not ordered:
+            return {"samples": 0}
+
+        def pct(q):
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+        return {"samples": len(ordered), "p50_ms": pct(0.5), "p95_ms": pct(0.95), "p99_ms": pct(0.99), "max_ms": round(ordered[-1] * 1000, 2)}
+
+
+def install_standins(anthropic_url: str) -> None:
+    """Must run before the backend modules are imported."""
+    os.environ["ANTHROPIC_BASE_URL"] = anthropic_url
+    os.environ.setdefault("ANTHROPIC_API_KEY", "bench-key")
+    state_dir = tempfile.mkdtemp(prefix="shadowai-bench-")
+    os.environ.setdefault("JOBS_DB_PATH", os.path.join(state_dir, "jobs.db"))
+    os.environ.setdefault("SCENARIO_LIBRARY_PATH", os.path.join(state_dir, "scenario_library.json"))
+    os.environ.setdefault("SHARED_STATE_PATH", os.path.join(state_dir, "shared_state.db"))
+    os.environ.setdefault("HISTORY_DB_PATH", os.path.join(state_dir, "history.db"))
+
+    import pymongo
+    from benchmarks.mongo_standin import StandInClient
+    pymongo.MongoClient = StandInClient
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--anthropic-url", default="http://127.0.0.1:8100")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    install_standins(args.anthropic_url)
+
+    import uvicorn
+    from main import app
+
+    probe = LoopLagProbe()
+
+    @app.on_event("startup")
+    async def start_probe():
+        app.state.loop_probe = asyncio.get_running_loop().create_task(probe.run())
+
+    @app.get("/__bench/loop-lag")
+    def loop_lag(reset: bool = False):
+        return probe.report(reset)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+import ast
+import io
+import re
+import tokenize
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+# Units smaller than this are merged with their neighbours so a file made of many
+# tiny helpers does not turn into hundreds of upstream calls.
+MIN_UNIT_LINES = 40
+MAX_UNIT_LINES = 200
+
+HEADER_PATTERN = re.compile(
+    r"^\s*(import\s|from\s+\S+\s+import\s|#include\b|#import\b|using\s|package\s|require\s*\(|"
+    r"const\s+\w+\s*=\s*require\(|use\s|extern\s+crate\s|@file|'use strict'|\"use strict\")"
+)
+
+
+@dataclass
+class CodeUnit:
+    name: str
+    kind: str
+    source: str
+    start_line: int
+    end_line: int
+    signatures: List[str] = field(default_factory=list)
+
+    @property
+    def line_count(self) -> int:
+        return self.end_line - self.start_line + 1
+
+
+@dataclass
+class SplitResult:
+    language: str
+    header: str
+    units: List[CodeUnit]
+
+    @property
+    def signatures(self) -> List[str]:
+        return [sig for unit in self.units for sig in unit.signatures]
+
+
+def detect_language(code: str) -> str:
+    """Best-effort guess: valid Python parses, anything brace-heavy is C-like."""
+    try:
+        ast.parse(code)
+        return "python"
+    except (SyntaxError, ValueError):
+        pass
+    if code.count("{") >= 2 and code.count("{") >= code.count("\n") // 40:
+        return "brace"
+    return "indent"
+
+
+def _python_signature(lines: List[str], node) -> str:
+    """The def/class header up to its colon, from the AST: never any of the body, never comments."""
+    first = node.body[0]
+    # Through the line the body starts on, cut where it starts (col_offset counts UTF-8 bytes)
+    header = lines[node.lineno - 1:first.lineno]
+    header[-1] = header[-1].encode("utf-8")[:first.col_offset].decode("utf-8", "ignore")
+    try:
+        for token in tokenize.generate_tokens(io.StringIO("\n".join(header) + "\n").readline):
+            if token.type == tokenize.COMMENT:
+                row, col = token.start
+                header[row - 1] = header[row - 1][:col]
+    except (tokenize.TokenError, IndentationError):
+        pass
+    return " ".join(" ".join(line.split()) for line in header if line.strip())
+
+
+def split_python(code: str) -> SplitResult:
+    tree = ast.parse(code)
+    lines = code.splitlines()
+    header_end = 0
+    body = list(tree.body)
+
+    # Leading docstring, imports and __future__ flags form the shared header.
+    while body:
+        node = body[0]
+        is_docstring = (
+            isinstance(node, ast.Expr)
+            and isinstance(getattr(node, "value", None), ast.Constant)
+            and isinstance(node.value.value, str)
+        )
+        if isinstance(node, (ast.Import, ast.ImportFrom)) or is_docstring:
+            header_end = node.end_lineno
+            body.pop(0)
+        else:
+            break
+
+    units = []
+    cursor = header_end
+    for index, node in enumerate(body):
+        start = node.lineno
+        decorators = getattr(node, "decorator_list", [])
+        if decorators:
+            start = min(d.lineno for d in decorators)
+        # Attach blank lines and comments preceding the node to the node itself.
+        start = min(start, cursor + 1)
+        end = node.end_lineno
+        if index == len(body) - 1:
+            end = len(lines)
+
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            kind, name = "function", node.name
+            signatures = [_python_signature(lines, node)]
+        elif isinstance(node, ast.ClassDef):
+            kind, name = "class", node.name
+            signatures = [_python_signature(lines, node)]
+            for child in node.body:
+                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    signatures.append("    " + _python_signature(lines, child))
+        else:
+            kind, name, signatures = "module", f"statements@{start}", []
+
+        units.append(CodeUnit(
+            name=name,
+            kind=kind,
+            source="\n".join(lines[start - 1:end]),
+            start_line=start,
+            end_line=end,
+            signatures=signatures,
+        ))
+        cursor = end
+
+    if not body and header_end < len(lines):
+        units.append(CodeUnit("statements", "module", "\n".join(lines[header_end:]), header_end + 1, len(lines)))
+
+    return SplitResult("python", "\n".join(lines[:header_end]), units)
+
+
+def _strip_strings_and_comments(line: str) -> str:
+    line = re.sub(r'"(?:\\.|[^"\\])*"', '""', line)
+    line = re.sub(r"'(?:\\.|[^'\\])*'", "''", line)
+    line = re.sub(r"`(?:\\.|[^`\\])*`", "``", line)
+    return line.split("//", 1)[0]
+
+
+def _header_split(lines: List[str]) -> int:
+    header_end = 0
+    for i, line in enumerate(lines):
+        if not line.strip() or HEADER_PATTERN.match(line) or line.strip().startswith(("//", "#", "/*", "*")):
+            if line.strip():
+                header_end = i + 1
+            continue
+        break
+    return header_end
+
+
+def _unit_name(first_line: str, fallback: str) -> str:
+    match = re.search(r"(?:function|class|def|fn|func|interface|struct|enum|impl|module)\s+([A-Za-z_$][\w$]*)", first_line)
+    if match:
+        return match.group(1)
+    match = re.search(r"([A-Za-z_$][\w$]*)\s*(?:=\s*(?:async\s*)?\(|\()", first_line)
+    return match.group(1) if match else fallback
+
+
+def split_brace(code: str) -> SplitResult:
+    """Split C-like source at lines where the brace depth returns to zero."""
+    lines = code.splitlines()
+    header_end = _header_split(lines)
+    units = []
+    depth = 0
+    in_block_comment = False
+    unit_start = header_end
+    opened = False
+
+    for i in range(header_end, len(lines)):
+        line = lines[i]
+        scan = line
+        if in_block_comment:
+            if "*/" not in scan:
+                continue
+            scan = scan.split("*/", 1)[1]
+            in_block_comment = False
+        scan = _strip_strings_and_comments(scan)
+        if "/*" in scan and "*/" not in scan.split("/*", 1)[1]:
+            in_block_comment = True
+            scan = scan.split("/*", 1)[0]
+        depth += scan.count("{") - scan.count("}")
+        opened = opened or "{" in scan
+        statement_done = depth <= 0 and opened and scan.rstrip().endswith(("}", "};", "});", ")", ";"))
+        if statement_done:
+            depth = 0
+            units.append(_make_unit(lines, unit_start, i))
+            unit_start = i + 1
+            opened = False
+
+    if unit_start < len(lines) and any(l.strip() for l in lines[unit_start:]):
+        units.append(_make_unit(lines, unit_start, len(lines) - 1))
+
+    return SplitResult("brace", "\n".join(lines[:header_end]), units)
+
+
+def split_indent(code: str) -> SplitResult:
+    """Split source at every non-indented line that follows an indented block."""
+    lines = code.splitlines()
+    header_end = _header_split(lines)
+    units = []
+    unit_start = header_end
+    seen_indented = False
+
+    for i in range(header_end, len(lines)):
+        line = lines[i]
+        if not line.strip():
+            continue
+        if line[0] in " \t":
+            seen_indented = True
+        elif seen_indented and i > unit_start:
+            units.append(_make_unit(lines, unit_start, i - 1))
+            unit_start = i
+            seen_indented = False
+
+    if unit_start < len(lines):
+        units.append(_make_unit(lines, unit_start, len(lines) - 1))
+
+    return SplitResult("indent", "\n".join(lines[:header_end]), units)
+
+
+def _make_unit(lines: List[str], start: int, end: int) -> CodeUnit:
+    first = next((l for l in lines[start:end + 1] if l.strip() and not l.strip().startswith(("//", "#", "/*", "*"))), "")
+    name = _unit_name(first, f"block@{start + 1}")
+    return CodeUnit(
+        name=name,
+        kind="block",
+        source="\n".join(lines[start:end + 1]),
+        start_line=start + 1,
+        end_line=end + 1,
+        signatures=[first.split("{")[0].strip()] if first else [],
+    )
+
+
+def merge_small_units(units: List[CodeUnit], min_lines: int = MIN_UNIT_LINES, max_lines: int = MAX_UNIT_LINES) -> List[CodeUnit]:
+    """Greedily merge adjacent small units, never growing a unit past max_lines."""
+    merged: List[CodeUnit] = []
+    for unit in units:
+        previous = merged[-1] if merged else None
+        if (
+            previous is not None
+            and (previous.line_count < min_lines or unit.line_count < min_lines)
+            and previous.line_count + unit.line_count <= max_lines
+        ):
+            merged[-1] = CodeUnit(
+                name=f"{previous.name.split('..')[0]}..{unit.name}",
+                kind="group" if previous.kind != unit.kind or previous.kind == "group" else previous.kind,
+                source=previous.source + "\n" + unit.source,
+                start_line=previous.start_line,
+                end_line=unit.end_line,
+                signatures=previous.signatures + unit.signatures,
+            )
+        else:
+            merged.append(unit)
+    return merged
+
+
+def merge_module_statements(units: List[CodeUnit]) -> List[CodeUnit]:
+    """Merge runs of loose top-level statements but keep every function and class on its own."""
+    merged: List[CodeUnit] = []
+    for unit in units:
+        previous = merged[-1] if merged else None
+        if previous is not None and previous.kind == "module" and unit.kind == "module":
+            merged[-1] = CodeUnit(
+                name=previous.name,
+                kind="module",
+                source=previous.source + "\n" + unit.source,
+                start_line=previous.start_line,
+                end_line=unit.end_line,
+            )
+        else:
+            merged.append(unit)
+    return merged
+
+
+def split_code(code: str, language: Optional[str] = None, merge: bool = True) -> SplitResult:
+    """Split a source file into ordered top-level units plus a shared header.
+
+    With merge=False every function and class stays a separate unit, which is what
+    the incremental refactor cache needs to notice single-function edits.
+    """
+    language = language or detect_language(code)
+    if language == "python":
+        try:
+            result = split_python(code)
+        except SyntaxError:
+            result = split_brace(code) if detect_language(code) == "brace" else split_indent(code)
+    elif language == "brace":
+        result = split_brace(code)
+    else:
+        result = split_indent(code)
+    result.units = merge_small_units(result.units) if merge else merge_module_statements(result.units)
+    return result
+
+
+def reassemble(header: str, sources: List[str]) -> str:
+    parts = [header.rstrip("\n")] if header.strip() else []
+    parts.extend(source.strip("\n") for source in sources)
+    return "\n\n".join(parts) + "\n"
+
+
+CODE_BLOCK_PATTERN = re.compile(r"```[\w+#.-]*\n(.*?)```", re.DOTALL)
+
+
+def extract_code_block(text: str) -> Tuple[str, Optional[str]]:
+    """Return (summary, code) from a reply made of a short summary and one code block."""
+    match = CODE_BLOCK_PATTERN.search(text)
+    if not match:
+        return text.strip(), None
+    summary = (text[:match.start()] + text[match.end():]).strip()
+    return summary, match.group(1).rstrip("\n")
@@ -1,72 +1,48 @@
-from pymongo import MongoClient
-from datetime import datetime
-import os
+from datetime import datetime, timezone
+from time import perf_counter
 import asyncio
 import logging
+from deadline import bounded, remaining
+from admission import admission
+from history_archive import HISTORY_ARCHIVE_DIR, HistoryArchiver, read_archive
+from history_journal import HistoryJournal
+from history_store import FILTER_FIELDS, HISTORY_BACKEND, HistoryConnection, HistoryUnavailable
+from metrics import CACHE_LOOKUP_SECONDS, DB_WRITE_SECONDS
+from rollups import Rollups, request_usage
+from tracing import TRACE_IN_HISTORY, current_trace, span
 from dotenv import load_dotenv
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# You can set MONGODB_URI in your environment, or default to localhost
-MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+# The history store (HISTORY_BACKEND: mongo or sqlite), connected in the background on startup
+store = HistoryConnection(HISTORY_BACKEND)
+# Writes made while the store is down, replayed once it is back
+journal = HistoryJournal()
 
-def get_mongo_client():
-    try:
-        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        # Log connection type
-        if "mongodb+srv" in MONGODB_URI:
-            logger.info("Connecting to MongoDB Atlas.")
-        else:
-            logger.info("Connecting to local MongoDB instance.")
-        # Verify the connection
-        client.admin.command('ping')
-        logger.info("Successfully connected to MongoDB")
-        return client
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB: {e}")
-        raise
-
-# Initialize MongoDB connection
-try:
-    client = get_mongo_client()
-    db = client["shadowai"]
-    history_collection = db["history"]
-    
-    # Create text index if it doesn't exist
-    def ensure_text_index():
-        try:
-            # Check if text index exists
-            existing_indexes = history_collection.list_indexes()
-            has_text_index = any(index.get('name') == 'input_text_metadata.context_text' 
-                               for index in existing_indexes)
-            
-            if not has_text_index:
-                logger.info("Creating text index on history collection...")
-                history_collection.create_index([
-                    ("input", "text"),
-                    ("metadata.context", "text")
-                ], name="input_text_metadata.context_text")
-                logger.info("Text index created successfully")
-        except Exception as e:
-            logger.error(f"Failed to create text index: {e}")
-    
-    ensure_text_index()
-    logger.info("MongoDB collections initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize MongoDB collections: {e}")
-    raise
+async def replay_journal():
+    await asyncio.get_running_loop().run_in_executor(None, journal.replay, store.insert)
 
-async def save_to_history_async(
-    feature: str,
-    user_input: str,
-    claude_prompt: str,
-    claude_response: str,
-    response_time_ms: float = None,
-    metadata: dict = None
-):
+store.on_ready.append(replay_journal)
+
+# Per-minute/hour usage aggregates in the same store, for /history/stats
+rollups = Rollups(store)
+# Moves documents past HISTORY_RETENTION_DAYS into compressed daily segment files
+archiver = HistoryArchiver(store)
+
+def _record_rollup(feature, response_time_ms, metadata) -> None:
+    metadata = metadata or {}
+    usage = request_usage.get() or {}
+    rollups.record(
+        feature,
+        model=metadata.get("model"),
+        mode=metadata.get("mode"),
+        latency_ms=response_time_ms,
+        input_tokens=usage.get("input_tokens", 0),
+        output_tokens=usage.get("output_tokens", 0),
+    )
+
+def _history_doc(feature, user_input, claude_prompt, claude_response, response_time_ms, metadata) -> dict:
     doc = {
         "feature": feature,
         "input": user_input,
@@ -78,21 +54,40 @@ async def save_to_history_async(
         doc["response_time_ms"] = response_time_ms
     if metadata is not None:
         doc["metadata"] = metadata
-    
+    return doc
+
+def _journal(feature: str, doc: dict) -> None:
+    try:
+        journal.append(doc)
+        logger.debug(f"Journaled history for feature: {feature}")
+    except Exception as e:
+        logger.error(f"[History] Also failed to journal history: {e}")
+
+async def save_to_history_async(
+    feature: str,
+    user_input: str,
+    claude_prompt: str,
+    claude_response: str,
+    response_time_ms: float = None,
+    metadata: dict = None
+):
+    doc = _history_doc(feature, user_input, claude_prompt, claude_response, response_time_ms, metadata)
+    if not store.ready:
+        # Don't wait on a store that is down; the journal is replayed once it reconnects
+        _journal(feature, doc)
+        return
     try:
         # Always use async execution
-        await asyncio.get_event_loop().run_in_executor(None, history_collection.insert_one, doc)
-        logger.info(f"Successfully saved history for feature: {feature}")
+        with admission.track("db"), DB_WRITE_SECONDS.time(feature=feature, outcome="error") as labels:
+            await asyncio.get_event_loop().run_in_executor(None, store.insert, doc)
+            labels["outcome"] = "ok"
+        logger.debug(f"Saved history for feature: {feature}")
+    except HistoryUnavailable as e:
+        logger.warning(f"[History] Store unavailable, journaling history: {e}")
+        _journal(feature, doc)
     except Exception as e:
-        logger.error(f"[MongoDB] Failed to log history: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
-        # Write to a local fallback file for debugging
-        try:
-            with open("mongo_history_fallback.log", "a") as f:
-                f.write(f"{datetime.utcnow().isoformat()} | {feature} | {str(e)} | {doc}\n")
-        except Exception as file_e:
-            logger.error(f"[MongoDB] Also failed to write fallback log: {file_e}")
+        logger.exception(f"[History] Failed to log history: {e}")
+        _journal(feature, doc)
 
 async def save_to_history(
     feature: str,
@@ -102,38 +97,50 @@ async def save_to_history(
     response_time_ms: float = None,
     metadata: dict = None
 ):
-    logger.info(f"Attempting to save history for feature: {feature}")
-    doc = {
-        "feature": feature,
-        "input": user_input,
-        "claude_prompt": claude_prompt,
-        "claude_response": claude_response,
-        "timestamp": datetime.utcnow(),
-    }
-    if response_time_ms is not None:
-        doc["response_time_ms"] = response_time_ms
-    if metadata is not None:
-        doc["metadata"] = metadata
-    
+    _record_rollup(feature, response_time_ms, metadata)
+    doc = _history_doc(feature, user_input, claude_prompt, claude_response, response_time_ms, metadata)
+    if not store.ready:
+        _journal(feature, doc)
+        store.require()
     try:
-        logger.info(f"Preparing to insert document into MongoDB: {doc}")
-        # Use run_in_executor to run the blocking MongoDB operation
-        result = await asyncio.get_running_loop().run_in_executor(None, history_collection.insert_one, doc)
-        logger.info(f"Successfully saved history for feature: {feature}, document ID: {result.inserted_id}")
-        return result.inserted_id
+        # The store's calls block, so they run in the default executor
+        with admission.track("db"), DB_WRITE_SECONDS.time(feature=feature, outcome="error") as labels:
+            inserted_id = await asyncio.get_running_loop().run_in_executor(None, store.insert, doc)
+            labels["outcome"] = "ok"
+        logger.debug(f"Saved history for feature: {feature}, document ID: {inserted_id}")
+        return inserted_id
     except Exception as e:
-        logger.error(f"[MongoDB] Failed to log history: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
-        # Write to a local fallback file for debugging
-        try:
-            with open("mongo_history_fallback.log", "a") as f:
-                f.write(f"{datetime.utcnow().isoformat()} | {feature} | {str(e)} | {doc}\n")
-        except Exception as file_e:
-            logger.error(f"[MongoDB] Also failed to write fallback log: {file_e}")
+        logger.exception(f"[History] Failed to log history: {e}")
+        _journal(feature, doc)
         raise  # Re-raise the exception to handle it in the route
 
+# History writes run in the background so responses never wait on Mongo; keep a
+# reference to each task so it is not garbage collected before it finishes
+_pending_writes = set()
+
+def log_history(**kwargs) -> None:
+    """Schedule save_to_history_async without blocking the caller."""
+    _record_rollup(kwargs["feature"], kwargs.get("response_time_ms"), kwargs.get("metadata"))
+    trace = current_trace() if TRACE_IN_HISTORY else None
+    if trace is not None:
+        kwargs["metadata"] = {**(kwargs.get("metadata") or {}), "trace": trace.to_metadata()}
+    task = asyncio.get_running_loop().create_task(save_to_history_async(**kwargs))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+async def flush_history():
+    """Wait for background history writes, e.g. on shutdown."""
+    if _pending_writes:
+        await asyncio.gather(*_pending_writes, return_exceptions=True)
+
 # New: Retrieve history with filters
+def utc_naive(value: datetime = None):
+    """Query datetimes as stored: naive UTC. '...Z' and other offsets are converted."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 def get_history(
     feature: str = None,
     session_id: str = None,
@@ -144,59 +151,64 @@ def get_history(
     end_date: datetime = None,
     limit: int = 50
 ):
-    query = {}
-    if feature:
-        query["feature"] = feature
-    if session_id:
-        query["metadata.session_id"] = session_id
-    if model:
-        query["metadata.model"] = model
-    if mode:
-        query["metadata.mode"] = mode
-    if file_type:
-        query["metadata.file_type"] = file_type
-    if start_date or end_date:
-        query["timestamp"] = {}
-        if start_date:
-            query["timestamp"]["$gte"] = start_date
-        if end_date:
-            query["timestamp"]["$lte"] = end_date
-    return list(history_collection.find(query).sort("timestamp", -1).limit(limit))
-
-
-# Retrieve similar history using MongoDB text search
-async def find_similar_history(feature: str, user_input: str, context: str, score_threshold: float = 2.0):
-    from pymongo import TEXT
+    values = {"feature": feature, "session_id": session_id, "model": model, "mode": mode, "file_type": file_type}
+    filters = {name: value for name, value in values.items() if name in FILTER_FIELDS and value}
+    return store.find(filters, utc_naive(start_date), utc_naive(end_date), limit)
 
-    try:
-        # Ensure text index exists on input and metadata fields (run this manually once in DB):
-        # db.history.create_index([("input", TEXT), ("metadata.context", TEXT)])
 
+def export_history(
+    feature: str = None,
+    session_id: str = None,
+    model: str = None,
+    mode: str = None,
+    file_type: str = None,
+    start_date: datetime = None,
+    end_date: datetime = None,
+    include_archive: bool = True
+):
+    """Every matching document, oldest first: archived segments, then the hot store."""
+    values = {"feature": feature, "session_id": session_id, "model": model, "mode": mode, "file_type": file_type}
+    filters = {name: value for name, value in values.items() if name in FILTER_FIELDS and value}
+    # Checked before the response starts, so a store that is down gets a 503 rather than a cut-off stream
+    store.require()
+    # Archived timestamps are naive UTC; an aware bound would fail mid-stream when compared
+    return _export(filters, utc_naive(start_date), utc_naive(end_date), include_archive)
+
+def _export(filters: dict, start_date: datetime, end_date: datetime, include_archive: bool):
+    if include_archive:
+        yield from read_archive(HISTORY_ARCHIVE_DIR, filters, start_date, end_date)
+    yield from store.scan(filters, start_date, end_date)
+
+
+# Retrieve similar history using the store's text search
+async def find_similar_history(feature: str, user_input: str, context: str, score_threshold: float = None):
+    """A stored response to a similar input, or None. Scores are on the backend's own scale."""
+    if not store.ready:
+        # No cache while the store is down; the request goes straight to the model
+        return None
+    if score_threshold is None:
+        score_threshold = store.similarity_threshold
+    try:
         combined_query = f"{user_input} {context}"
-        logger.info(f"[Cache Lookup] Searching for similar history with query: {combined_query[:100]}...")
-        
-        # Use run_in_executor for MongoDB operations
-        result = await asyncio.get_running_loop().run_in_executor(
-            None,
-            lambda: history_collection.find_one(
-            {
-                "$text": {"$search": combined_query},
-                "feature": feature
-            },
-            sort=[("score", {"$meta": "textScore"})],
-            projection={"claude_response": 1, "input": 1, "score": {"$meta": "textScore"}}
-            )
-        )
-
-        if result and result.get("score", 0) > score_threshold:
-            logger.info(f"[Cache Hit] Found similar query in DB with score {result['score']:.2f}")
-            logger.info(f"[Cache Hit] Original input: {result['input'][:100]}...")
-            return result["claude_response"]
+        logger.debug(f"[Cache Lookup] Searching for similar history with query: {combined_query[:100]}...")
+
+        # A cache lookup is never worth more than the request has left
+        time_left = remaining()
+        start = perf_counter()
+        with admission.track("db"), CACHE_LOOKUP_SECONDS.time(feature=feature, layer=store.name, result="error") as labels, span(f"cache.{store.name}"):
+            match = await bounded(asyncio.get_running_loop().run_in_executor(
+                None, store.find_similar, feature, combined_query, time_left
+            ), stage="cache lookup")
+            labels["result"] = "hit" if match and match[1] > score_threshold else "miss"
+
+        if match and match[1] > score_threshold:
+            rollups.record(feature, latency_ms=(perf_counter() - start) * 1000, cache_hit=True)
+            logger.debug(f"[Cache Hit] Found similar query in DB with score {match[1]:.2f}")
+            return match[0]["claude_response"]
+        if match:
+            logger.debug(f"[Cache Miss] Found result but score {match[1]:.2f} below threshold {score_threshold}")
         else:
-            if result:
-                logger.info(f"[Cache Miss] Found result but score {result.get('score', 0):.2f} below threshold {score_threshold}")
-            else:
-                logger.info("[Cache Miss] No similar history found in database")
+            logger.debug("[Cache Miss] No similar history found in database")
     except Exception as e:
         logger.warning(f"[Cache Lookup] Failed to search similar history: {e}")
 
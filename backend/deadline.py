@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from typing import Awaitable, Optional
+
+from metrics import REQUEST_CANCELLATIONS, feature_from_path
+
+logger = logging.getLogger(__name__)
+
+# Clients (the Next.js proxy) send their own timeout so the backend stops when they do
+REQUEST_TIMEOUT_HEADER = "x-request-timeout"
+# Applied when a request carries no header; 0 disables the server-side default
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("DEFAULT_REQUEST_TIMEOUT", "0"))
+MAX_REQUEST_TIMEOUT = float(os.getenv("MAX_REQUEST_TIMEOUT", "300"))
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left before the current request's deadline, or default if it has none."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    left = deadline - time.monotonic()
+    return max(left, 0.0) if default is None else max(min(left, default), 0.0)
+
+
+def check(stage: str = "") -> None:
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded{f' during {stage}' if stage else ''}")
+
+
+async def bounded(awaitable: Awaitable, stage: str = "", default: Optional[float] = None):
+    """Await something, but no longer than the request deadline allows."""
+    timeout = remaining(default)
+    if timeout is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout=timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Request deadline exceeded{f' during {stage}' if stage else ''}")
+
+
+class DeadlineMiddleware:
+    """Pure ASGI middleware: request deadlines plus cancellation on client disconnect.
+
+    The request's receive channel is pumped through a queue so the middleware can see
+    `http.disconnect` while the endpoint is still working; at that point (or when the
+    deadline passes) the endpoint task is cancelled, which in turn cancels pending OCR
+    frames, DB waits and upstream HTTP requests. Once the last body chunk has gone out
+    there is nothing left to cut short, and the endpoint (background tasks included)
+    runs to completion.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timeout = DEFAULT_REQUEST_TIMEOUT or None
+        for name, value in scope.get("headers", []):
+            if name.decode("latin-1").lower() == REQUEST_TIMEOUT_HEADER:
+                try:
+                    timeout = min(float(value.decode("latin-1")), MAX_REQUEST_TIMEOUT)
+                except ValueError:
+                    pass
+        token = _deadline.set(time.monotonic() + timeout if timeout else None)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        disconnected = asyncio.Event()
+        response_started = False
+        response_complete = False
+
+        async def pump():
+            while True:
+                message = await receive()
+                await queue.put(message)
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        async def tracking_send(message):
+            nonlocal response_started, response_complete
+            if message["type"] == "http.response.start":
+                response_started = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Set before sending: the server may report the disconnect as soon as it has it
+                response_complete = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, queue.get, tracking_send))
+        pump_task = asyncio.ensure_future(pump())
+        disconnect_task = asyncio.ensure_future(disconnected.wait())
+        try:
+            done, _ = await asyncio.wait({app_task, disconnect_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if app_task in done:
+                app_task.result()
+                return
+            if response_complete:
+                # The client has the whole response: a disconnect or the deadline now cuts nothing short
+                await app_task
+                return
+
+            feature = feature_from_path(scope.get("path", ""))
+            reason = "client_disconnect" if disconnect_task in done else "deadline"
+            REQUEST_CANCELLATIONS.inc(feature=feature, reason=reason)
+            logger.info(f"[Deadline] Cancelling {scope.get('path')} ({reason})")
+            app_task.cancel()
+            try:
+                await app_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            if reason == "deadline" and not response_started:
+                await send({
+                    "type": "http.response.start",
+                    "status": 504,
+                    "headers": [(b"content-type", b"application/json")],
+                })
+                await send({"type": "http.response.body", "body": b'{"error": "Request deadline exceeded"}'})
+        finally:
+            pump_task.cancel()
+            disconnect_task.cancel()
+            _deadline.reset(token)
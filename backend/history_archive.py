@@ -0,0 +1,154 @@
+"""Retention for history: documents older than HISTORY_RETENTION_DAYS leave the hot store.
+
+The archiver moves them, oldest first, into one append-only segment per UTC day:
+HISTORY_ARCHIVE_DIR/YYYY/MM/history-YYYY-MM-DD.jsonl.gz. Each batch is appended as a new
+gzip member (a valid continuation of the same gzip stream) and synced before the batch
+is deleted from the hot store, so a crash can duplicate a document in a segment but never
+lose one; readers drop the duplicates. One worker at a time archives (a shared-state lock).
+Segments are read back by /history/export.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from logging_setup import fields
+from shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+# Days documents stay in the hot store (0 keeps everything)
+HISTORY_RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "30"))
+# Archive expired documents to segment files; with false they are only deleted
+HISTORY_ARCHIVE = os.getenv("HISTORY_ARCHIVE", "true").lower() == "true"
+HISTORY_ARCHIVE_DIR = os.getenv(
+    "HISTORY_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history_archive")
+)
+HISTORY_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("HISTORY_ARCHIVE_INTERVAL_SECONDS", "3600"))
+HISTORY_ARCHIVE_BATCH = int(os.getenv("HISTORY_ARCHIVE_BATCH", "1000"))
+
+_SEGMENT = re.compile(r"history-(\d{4}-\d{2}-\d{2})\.jsonl\.gz$")
+
+
+def segment_path(directory: str, day: date) -> str:
+    return os.path.join(directory, f"{day:%Y}", f"{day:%m}", f"history-{day.isoformat()}.jsonl.gz")
+
+
+def segments(directory: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[str]:
+    """Segment files whose day overlaps [start, end], oldest first."""
+    found = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            match = _SEGMENT.match(name)
+            if not match:
+                continue
+            day = date.fromisoformat(match.group(1))
+            if (start and day < start.date()) or (end and day > end.date()):
+                continue
+            found.append((day, os.path.join(root, name)))
+    return [path for _, path in sorted(found)]
+
+
+def _encode(doc: dict) -> str:
+    return json.dumps({**doc, "_id": str(doc["_id"]), "timestamp": doc["timestamp"].isoformat()}, default=str)
+
+
+def append_segment(path: str, docs: List[dict]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = gzip.compress("".join(_encode(doc) + "\n" for doc in docs).encode("utf-8"))
+    with open(path, "ab") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_archive(directory: str, filters: dict, start: Optional[datetime], end: Optional[datetime]) -> Iterator[dict]:
+    """Archived documents matching get_history-style filters, oldest segment first."""
+    for path in segments(directory, start, end):
+        seen = set()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                doc = json.loads(line)
+                if doc["_id"] in seen:
+                    continue
+                seen.add(doc["_id"])
+                doc["timestamp"] = datetime.fromisoformat(doc["timestamp"])
+                if (start and doc["timestamp"] < start) or (end and doc["timestamp"] > end):
+                    continue
+                metadata = doc.get("metadata") or {}
+                if all((doc.get(name) if name == "feature" else metadata.get(name)) == value for name, value in filters.items()):
+                    yield doc
+
+
+class HistoryArchiver:
+    """Moves expired documents out of the hot store on a timer."""
+
+    LOCK_TTL = 600
+
+    def __init__(self, store, directory: str = HISTORY_ARCHIVE_DIR, retention_days: float = HISTORY_RETENTION_DAYS,
+                 archive: bool = HISTORY_ARCHIVE, state=None):
+        self.store = store
+        self.state = state or shared_state
+        self.directory = directory
+        self.retention_days = retention_days
+        self.archive = archive
+        self.archived = 0
+        self.last_run: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def run_once(self, batch_size: int = HISTORY_ARCHIVE_BATCH) -> int:
+        """Archive (or delete) every expired document; returns how many left the hot store."""
+        if self.retention_days <= 0 or not self.store.ready:
+            return 0
+        owner = f"{os.getpid()}:{id(self)}"
+        if not self.state.acquire("history-archive", owner, self.LOCK_TTL):
+            return 0
+        try:
+            return self._archive(batch_size)
+        finally:
+            self.state.release("history-archive", owner)
+
+    def _archive(self, batch_size: int) -> int:
+        cutoff = datetime.utcnow() - timedelta(days=self.retention_days)
+        moved = 0
+        while True:
+            docs = self.store.expired(cutoff, batch_size)
+            if not docs:
+                break
+            if self.archive:
+                by_day: Dict[date, List[dict]] = {}
+                for doc in docs:
+                    by_day.setdefault(doc["timestamp"].date(), []).append(doc)
+                for day, day_docs in by_day.items():
+                    append_segment(segment_path(self.directory, day), day_docs)
+            self.store.delete(docs)
+            moved += len(docs)
+        self.archived += moved
+        self.last_run = datetime.utcnow().isoformat() + "Z"
+        if moved:
+            logger.info("history archived", extra=fields(documents=moved, cutoff=cutoff.isoformat(), archive=self.archive))
+        return moved
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.run_once)
+            except Exception as e:
+                logger.error("history archiving failed", extra=fields(error=str(e)))
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = HISTORY_ARCHIVE_INTERVAL_SECONDS) -> None:
+        if self.retention_days > 0 and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(interval))
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"retention_days": self.retention_days, "archive": self.archive, "archived": self.archived, "last_run": self.last_run}
@@ -0,0 +1,111 @@
+"""Compact history documents: prompts stored as template references, large text compressed.
+
+A compact document has "v": 2 and a "prompt" field instead of "claude_prompt". The prompt
+is a JSON reference, itself compressed when large:
+
+    {"t": template id, "p": params, "i": param taken from the input}   rendered again on read
+    {"input": true}                                                     the prompt was the input
+    {"text": prompt}                                                    anything else, verbatim
+
+Text of HISTORY_COMPRESS_MIN_BYTES or more is stored zlib-compressed (bytes) when that is
+smaller. Documents written before this format have no "v" and are read as they are.
+"""
+import json
+import os
+import zlib
+from typing import Iterable, Optional, Union
+
+from prompt_templates import TEMPLATES, RenderedPrompt, infer_prompt, render
+
+HISTORY_COMPRESS_MIN_BYTES = int(os.getenv("HISTORY_COMPRESS_MIN_BYTES", "512"))
+COMPACT_VERSION = 2
+PACKED_FIELDS = ("input", "claude_response")
+
+
+def pack_text(text: Optional[str]) -> Union[str, bytes, None]:
+    if not isinstance(text, str):
+        return text
+    raw = text.encode("utf-8")
+    if len(raw) < HISTORY_COMPRESS_MIN_BYTES:
+        return text
+    compressed = zlib.compress(raw, 6)
+    return compressed if len(compressed) < len(raw) else text
+
+
+def unpack_text(value: Union[str, bytes, None]) -> Optional[str]:
+    if isinstance(value, (bytes, bytearray)):
+        return zlib.decompress(value).decode("utf-8")
+    return value
+
+
+def prompt_ref(prompt: Optional[str], user_input: Optional[str]) -> dict:
+    if prompt and prompt == user_input:
+        return {"input": True}
+    if isinstance(prompt, RenderedPrompt) and prompt.template in TEMPLATES:
+        ref = {"t": prompt.template, "p": dict(prompt.params)}
+        # The refactor prompts embed the whole input; keep one copy
+        for name, value in prompt.params.items():
+            if isinstance(value, str) and value and value == user_input:
+                ref["i"] = name
+                del ref["p"][name]
+                break
+        return ref
+    return {"text": prompt}
+
+
+def render_ref(ref: dict, user_input: Optional[str]) -> Optional[str]:
+    if ref.get("input"):
+        return user_input
+    if "t" in ref:
+        params = dict(ref["p"])
+        if "i" in ref:
+            params[ref["i"]] = user_input
+        return str(render(ref["t"], **params))
+    return ref.get("text")
+
+
+def compact(doc: dict, packed_fields: Iterable[str] = PACKED_FIELDS) -> dict:
+    """The stored form of a history document (as built by db._history_doc)."""
+    doc = dict(doc)
+    ref = prompt_ref(doc.pop("claude_prompt", None), doc.get("input"))
+    doc["prompt"] = pack_text(json.dumps(ref, separators=(",", ":")))
+    for name in packed_fields:
+        doc[name] = pack_text(doc.get(name))
+    doc["v"] = COMPACT_VERSION
+    return doc
+
+
+def expand(doc: dict) -> dict:
+    """The document as routes and /history expect it, whichever format it was stored in."""
+    doc = dict(doc)
+    for name in PACKED_FIELDS:
+        if name in doc:
+            doc[name] = unpack_text(doc[name])
+    if "prompt" in doc:
+        doc["claude_prompt"] = render_ref(json.loads(unpack_text(doc.pop("prompt"))), doc.get("input"))
+    doc.pop("v", None)
+    return doc
+
+
+def upgrade(doc: dict) -> dict:
+    """A legacy (expanded) document with its prompt re-attached to the template that renders it."""
+    rendered = infer_prompt(doc)
+    if rendered is None:
+        return doc
+    doc = {**doc, "claude_prompt": rendered}
+    # ask-qa used to store the whole prompt as the input; new documents store the question
+    if doc["feature"] == "ask-qa" and doc.get("input") == str(rendered):
+        doc["input"] = rendered.params["question"]
+    return doc
+
+
+def stored_bytes(doc: dict) -> int:
+    """Size of a document's text payload as stored, for migration reports."""
+    total = 0
+    for name in ("input", "claude_prompt", "prompt", "claude_response"):
+        value = doc.get(name)
+        if isinstance(value, str):
+            total += len(value.encode("utf-8"))
+        elif isinstance(value, (bytes, bytearray)):
+            total += len(value)
+    return total
@@ -0,0 +1,152 @@
+"""History writes made while the store is unavailable, replayed once it is back.
+
+Each worker appends JSON lines to its own file in HISTORY_JOURNAL_DIR. A replaying worker
+claims a file by renaming it (so two workers never replay the same one), inserts its
+documents in order and deletes it. If the store goes away again, whatever was not inserted
+is journaled again; a document the store rejects is set aside in the dead-letter file.
+"""
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Callable, List
+
+from history_store import HistoryUnavailable
+from logging_setup import fields
+from prompt_templates import TEMPLATES, RenderedPrompt, render
+
+logger = logging.getLogger(__name__)
+
+HISTORY_JOURNAL_DIR = os.getenv(
+    "HISTORY_JOURNAL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history_journal")
+)
+
+_CLAIMED = re.compile(r"\.replaying-(\d+)$")
+# Documents that failed on their own (bad data, not a store outage); never replayed
+DEAD_LETTER = "dead-letter.jsonl"
+# Failures that mean the store is gone again, so the rest of the replay waits for the next one
+UNAVAILABLE = (HistoryUnavailable, ConnectionError)
+
+
+def _encode(doc: dict) -> str:
+    entry = {**doc, "timestamp": doc["timestamp"].isoformat()}
+    prompt = doc.get("claude_prompt")
+    if isinstance(prompt, RenderedPrompt):
+        # Keep the template reference so the replayed document stays compact
+        entry["claude_prompt"] = {"t": prompt.template, "p": prompt.params}
+    return json.dumps(entry, default=str)
+
+
+def _decode(line: str) -> dict:
+    doc = json.loads(line)
+    doc["timestamp"] = datetime.fromisoformat(doc["timestamp"])
+    prompt = doc.get("claude_prompt")
+    if isinstance(prompt, dict) and prompt.get("t") in TEMPLATES:
+        doc["claude_prompt"] = render(prompt["t"], **prompt["p"])
+    return doc
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class HistoryJournal:
+    def __init__(self, directory: str = HISTORY_JOURNAL_DIR):
+        self.directory = directory
+        self.journaled = 0
+        self.replayed = 0
+        self.dead_lettered = 0
+        self._lock = threading.Lock()
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"journal-{os.getpid()}.jsonl")
+
+    def append(self, doc: dict) -> None:
+        line = _encode(doc) + "\n"
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(), "a", encoding="utf-8") as f:
+                f.write(line)
+            self.journaled += 1
+
+    def _claim(self) -> List[str]:
+        claimed = []
+        if not os.path.isdir(self.directory):
+            return claimed
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            match = _CLAIMED.search(name)
+            if match and _alive(int(match.group(1))):
+                continue
+            if not match and (not name.endswith(".jsonl") or name == DEAD_LETTER):
+                continue
+            # Files left claimed by a worker that died mid-replay are taken over too
+            target = f"{_CLAIMED.sub('', path)}.replaying-{os.getpid()}"
+            try:
+                if path == self._path():
+                    # An append holding the lock finishes before the rename; later ones start a new file
+                    with self._lock:
+                        os.rename(path, target)
+                else:
+                    os.rename(path, target)
+            except FileNotFoundError:
+                continue  # another worker claimed it first
+            claimed.append(target)
+        return claimed
+
+    def _dead_letter(self, line: str, error: Exception) -> None:
+        entry = json.dumps({"error": str(error), "at": datetime.utcnow().isoformat(), "line": line.rstrip("\n")})
+        with self._lock:
+            with open(os.path.join(self.directory, DEAD_LETTER), "a", encoding="utf-8") as f:
+                f.write(entry + "\n")
+            self.dead_lettered += 1
+
+    def replay(self, insert: Callable[[dict], object]) -> int:
+        """Insert every journaled document with `insert`; returns how many went in."""
+        replayed = 0
+        dead = 0
+        claimed = self._claim()
+        for position, path in enumerate(claimed):
+            with open(path, encoding="utf-8") as f:
+                lines = [line for line in f if line.strip()]
+            for index, line in enumerate(lines):
+                try:
+                    insert(_decode(line))
+                except UNAVAILABLE as e:
+                    # Keep the rest for the next replay, in order, including the claimed files not
+                    # reached yet: left claimed by a live worker, nobody would ever replay them
+                    remaining = lines[index:]
+                    for later in claimed[position + 1:]:
+                        with open(later, encoding="utf-8") as f:
+                            remaining.extend(line for line in f if line.strip())
+                    with self._lock:
+                        with open(self._path(), "a", encoding="utf-8") as f:
+                            f.writelines(remaining)
+                    for done in claimed[position:]:
+                        os.remove(done)
+                    logger.warning("history journal replay stopped", extra=fields(remaining=len(remaining), error=str(e)))
+                    self.replayed += replayed
+                    return replayed
+                except Exception as e:
+                    # One bad document must not hold back the ones after it
+                    self._dead_letter(line, e)
+                    dead += 1
+                    logger.error("history journal document dead-lettered", extra=fields(error=str(e)))
+                    continue
+                replayed += 1
+            os.remove(path)
+        self.replayed += replayed
+        if replayed or dead:
+            logger.info("history journal replayed", extra=fields(documents=replayed, dead_lettered=dead))
+        return replayed
+
+    def stats(self) -> dict:
+        return {"journaled": self.journaled, "replayed": self.replayed, "dead_lettered": self.dead_lettered}
@@ -0,0 +1,708 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple
+
+from history_archive import HISTORY_ARCHIVE, HISTORY_RETENTION_DAYS
+from history_codec import PACKED_FIELDS, compact, expand, stored_bytes, unpack_text, upgrade
+from logging_setup import fields
+from resilience import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# Where history lives: "mongo" (MONGODB_URI) or "sqlite" (an embedded file, no server needed).
+# SQLite is opt-in, so an install never moves its history off Mongo without saying so.
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "mongo").lower()
+HISTORY_BACKENDS = ("mongo", "sqlite")
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.db"))
+# Backoff between attempts to (re)connect the history store
+HISTORY_RECONNECT_BASE = float(os.getenv("HISTORY_RECONNECT_BASE", "0.5"))
+HISTORY_RECONNECT_MAX = float(os.getenv("HISTORY_RECONNECT_MAX", "30"))
+# Retry-After, in seconds, on 503s for requests that need the store while it is down
+HISTORY_RETRY_AFTER = 5
+# Share of the query's terms a stored input must contain to count as similar (sqlite backend)
+HISTORY_SIMILARITY_THRESHOLD = float(os.getenv("HISTORY_SIMILARITY_THRESHOLD", "0.8"))
+# FTS candidates re-scored per lookup, and distinct query terms sent to FTS
+SIMILARITY_CANDIDATES = 5
+MAX_QUERY_TERMS = 64
+
+# Filters get_history accepts, and where each lives in a Mongo document
+FILTER_FIELDS = {
+    "feature": "feature",
+    "session_id": "metadata.session_id",
+    "model": "metadata.model",
+    "mode": "metadata.mode",
+    "file_type": "metadata.file_type",
+}
+
+# Additive fields of a rollup row (see rollups.py); the latency sketch is stored beside them
+ROLLUP_COUNTERS = ("count", "cache_hits", "latency_count", "latency_ms_sum", "input_tokens", "output_tokens")
+
+_TERM = re.compile(r"\w{3,}")
+
+
+class HistoryUnavailable(Exception):
+    """The history store is not connected (yet, or any more)."""
+
+
+class HistoryStore:
+    """Where history documents are written, listed and searched for similar inputs.
+
+    Constructing a store never blocks; connect() verifies the backend and builds indexes.
+    """
+
+    name = "base"
+    ready = True
+    # Errors meaning the backend itself is gone, rather than one bad operation
+    connection_errors: Tuple[type, ...] = ()
+    # find_similar scores above this count as a cache hit
+    similarity_threshold = 0.0
+    # Text fields stored compressed once large (see history_codec)
+    packed_fields = PACKED_FIELDS
+
+    def connect(self) -> None:
+        """Check the backend is reachable and create indexes; raises if it is not."""
+
+    def insert(self, doc: dict):
+        """Store one document; returns its id."""
+        raise NotImplementedError
+
+    def find(self, filters: dict, start_date: Optional[datetime], end_date: Optional[datetime], limit: int) -> List[dict]:
+        """Newest first; filters maps FILTER_FIELDS keys to required values."""
+        raise NotImplementedError
+
+    def find_similar(self, feature: str, text: str, time_left: Optional[float]) -> Optional[Tuple[dict, float]]:
+        """Best text match for `text` within a feature as (document, score), or None."""
+        raise NotImplementedError
+
+    def scan(self, filters: dict, start_date: Optional[datetime], end_date: Optional[datetime]) -> Iterator[dict]:
+        """Every matching document, oldest first, for exports."""
+        raise NotImplementedError
+
+    def expired(self, before: datetime, limit: int) -> List[dict]:
+        """Up to `limit` documents older than `before`, oldest first."""
+        raise NotImplementedError
+
+    def delete(self, docs: List[dict]) -> None:
+        """Remove documents returned by expired()."""
+        raise NotImplementedError
+
+    def add_rollups(self, rows: List[Tuple[tuple, dict]]) -> None:
+        """Add ((granularity, bucket, feature, model, mode), deltas) into the stored rollups."""
+        raise NotImplementedError
+
+    def find_rollups(self, granularity: str, start: datetime, end: datetime, filters: dict) -> List[dict]:
+        """Rollup rows with start <= bucket < end; filters maps feature/model/mode to values."""
+        raise NotImplementedError
+
+    def prune_rollups(self, granularity: str, before: datetime) -> None:
+        raise NotImplementedError
+
+    def legacy_batches(self, batch_size: int) -> Iterator[List[dict]]:
+        """Documents stored before the compact format, oldest id first."""
+        raise NotImplementedError
+
+    def replace(self, updates: List[Tuple[dict, dict]]) -> None:
+        """Swap (legacy document, compact document) pairs in place."""
+        raise NotImplementedError
+
+    def migrate(self, batch_size: int = 500, dry_run: bool = False) -> dict:
+        """Rewrite legacy documents in the compact format; returns counts and payload sizes."""
+        stats = {"documents": 0, "templated": 0, "bytes_before": 0, "bytes_after": 0}
+        for batch in self.legacy_batches(batch_size):
+            updates = []
+            for doc in batch:
+                upgraded = upgrade(doc)
+                stored = compact(upgraded, self.packed_fields)
+                stats["documents"] += 1
+                stats["templated"] += upgraded is not doc
+                stats["bytes_before"] += stored_bytes(doc)
+                stats["bytes_after"] += stored_bytes(stored)
+                updates.append((doc, stored))
+            if not dry_run:
+                self.replace(updates)
+            logger.info("history migration batch", extra=fields(documents=stats["documents"], dry_run=dry_run))
+        return stats
+
+
+class MongoHistoryStore(HistoryStore):
+    """The history collection in MongoDB, searched with its text index."""
+
+    name = "mongo"
+    similarity_threshold = 2.0
+    # input stays plain: the text index reads it
+    packed_fields = ("claude_response",)
+    TEXT_INDEX = "input_text_metadata.context_text"
+    TTL_INDEX = "history_ttl"
+    # With archiving on, the TTL index is only a backstop for an archiver that stopped running
+    TTL_GRACE_DAYS = 7
+
+    def __init__(self, uri: str = MONGODB_URI):
+        from pymongo import MongoClient
+        from pymongo.errors import ConnectionFailure
+
+        # MongoClient connects in its own background threads; nothing here waits on the server
+        self.uri = uri
+        self.client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+        self.collection = self.client["shadowai"]["history"]
+        self.rollups = self.client["shadowai"]["history_rollups"]
+        self.connection_errors = (ConnectionFailure,)
+
+    def connect(self):
+        # Log connection type
+        if "mongodb+srv" in self.uri:
+            logger.info("Connecting to MongoDB Atlas.")
+        else:
+            logger.info("Connecting to local MongoDB instance.")
+        # Verify the connection
+        self.client.admin.command('ping')
+        logger.info("Successfully connected to MongoDB")
+        self.ensure_text_index()
+        if HISTORY_RETENTION_DAYS > 0:
+            self.ensure_ttl_index(HISTORY_RETENTION_DAYS + (self.TTL_GRACE_DAYS if HISTORY_ARCHIVE else 0))
+        self.rollups.create_index(
+            [("granularity", 1), ("bucket", 1), ("feature", 1), ("model", 1), ("mode", 1)], name="rollup_key", unique=True
+        )
+
+    def ensure_text_index(self) -> None:
+        try:
+            if not any(index.get('name') == self.TEXT_INDEX for index in self.collection.list_indexes()):
+                logger.info("Creating text index on history collection...")
+                self.collection.create_index([("input", "text"), ("metadata.context", "text")], name=self.TEXT_INDEX)
+                logger.info("Text index created successfully")
+        except Exception as e:
+            logger.error(f"Failed to create text index: {e}")
+
+    def ensure_ttl_index(self, days: float) -> None:
+        expire_after = int(days * 86400)
+        try:
+            existing = next((index for index in self.collection.list_indexes() if index.get('name') == self.TTL_INDEX), None)
+            if existing is not None and existing.get("expireAfterSeconds") == expire_after:
+                return
+            if existing is not None:
+                self.collection.drop_index(self.TTL_INDEX)
+            self.collection.create_index([("timestamp", 1)], name=self.TTL_INDEX, expireAfterSeconds=expire_after)
+            logger.info(f"TTL index set: history documents expire after {days:g} days")
+        except Exception as e:
+            logger.error(f"Failed to create TTL index: {e}")
+
+    def insert(self, doc):
+        return self.collection.insert_one(compact(doc, self.packed_fields)).inserted_id
+
+    def find(self, filters, start_date, end_date, limit):
+        query = {FILTER_FIELDS[name]: value for name, value in filters.items()}
+        if start_date or end_date:
+            query["timestamp"] = {}
+            if start_date:
+                query["timestamp"]["$gte"] = start_date
+            if end_date:
+                query["timestamp"]["$lte"] = end_date
+        return [expand(doc) for doc in self.collection.find(query).sort("timestamp", -1).limit(limit)]
+
+    def find_similar(self, feature, text, time_left):
+        # max_time_ms makes the server give up too instead of finishing a scan nobody waits for
+        query_options = {"max_time_ms": max(int(time_left * 1000), 1)} if time_left is not None else {}
+        result = self.collection.find_one(
+            {"$text": {"$search": text}, "feature": feature},
+            sort=[("score", {"$meta": "textScore"})],
+            projection={"claude_response": 1, "input": 1, "score": {"$meta": "textScore"}},
+            **query_options
+        )
+        if not result:
+            return None
+        return expand(result), result.get("score", 0)
+
+    def scan(self, filters, start_date, end_date):
+        query = {FILTER_FIELDS[name]: value for name, value in filters.items()}
+        if start_date or end_date:
+            query["timestamp"] = {}
+            if start_date:
+                query["timestamp"]["$gte"] = start_date
+            if end_date:
+                query["timestamp"]["$lte"] = end_date
+        for doc in self.collection.find(query).sort("timestamp", 1):
+            yield expand(doc)
+
+    def expired(self, before, limit):
+        return [expand(doc) for doc in self.collection.find({"timestamp": {"$lt": before}}).sort("timestamp", 1).limit(limit)]
+
+    def delete(self, docs):
+        self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+
+    def add_rollups(self, rows):
+        for (granularity, bucket, feature, model, mode), row in rows:
+            increments = {name: row[name] for name in ROLLUP_COUNTERS}
+            increments.update({f"sketch.{index}": count for index, count in row["sketch"].items()})
+            self.rollups.update_one(
+                {"granularity": granularity, "bucket": bucket, "feature": feature, "model": model, "mode": mode},
+                {"$inc": increments},
+                upsert=True,
+            )
+
+    def find_rollups(self, granularity, start, end, filters):
+        query = {"granularity": granularity, "bucket": {"$gte": start, "$lt": end}, **filters}
+        return list(self.rollups.find(query))
+
+    def prune_rollups(self, granularity, before):
+        self.rollups.delete_many({"granularity": granularity, "bucket": {"$lt": before}})
+
+    def legacy_batches(self, batch_size):
+        query = {"v": {"$exists": False}}
+        while True:
+            batch = list(self.collection.find(query).sort("_id", 1).limit(batch_size))
+            if not batch:
+                return
+            yield batch
+            query = {"v": {"$exists": False}, "_id": {"$gt": batch[-1]["_id"]}}
+
+    def replace(self, updates):
+        from pymongo import ReplaceOne
+
+        self.collection.bulk_write([ReplaceOne({"_id": old["_id"]}, new) for old, new in updates], ordered=False)
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """An embedded SQLite file in WAL mode: indexed columns for the filters, FTS5 for similarity.
+
+    Each thread gets its own connection so readers never wait on each other or on a writer.
+    """
+
+    name = "sqlite"
+    similarity_threshold = HISTORY_SIMILARITY_THRESHOLD
+
+    connection_errors = (sqlite3.OperationalError,)
+
+    def __init__(self, path: str = HISTORY_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self.has_fts = True
+
+    def connect(self):
+        self._connection().execute("SELECT 1")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # A forked worker must not reuse its parent's connection
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._create_schema(conn)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY,
+                feature TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                input TEXT,
+                claude_prompt TEXT,
+                prompt BLOB,
+                claude_response TEXT,
+                response_time_ms REAL,
+                metadata TEXT,
+                session_id TEXT,
+                model TEXT,
+                mode TEXT,
+                file_type TEXT
+            )"""
+        )
+        # Files created before the compact format have no prompt column
+        if "prompt" not in {row["name"] for row in conn.execute("PRAGMA table_info(history)")}:
+            conn.execute("ALTER TABLE history ADD COLUMN prompt BLOB")
+        # ISO timestamps sort chronologically, so every filter is an index range scan
+        for column in ("feature", "session_id", "model", "mode", "file_type"):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS history_{column}_ts ON history ({column}, timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS history_ts ON history (timestamp)")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS history_rollups (
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                feature TEXT NOT NULL,
+                model TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                cache_hits INTEGER NOT NULL DEFAULT 0,
+                latency_count INTEGER NOT NULL DEFAULT 0,
+                latency_ms_sum REAL NOT NULL DEFAULT 0,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (granularity, bucket, feature, model, mode)
+            ) WITHOUT ROWID"""
+        )
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS history_rollup_sketch (
+                granularity TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                feature TEXT NOT NULL,
+                model TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (granularity, bucket, feature, model, mode, idx)
+            ) WITHOUT ROWID"""
+        )
+        try:
+            conn.execute(
+                """CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+                    input, context, content='', tokenize='porter unicode61'
+                )"""
+            )
+        except sqlite3.OperationalError as e:
+            if self.has_fts:
+                logger.warning("sqlite has no FTS5; similar-history lookups are disabled", extra=fields(error=str(e)))
+            self.has_fts = False
+
+    def insert(self, doc):
+        metadata = doc.get("metadata") or {}
+        stored = compact(doc, self.packed_fields)
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                """INSERT INTO history (feature, timestamp, input, prompt, claude_response, response_time_ms,
+                                        metadata, session_id, model, mode, file_type)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    doc["feature"], doc["timestamp"].isoformat(), stored["input"], stored["prompt"],
+                    stored["claude_response"], doc.get("response_time_ms"),
+                    json.dumps(doc["metadata"], default=str) if "metadata" in doc else None,
+                    *(_text_or_none(metadata.get(name)) for name in ("session_id", "model", "mode", "file_type")),
+                ),
+            )
+            if self.has_fts:
+                conn.execute(
+                    "INSERT INTO history_fts (rowid, input, context) VALUES (?, ?, ?)",
+                    (cursor.lastrowid, doc.get("input") or "", _text_or_none(metadata.get("context")) or ""),
+                )
+        return cursor.lastrowid
+
+    @staticmethod
+    def _where(filters, start_date, end_date) -> Tuple[List[str], list]:
+        clauses, params = [], []
+        for name, value in filters.items():
+            clauses.append(f"{name} = ?")
+            params.append(value)
+        if start_date:
+            clauses.append("timestamp >= ?")
+            params.append(start_date.isoformat())
+        if end_date:
+            clauses.append("timestamp <= ?")
+            params.append(end_date.isoformat())
+        return clauses, params
+
+    def find(self, filters, start_date, end_date, limit):
+        clauses, params = self._where(filters, start_date, end_date)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connection().execute(
+            f"SELECT * FROM history {where} ORDER BY timestamp DESC LIMIT ?", (*params, limit)
+        ).fetchall()
+        return [_row_to_doc(row) for row in rows]
+
+    def scan(self, filters, start_date, end_date, batch_size: int = 500):
+        clauses, params = self._where(filters, start_date, end_date)
+        after = ("", 0)
+        while True:
+            # Keyset pages, each on the calling thread's connection: a streaming export may
+            # resume on a different thread than the one that started it
+            where = " AND ".join(clauses + ["(timestamp, id) > (?, ?)"])
+            rows = self._connection().execute(
+                f"SELECT * FROM history WHERE {where} ORDER BY timestamp, id LIMIT ?", (*params, *after, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield _row_to_doc(row)
+            after = (rows[-1]["timestamp"], rows[-1]["id"])
+
+    def expired(self, before, limit):
+        rows = self._connection().execute(
+            "SELECT * FROM history WHERE timestamp < ? ORDER BY timestamp LIMIT ?", (before.isoformat(), limit)
+        ).fetchall()
+        return [_row_to_doc(row) for row in rows]
+
+    def delete(self, docs):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for doc in docs:
+                conn.execute("DELETE FROM history WHERE id = ?", (doc["_id"],))
+                if self.has_fts:
+                    conn.execute(
+                        "INSERT INTO history_fts (history_fts, rowid, input, context) VALUES ('delete', ?, ?, ?)",
+                        (doc["_id"], doc.get("input") or "", _text_or_none((doc.get("metadata") or {}).get("context")) or ""),
+                    )
+
+    def find_similar(self, feature, text, time_left):
+        if not self.has_fts:
+            return None
+        terms = list(dict.fromkeys(term.lower() for term in _TERM.findall(text)))
+        if not terms:
+            return None
+        match = " OR ".join(f'"{term}"' for term in terms[:MAX_QUERY_TERMS])
+        conn = self._connection()
+        if time_left is not None:
+            # Abort the query, not just stop waiting for it, once the request's deadline passes
+            deadline = time.monotonic() + time_left
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        try:
+            rows = conn.execute(
+                """SELECT h.* FROM history_fts JOIN history h ON h.id = history_fts.rowid
+                   WHERE history_fts MATCH ? AND h.feature = ?
+                   ORDER BY bm25(history_fts) LIMIT ?""",
+                (match, feature, SIMILARITY_CANDIDATES),
+            ).fetchall()
+        finally:
+            if time_left is not None:
+                conn.set_progress_handler(None, 0)
+        # bm25 depends on the corpus, so re-score the best candidates on a fixed scale:
+        # the share of the query's terms each one contains
+        wanted = set(terms)
+        best = None
+        for row in rows:
+            doc = _row_to_doc(row)
+            context = (doc.get("metadata") or {}).get("context") or ""
+            found = {term.lower() for term in _TERM.findall(f"{doc.get('input') or ''} {context}")}
+            score = len(wanted & found) / len(wanted)
+            if best is None or score > best[1]:
+                best = (doc, score)
+        return best
+
+    def add_rollups(self, rows):
+        counters = ", ".join(ROLLUP_COUNTERS)
+        updates = ", ".join(f"{name} = {name} + excluded.{name}" for name in ROLLUP_COUNTERS)
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for (granularity, bucket, feature, model, mode), row in rows:
+                key = (granularity, bucket.isoformat(), feature, model, mode)
+                conn.execute(
+                    f"""INSERT INTO history_rollups (granularity, bucket, feature, model, mode, {counters})
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (granularity, bucket, feature, model, mode) DO UPDATE SET {updates}""",
+                    (*key, *(row[name] for name in ROLLUP_COUNTERS)),
+                )
+                conn.executemany(
+                    """INSERT INTO history_rollup_sketch (granularity, bucket, feature, model, mode, idx, count)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (granularity, bucket, feature, model, mode, idx) DO UPDATE SET count = count + excluded.count""",
+                    [(*key, index, count) for index, count in row["sketch"].items()],
+                )
+
+    def find_rollups(self, granularity, start, end, filters):
+        clauses = ["granularity = ?", "bucket >= ?", "bucket < ?"] + [f"{name} = ?" for name in filters]
+        params = (granularity, start.isoformat(), end.isoformat(), *filters.values())
+        where = " AND ".join(clauses)
+        conn = self._connection()
+        rows = {}
+        for row in conn.execute(f"SELECT * FROM history_rollups WHERE {where}", params):
+            doc = dict(row)
+            doc["sketch"] = {}
+            rows[(row["bucket"], row["feature"], row["model"], row["mode"])] = doc
+        for row in conn.execute(f"SELECT bucket, feature, model, mode, idx, count FROM history_rollup_sketch WHERE {where}", params):
+            doc = rows.get((row["bucket"], row["feature"], row["model"], row["mode"]))
+            if doc is not None:
+                doc["sketch"][row["idx"]] = row["count"]
+        for doc in rows.values():
+            doc["bucket"] = datetime.fromisoformat(doc["bucket"])
+        return list(rows.values())
+
+    def prune_rollups(self, granularity, before):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("history_rollups", "history_rollup_sketch"):
+                conn.execute(f"DELETE FROM {table} WHERE granularity = ? AND bucket < ?", (granularity, before.isoformat()))
+
+    def legacy_batches(self, batch_size):
+        last_id = 0
+        while True:
+            rows = self._connection().execute(
+                "SELECT * FROM history WHERE prompt IS NULL AND id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            yield [_row_to_doc(row) for row in rows]
+            last_id = rows[-1]["id"]
+
+    def replace(self, updates):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for old, new in updates:
+                conn.execute(
+                    "UPDATE history SET input = ?, claude_prompt = NULL, prompt = ?, claude_response = ? WHERE id = ?",
+                    (new["input"], new["prompt"], new["claude_response"], old["_id"]),
+                )
+                new_input = unpack_text(new["input"])
+                if self.has_fts and new_input != old["input"]:
+                    # A contentless index forgets a row only when given the exact values it indexed
+                    context = _text_or_none((old.get("metadata") or {}).get("context")) or ""
+                    conn.execute(
+                        "INSERT INTO history_fts (history_fts, rowid, input, context) VALUES ('delete', ?, ?, ?)",
+                        (old["_id"], old["input"] or "", context),
+                    )
+                    conn.execute(
+                        "INSERT INTO history_fts (rowid, input, context) VALUES (?, ?, ?)",
+                        (old["_id"], new_input or "", context),
+                    )
+
+
+def _text_or_none(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _row_to_doc(row: sqlite3.Row) -> dict:
+    """Rebuild the document shape the Mongo backend returns."""
+    doc = {
+        "_id": row["id"],
+        "feature": row["feature"],
+        "input": row["input"],
+        "claude_prompt": row["claude_prompt"],
+        "claude_response": row["claude_response"],
+        "timestamp": datetime.fromisoformat(row["timestamp"]),
+    }
+    if row["prompt"] is not None:
+        del doc["claude_prompt"]
+        doc["prompt"] = row["prompt"]
+    if row["response_time_ms"] is not None:
+        doc["response_time_ms"] = row["response_time_ms"]
+    if row["metadata"] is not None:
+        doc["metadata"] = json.loads(row["metadata"])
+    return expand(doc)
+
+
+def create_history_store(backend: str = HISTORY_BACKEND) -> HistoryStore:
+    if backend == "mongo":
+        return MongoHistoryStore()
+    if backend == "sqlite":
+        return SQLiteHistoryStore()
+    raise ValueError(f"unknown HISTORY_BACKEND {backend!r}, expected one of {HISTORY_BACKENDS}")
+
+
+class HistoryConnection:
+    """The history store, connected in the background and reconnected with backoff.
+
+    Importing the app never waits on the database. Until the store has connected, and
+    again from the first connection error until a reconnect succeeds, `ready` is False:
+    callers skip the similarity cache and journal their writes instead of waiting on a
+    dead server, and the store's methods raise HistoryUnavailable.
+    """
+
+    def __init__(self, backend: str = HISTORY_BACKEND, factory: Callable[[str], HistoryStore] = create_history_store):
+        # Checked here rather than on the first connect, which would only log and retry forever
+        if backend not in HISTORY_BACKENDS:
+            raise ValueError(f"unknown HISTORY_BACKEND {backend!r}, expected one of {HISTORY_BACKENDS}")
+        self.backend = backend
+        self.store: Optional[HistoryStore] = None
+        self.ready = False
+        self.state = "connecting"
+        self.last_error: Optional[str] = None
+        self.connected_at: Optional[str] = None
+        self.reconnects = 0
+        # Awaited after every successful (re)connect, e.g. to replay journaled writes
+        self.on_ready: List[Callable[[], Awaitable[None]]] = []
+        self._factory = factory
+        self._retry = RetryPolicy(base=HISTORY_RECONNECT_BASE, cap=HISTORY_RECONNECT_MAX)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def name(self) -> str:
+        return self.store.name if self.store is not None else self.backend
+
+    def __getattr__(self, attr):
+        # Only reached for what HistoryConnection itself lacks: the store's methods and settings
+        store = self.__dict__.get("store")
+        if store is None or not self.__dict__.get("ready"):
+            raise HistoryUnavailable(f"history store ({self.backend}) is {self.__dict__.get('state')}")
+        value = getattr(store, attr)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            try:
+                return value(*args, **kwargs)
+            except store.connection_errors as e:
+                self.failed(e)
+                raise HistoryUnavailable(str(e)) from e
+        return call
+
+    def require(self) -> None:
+        """Raise HistoryUnavailable unless the store is connected."""
+        if not self.ready:
+            raise HistoryUnavailable(f"history store ({self.name}) is {self.state}")
+
+    def _connect(self) -> None:
+        if self.store is None:
+            self.store = self._factory(self.backend)
+        self.store.connect()
+
+    async def _run(self) -> None:
+        attempt = 0
+        while True:
+            if not self.ready:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self._connect)
+                except Exception as e:
+                    self.state, self.last_error = "down", str(e)
+                    delay = self._retry.delay(attempt)
+                    attempt += 1
+                    logger.warning("history store unavailable, retrying", extra=fields(
+                        backend=self.backend, attempt=attempt, retry_in_s=round(delay, 2), error=str(e)))
+                    await asyncio.sleep(delay)
+                    continue
+                attempt = 0
+                self.ready, self.state = True, "ready"
+                self.connected_at = datetime.utcnow().isoformat() + "Z"
+                logger.info(f"History store ready ({self.name})")
+                for callback in self.on_ready:
+                    try:
+                        await callback()
+                    except Exception as e:
+                        logger.error("history on_ready callback failed", extra=fields(error=str(e)))
+            self._wake.clear()
+            await self._wake.wait()
+
+    def start(self) -> None:
+        """Connect in the background; returns immediately."""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._task = self._loop.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def failed(self, error: Exception) -> None:
+        """Mark the store down after a connection error; safe to call from any thread."""
+        if not self.ready:
+            return
+        self.ready, self.state, self.last_error = False, "down", str(error)
+        self.reconnects += 1
+        logger.error("history store connection lost", extra=fields(backend=self.backend, error=str(error)))
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "state": self.state,
+            "ready": self.ready,
+            "connected_at": self.connected_at,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+        }
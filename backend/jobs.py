@@ -0,0 +1,278 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from threading import Lock
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from metrics import QUEUE_WAIT_SECONDS
+from logging_setup import request_feature, request_id
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_PURGE_INTERVAL = float(os.getenv("JOB_PURGE_INTERVAL", "300"))
+# A running job whose heartbeat is older than this belonged to a worker that died
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "90"))
+JOB_HEARTBEAT_SECONDS = JOB_STALE_SECONDS / 3
+
+TERMINAL_STATUSES = ("done", "failed")
+
+# Set while a job handler runs so deep code (per-unit refactors, OCR frames) can report progress
+_current_job: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_job", default=None)
+
+
+class JobStore:
+    """Durable local job queue in SQLite; survives worker restarts."""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    feature TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    expires_at REAL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires_at)")
+
+    def create(self, feature: str, payload: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, feature, payload, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, feature, json.dumps(payload), now, now),
+            )
+        return job_id
+
+    def update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        for key in ("progress", "result"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key], default=str)
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        for key in ("progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    def claim(self, job_id: str) -> bool:
+        """Atomically move a queued job to running; False if another worker got it first."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            ).rowcount == 1
+
+    def heartbeat(self, job_id: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def recover(self, stale_after: float = JOB_STALE_SECONDS) -> List[str]:
+        """Requeue running jobs whose worker stopped heartbeating; return all queued ids, oldest first."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+                (time.time() - stale_after,),
+            )
+            rows = self._conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        return [row["id"] for row in rows]
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            ).rowcount
+
+    def count(self, status: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+
+JobHandler = Callable[[dict], Awaitable[dict]]
+
+
+class JobManager:
+    """Bounded worker pool over the durable queue, with progress fan-out for SSE."""
+
+    def __init__(self, store_path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS):
+        self.store_path = store_path
+        self.workers = workers
+        self.store: Optional[JobStore] = None
+        self.handlers: Dict[str, JobHandler] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    def register(self, feature: str, handler: JobHandler) -> None:
+        self.handlers[feature] = handler
+
+    async def _db(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: fn(*args, **kwargs))
+
+    async def start(self) -> None:
+        self.store = JobStore(self.store_path)
+        self._queue = asyncio.Queue()
+        recovered = await self._db(self.store.recover)
+        for job_id in recovered:
+            self._queue.put_nowait(job_id)
+        if recovered:
+            logger.info(f"[Jobs] Requeued {len(recovered)} jobs from the durable queue")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def submit(self, feature: str, payload: dict) -> str:
+        job_id = await self._db(self.store.create, feature, payload)
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self._db(self.store.get, job_id)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(job_id, [])
+        if queue in subscribers:
+            subscribers.remove(queue)
+        if not subscribers:
+            self._subscribers.pop(job_id, None)
+
+    def _publish(self, job_id: str, event: str, data: dict) -> None:
+        for queue in self._subscribers.get(job_id, []):
+            queue.put_nowait((event, data))
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+        }
+
+    async def report(self, job_id: str, progress: dict) -> None:
+        await self._db(self.store.update, job_id, progress=progress)
+        self._publish(job_id, "progress", progress)
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                # Several processes may share the queue; only the one that claims the job runs it
+                claimed = await self._db(self.store.claim, job_id)
+            except Exception as e:
+                # Still queued, so the next recover() hands it out again
+                logger.warning(f"[Jobs] Could not claim job {job_id}: {e}")
+                continue
+            if not claimed:
+                continue
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                # Shutdown: leave it 'running' so recover() requeues it on the next start
+                raise
+            except Exception as e:
+                # Never leave a claimed job 'running': that would only be noticed once it goes stale
+                logger.error(f"[Jobs] Job {job_id} could not be completed: {e}")
+                await self._finish(job_id, "failed", {"error": str(e)})
+
+    async def _run(self, job_id: str) -> None:
+        job = await self._db(self.store.get, job_id)
+        if job is None:
+            raise Exception("job disappeared from the store")
+        QUEUE_WAIT_SECONDS.observe(time.time() - job["created_at"], feature=job["feature"], queue="jobs")
+        handler = self.handlers.get(job["feature"])
+        self._publish(job_id, "status", {"status": "running"})
+        token = _current_job.set(job_id)
+        # Log lines from the job carry its id in place of a request id
+        id_token = request_id.set(job_id)
+        feature_token = request_feature.set(job["feature"])
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            if handler is None:
+                raise Exception(f"No handler registered for feature '{job['feature']}'")
+            result = await handler(job["payload"])
+            status, fields = "done", {"result": result}
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[Jobs] Job {job_id} ({job['feature']}) failed: {e}")
+            status, fields = "failed", {"error": str(e)}
+        finally:
+            heartbeat.cancel()
+            _current_job.reset(token)
+            request_id.reset(id_token)
+            request_feature.reset(feature_token)
+        await self._db(self.store.update, job_id, status=status, expires_at=time.time() + JOB_RESULT_TTL, **fields)
+        self._publish(job_id, status, {"status": status, **fields})
+
+    async def _finish(self, job_id: str, status: str, fields: dict) -> None:
+        try:
+            await self._db(self.store.update, job_id, status=status, expires_at=time.time() + JOB_RESULT_TTL, **fields)
+        except Exception as e:
+            # Left 'running' without a heartbeat: recover() requeues it once it goes stale
+            logger.error(f"[Jobs] Could not mark job {job_id} {status}: {e}")
+        self._publish(job_id, status, {"status": status, **fields})
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            await self._db(self.store.heartbeat, job_id)
+
+    async def _purge_loop(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_PURGE_INTERVAL)
+            try:
+                purged = await self._db(self.store.purge_expired)
+                if purged:
+                    logger.info(f"[Jobs] Purged {purged} expired job results")
+                # Pick up jobs orphaned by a worker process that died
+                for job_id in await self._db(self.store.recover):
+                    self._queue.put_nowait(job_id)
+            except Exception as e:
+                logger.warning(f"[Jobs] Purge failed: {e}")
+
+
+job_manager = JobManager()
+
+
+async def report_progress(**progress) -> None:
+    """Publish progress for the job currently running in this task; no-op outside jobs."""
+    job_id = _current_job.get()
+    if job_id is not None and job_manager.store is not None:
+        await job_manager.report(job_id, progress)
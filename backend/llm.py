@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+import httpx
+
+from resilience import (
+    LLM_HEDGE,
+    LLM_HEDGE_MIN_DELAY,
+    LLM_REQUEST_DEADLINE,
+    RETRYABLE_STATUSES,
+    UpstreamError,
+    breaker,
+    hedged,
+    latency,
+    parse_retry_after,
+    retry_policy,
+)
+from deadline import remaining as request_time_left
+from metrics import LLM_REQUEST_SECONDS, LLM_RETRIES, LLM_TOKENS, LLM_TTFT_SECONDS
+from rollups import add_usage
+from scheduler import upstream_scheduler
+from shared_state import single_flight
+from token_diet import count_tokens
+from logging_setup import fields
+from tracing import record_span, span
+
+logger = logging.getLogger(__name__)
+
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com")
+MESSAGES_URL = f"{ANTHROPIC_BASE_URL.rstrip('/')}/v1/messages"
+
+# Per-attempt timeout; the overall budget is LLM_REQUEST_DEADLINE
+TIMEOUT = 60.0
+
+# Identical concurrent calls, from any worker, share one upstream request. Only calls made
+# while it is in flight get its answer; LLM_DEDUP_TTL just has to outlast their polling.
+LLM_DEDUP = os.getenv("LLM_DEDUP", "true").lower() == "true"
+LLM_DEDUP_TTL = float(os.getenv("LLM_DEDUP_TTL", "5"))
+
+
+def claude_headers(api_key: str) -> dict:
+    return {
+        "x-api-key": api_key,
+        "anthropic-version": "2023-06-01",
+        "Content-Type": "application/json"
+    }
+
+
+def response_text(data: dict) -> str:
+    """Concatenate the text blocks of a messages response."""
+    return "".join(block.get("text", "") for block in data.get("content", []) if block.get("type") == "text")
+
+
+def request_key(body: dict) -> str:
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(body: dict) -> int:
+    """Prompt estimate plus the output allowance, for the tokens/minute bucket."""
+    prompt = json.dumps(body.get("system", "")) + json.dumps(body.get("messages", [])) + json.dumps(body.get("tools", []))
+    return count_tokens(prompt) + body.get("max_tokens", 1024)
+
+
+async def _post_once(client, headers, body, feature: str, session_id: Optional[str], timeout: float) -> dict:
+    """One upstream attempt: wait for a scheduler slot, post, classify the outcome."""
+    async with upstream_scheduler.slot(feature, session_id, estimate_tokens(body)) as ticket:
+        record_span("claude.queue", ticket.wait_ms / 1000)
+        model = body.get("model", "")
+        started = time.monotonic()
+        try:
+            # Send with stream=True so the arrival of the headers can be timed separately;
+            # the messages call is not streamed, so this is time to first byte
+            with span("claude.attempt"):
+                request = client.build_request("POST", MESSAGES_URL, headers=headers, json=body, timeout=timeout)
+                response = await client.send(request, stream=True)
+                try:
+                    LLM_TTFT_SECONDS.observe(time.monotonic() - started, feature=feature, model=model)
+                    await response.aread()
+                finally:
+                    await response.aclose()
+        except httpx.TimeoutException as e:
+            raise UpstreamError(f"Claude API timed out: {str(e)}", retryable=True)
+        except httpx.TransportError as e:
+            raise UpstreamError(f"Claude API connection failed: {str(e)}", retryable=True)
+
+        if response.status_code >= 400:
+            retry_after = parse_retry_after(response.headers.get("retry-after"))
+            if response.status_code == 429:
+                upstream_scheduler.penalize(retry_after or 5.0)
+            raise UpstreamError(
+                f"Claude API returned HTTP {response.status_code}: {response.text[:300]}",
+                status=response.status_code,
+                retryable=response.status_code in RETRYABLE_STATUSES,
+                retry_after=retry_after,
+            )
+
+        data = response.json()
+        latency.record(model, time.monotonic() - started)
+        usage = data.get("usage", {})
+        if usage:
+            LLM_TOKENS.inc(usage.get("input_tokens", 0), feature=feature, model=model, direction="input")
+            LLM_TOKENS.inc(usage.get("output_tokens", 0), feature=feature, model=model, direction="output")
+            upstream_scheduler.settle(ticket, usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+            add_usage(usage)
+        return data
+
+
+async def make_claude_request(
+    client,
+    headers,
+    body,
+    feature: str = "default",
+    session_id: Optional[str] = None,
+    timeout: float = TIMEOUT,
+    deadline: float = LLM_REQUEST_DEADLINE,
+    hedge: bool = LLM_HEDGE,
+):
+    """Shared upstream call with retries, an overall deadline, optional hedging and a breaker.
+
+    429/5xx/529 and transport errors are retried with jittered exponential backoff that
+    honours Retry-After; every attempt's timeout is clipped to what is left of `deadline`.
+    With hedge=True a second copy of a slow attempt is sent once the model's p95 latency
+    has passed, and whichever finishes first wins. With LLM_DEDUP an identical body already
+    in flight on any worker is waited for instead of sent again (outcome "shared").
+    """
+    model = body.get("model", "")
+    with LLM_REQUEST_SECONDS.time(feature=feature, model=model, outcome="error") as labels, span("claude", model=model):
+        call = lambda: _request_with_retries(client, headers, body, feature, session_id, timeout, deadline, hedge)
+        shared = False
+        if LLM_DEDUP:
+            data, shared = await single_flight("llm", request_key(body), call, lock_ttl=deadline + TIMEOUT, result_ttl=LLM_DEDUP_TTL)
+        else:
+            data = await call()
+        labels["outcome"] = "shared" if shared else "ok"
+    return data
+
+
+async def _request_with_retries(client, headers, body, feature, session_id, timeout, deadline, hedge):
+    # Never outlive the client's own request deadline
+    deadline = request_time_left(deadline)
+    deadline_at = time.monotonic() + deadline
+    model = body.get("model", "")
+    attempt = 0
+    while True:
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise UpstreamError(f"Claude API deadline of {deadline:.0f}s exceeded after {attempt} attempts")
+        probe = breaker.allow(probe_timeout=remaining)
+
+        hedge_after = None
+        if hedge:
+            p95 = latency.percentile(model, 0.95)
+            if p95 is not None:
+                hedge_after = max(p95, LLM_HEDGE_MIN_DELAY)
+
+        attempt_timeout = min(timeout, remaining)
+        try:
+            try:
+                data = await asyncio.wait_for(
+                    hedged(lambda: _post_once(client, headers, body, feature, session_id, attempt_timeout), hedge_after),
+                    timeout=remaining,
+                )
+            finally:
+                # Cancelled or rate limited probes give no verdict; the outcomes below record one
+                breaker.release(probe)
+            breaker.record_success()
+            return data
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            raise UpstreamError(f"Claude API deadline of {deadline:.0f}s exceeded")
+        except UpstreamError as e:
+            if not e.retryable:
+                # A 4xx is our fault; the upstream itself answered fine
+                if e.status is not None:
+                    breaker.record_success()
+                raise
+            # Rate limiting means we are too fast, not that the upstream is down
+            if e.status != 429:
+                breaker.record_failure()
+            attempt += 1
+            if attempt >= retry_policy.max_attempts:
+                raise UpstreamError(f"Claude API failed after {attempt} attempts: {str(e)}", status=e.status)
+            delay = retry_policy.delay(attempt - 1, e.retry_after)
+            if time.monotonic() + delay >= deadline_at:
+                raise UpstreamError(f"Claude API failed and the deadline leaves no time to retry: {str(e)}", status=e.status)
+            LLM_RETRIES.inc(feature=feature, model=model, reason=str(e.status or "transport"))
+            logger.warning(
+                "upstream attempt failed, retrying",
+                extra=fields(attempt=attempt, model=model, error=str(e), retry_in_s=round(delay, 2)),
+            )
+            await asyncio.sleep(delay)
+        except Exception:
+            # Anything else (say, a body that is not JSON) still means the upstream misbehaved
+            breaker.record_failure()
+            raise
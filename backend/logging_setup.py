@@ -0,0 +1,198 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from metrics import feature_from_path, registry
+
+# Configured before main.py loads .env, so load it here too
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one object per line, "text" for humans
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+# Per-feature overrides, e.g. LOG_LEVELS='{"screen-assist": "DEBUG"}'
+LOG_LEVELS = {feature: level.upper() for feature, level in json.loads(os.getenv("LOG_LEVELS", "{}")).items()}
+# Fraction of below-WARNING records kept per feature, e.g. LOG_SAMPLING='{"gitops": 0.1}'
+LOG_SAMPLING = {feature: float(rate) for feature, rate in json.loads(os.getenv("LOG_SAMPLING", "{}")).items()}
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+request_feature: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_feature", default=None)
+
+LOG_DROPPED = registry.counter("shadowai_log_records_dropped_total", "Log records dropped because the log queue was full.")
+
+# Attributes every LogRecord has; anything else arrived through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def truncate(value, limit: int = LOG_MAX_FIELD_CHARS):
+    if isinstance(value, str) and len(value) > limit:
+        return f"{value[:limit]}...[+{len(value) - limit} chars]"
+    return value
+
+
+def fields(**values) -> dict:
+    """`extra=` payload for structured fields: logger.debug("ocr done", extra=fields(chars=n))."""
+    return values
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the request id and feature, then applies per-feature levels and sampling."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        feature = getattr(record, "feature", None) or request_feature.get()
+        record.feature = feature
+        if feature in LOG_LEVELS and record.levelno < logging.getLevelName(LOG_LEVELS[feature]):
+            return False
+        # Warnings and errors are never sampled away
+        rate = LOG_SAMPLING.get(feature)
+        if rate is not None and record.levelno < logging.WARNING and random.random() >= rate:
+            return False
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a background thread; drops (and counts) them when the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message here, where args are still valid, but leave formatting to the listener
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = truncate(record.getMessage(), LOG_MAX_FIELD_CHARS * 4)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = truncate(value)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extras = {
+            key: truncate(value) for key, value in record.__dict__.items()
+            if key not in _RECORD_ATTRS and key not in ("request_id", "feature") and value is not None
+        }
+        prefix = f"[{record.request_id}] " if getattr(record, "request_id", None) else ""
+        suffix = " " + " ".join(f"{key}={value!r}" for key, value in extras.items()) if extras else ""
+        return prefix + line + suffix
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging() -> None:
+    """Route all logging through a bounded queue drained by a background thread."""
+    global _listener
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    # Per-feature levels can only lower the bar if the root lets the records through
+    levels = [logging.getLevelName(LOG_LEVEL)] + [logging.getLevelName(level) for level in LOG_LEVELS.values()]
+    root.setLevel(min(levels))
+    handler.setLevel(min(levels))
+    if LOG_LEVELS:
+        handler.addFilter(_DefaultLevelFilter(logging.getLevelName(LOG_LEVEL)))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class _DefaultLevelFilter(logging.Filter):
+    """LOG_LEVEL for records from features without their own level."""
+
+    def __init__(self, level: int):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return getattr(record, "feature", None) in LOG_LEVELS or record.levelno >= self.level
+
+
+class CorrelationMiddleware:
+    """Pure ASGI middleware: a request id (from X-Request-ID or generated) for every log line."""
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("requests")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rid = None
+        for name, value in scope.get("headers", []):
+            if name.decode("latin-1").lower() == REQUEST_ID_HEADER:
+                rid = value.decode("latin-1")[:64]
+        rid = rid or uuid.uuid4().hex[:16]
+        id_token = request_id.set(rid)
+        feature_token = request_feature.set(feature_from_path(scope.get("path", "")))
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            self.logger.debug(
+                "request",
+                extra=fields(method=scope.get("method"), path=scope.get("path"), status=status["code"],
+                             duration_ms=round((time.perf_counter() - start) * 1000, 1)),
+            )
+            request_feature.reset(feature_token)
+            request_id.reset(id_token)
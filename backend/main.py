@@ -1,30 +1,42 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 import os
+from datetime import datetime
+from logging_setup import setup_logging, CorrelationMiddleware
+
+# Before the route imports, so log lines emitted while they connect (e.g. Mongo) are kept
+setup_logging()
+
 from fastapi.middleware.cors import CORSMiddleware
 from routes.refactor import router as refactor_router
+from routes.refactor_batch import router as refactor_batch_router
 from routes.ask_qa import router as qa_router
-from routes.gitops import router as gitops_router
+from routes.gitops import router as gitops_router, scenario_library
 from routes.screen_assist import router as screen_assist_router
 from routes.history import router as history_router
+from routes.jobs import router as jobs_router
+from routes.admin import router as admin_router
+from jobs import job_manager
 from dotenv import load_dotenv
-import logging
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+from scheduler import request_queue_wait, upstream_scheduler
+from deadline import DeadlineMiddleware
+from admission import AdmissionMiddleware, admission
+from resilience import breaker
+from shared_state import shared_state
+from metrics import CONTENT_TYPE, MetricsMiddleware, render as render_metrics
+from tracing import TracingMiddleware
+from profiling import ProfilingMiddleware
+from responses import CompressionMiddleware, ORJSONResponse
+from db import archiver, flush_history, journal, rollups, store
+from history_store import HISTORY_RETRY_AFTER, HistoryUnavailable
+from rollups import request_usage
 
 load_dotenv()
 
-import db  # ensures DB connection is initialized and logs are printed
-
 print("🚀 Starting AI Development Assistant Backend...")
 print("📦 Claude API Key:", "✅ Set" if os.getenv("ANTHROPIC_API_KEY") else "❌ Missing")
 print("🛠 Mongo URI:", "✅ Set" if os.getenv("MONGODB_URI") else "❌ Missing")
 
-app = FastAPI(title="AI Development Assistant API", version="1.0.0")
+app = FastAPI(title="AI Development Assistant API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Define allowed origins for CORS - support both local development and Replit
 default_origins = ["http://localhost:3000", "https://localhost:3000"]
@@ -47,10 +59,13 @@ app.add_middleware(
 )
 
 app.include_router(refactor_router)
+app.include_router(refactor_batch_router)
 app.include_router(qa_router)
 app.include_router(gitops_router)
 app.include_router(screen_assist_router)
 app.include_router(history_router)
+app.include_router(jobs_router)
+app.include_router(admin_router)
 
 @app.get("/")
 def root():
@@ -58,7 +73,45 @@ def root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "timestamp": "2024-01-01T00:00:00Z"}
+    state = admission.state()
+    shedding = [feature for feature, info in state["features"].items() if info["shedding"]]
+    shared = shared_state.stats()
+    degraded = shedding or breaker.state != "closed" or not shared["ok"] or not store.ready
+    return {
+        "status": "degraded" if degraded else "healthy",
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "shedding": shedding,
+        "admission": state,
+        "upstream": {**upstream_scheduler.stats(), "circuit": breaker.state},
+        "jobs": job_manager.stats(),
+        "shared_state": shared,
+        "history": {**store.stats(), "journal": journal.stats()},
+        "history_retention": archiver.stats(),
+    }
+
+@app.get("/health/live")
+def liveness():
+    # The process is serving requests, whatever the state of its dependencies
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def readiness():
+    # Not ready until the history store has connected (or while it is reconnecting)
+    if not store.ready:
+        return ORJSONResponse({"status": "not ready", "history": store.stats()}, status_code=503)
+    return {"status": "ready"}
+
+@app.exception_handler(HistoryUnavailable)
+async def history_unavailable(request: Request, exc: HistoryUnavailable):
+    return ORJSONResponse(
+        {"error": f"history is temporarily unavailable: {exc}", "retry_after": HISTORY_RETRY_AFTER},
+        status_code=503,
+        headers={"Retry-After": str(HISTORY_RETRY_AFTER)},
+    )
+
+@app.get("/metrics")
+def metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE)
 
 @app.get("/modules")
 def get_modules():
@@ -74,8 +127,83 @@ async def list_routes():
     for route in app.routes:
         print(f"  - {route.path}")
 
+@app.on_event("startup")
+async def connect_history_store():
+    # Returns at once; the store connects (and reconnects) in the background
+    store.start()
+
+@app.on_event("shutdown")
+async def disconnect_history_store():
+    store.stop()
+
+@app.on_event("startup")
+async def start_job_workers():
+    await job_manager.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_manager.stop()
+
+@app.on_event("shutdown")
+async def flush_history_writes():
+    await flush_history()
+
+@app.on_event("shutdown")
+async def flush_rollups():
+    await rollups.stop()
+
+@app.on_event("startup")
+async def start_rollups():
+    rollups.start()
+
+@app.on_event("startup")
+async def start_history_archiver():
+    archiver.start()
+
+@app.on_event("shutdown")
+async def stop_history_archiver():
+    archiver.stop()
+
+@app.on_event("startup")
+async def warm_scenario_library():
+    scenario_library.start()
+
+@app.on_event("shutdown")
+async def stop_scenario_library():
+    scenario_library.stop()
+
 @app.middleware("http")
-async def log_request_path(request, call_next):
-    logging.info(f"Incoming request path: {request.url.path}")
-    response = await call_next(request)
+async def expose_queue_wait(request, call_next):
+    # Routes add the time their upstream calls spent queued in the scheduler
+    waited = {}
+    token = request_queue_wait.set(waited)
+    try:
+        response = await call_next(request)
+    finally:
+        request_queue_wait.reset(token)
+    if "ms" in waited:
+        response.headers["X-Queue-Wait-Ms"] = f"{waited['ms']:.1f}"
     return response
+
+@app.middleware("http")
+async def track_token_usage(request, call_next):
+    # Upstream calls add their token usage here for the history rollups
+    token = request_usage.set({})
+    try:
+        return await call_next(request)
+    finally:
+        request_usage.reset(token)
+
+# gzip/brotli for large JSON bodies; inside tracing so compression counts as request time
+app.add_middleware(CompressionMiddleware)
+# Innermost: only admitted requests are traced, and armed ones profiled
+app.add_middleware(TracingMiddleware)
+app.add_middleware(ProfilingMiddleware)
+# Shed load before any work (or body parsing) happens for an overloaded feature
+app.add_middleware(AdmissionMiddleware)
+# Outside everything but metrics, so a disconnect or deadline cancels all the work underneath it
+app.add_middleware(DeadlineMiddleware)
+# Request ids for every log line, including those about shed or cancelled requests
+app.add_middleware(CorrelationMiddleware)
+# Wraps even the deadline middleware so 503s and 504s are counted too
+app.add_middleware(MetricsMiddleware)
@@ -0,0 +1,250 @@
+import math
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Seconds; the tail covers slow LLM calls and long OCR sessions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def items(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return sorted(self._values.items())
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Metric):
+    """Read at scrape time from a callback returning {label values tuple: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str], collect: Callable[[], Dict[Tuple[str, ...], float]]):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self.collect().items())
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (per-bucket counts, sum, count)
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block; labels may be updated inside it (e.g. hit/miss)."""
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str], collect) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, collect))
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+# Requests
+REQUEST_SECONDS = registry.histogram(
+    "shadowai_request_seconds", "End-to-end request latency.", ("feature", "method", "status"))
+REQUEST_CANCELLATIONS = registry.counter(
+    "shadowai_request_cancellations_total", "Requests whose in-flight work was cancelled.", ("feature", "reason"))
+ADMISSION_REJECTIONS = registry.counter(
+    "shadowai_admission_rejections_total", "Requests shed by admission control.", ("feature", "reason"))
+
+# Caches; layer is l1 (in-process), shared (cross-worker state), library (precomputed scenarios)
+# or the history store's similarity search (mongo or sqlite)
+CACHE_LOOKUP_SECONDS = registry.histogram(
+    "shadowai_cache_lookup_seconds", "Response cache lookup latency.", ("feature", "layer", "result"))
+
+# OCR
+OCR_DECODE_SECONDS = registry.histogram(
+    "shadowai_ocr_decode_seconds", "Base64 + image decode time per frame.")
+OCR_PREPROCESS_SECONDS = registry.histogram(
+    "shadowai_ocr_preprocess_seconds", "Image preprocessing time per frame.")
+OCR_ENGINE_SECONDS = registry.histogram(
+    "shadowai_ocr_engine_seconds", "Time spent in each OCR engine attempt.", ("engine", "outcome"))
+OCR_FRAME_SECONDS = registry.histogram(
+    "shadowai_ocr_frame_seconds", "Total OCR time per frame, by the engine that produced the text.", ("engine",))
+
+# Upstream LLM
+LLM_TTFT_SECONDS = registry.histogram(
+    "shadowai_llm_time_to_first_byte_seconds", "Time until the upstream response headers arrive, per attempt.", ("feature", "model"))
+LLM_REQUEST_SECONDS = registry.histogram(
+    "shadowai_llm_request_seconds", "Logical LLM call latency across retries and hedges.", ("feature", "model", "outcome"))
+LLM_RETRIES = registry.counter(
+    "shadowai_llm_retries_total", "Retried upstream attempts.", ("feature", "model", "reason"))
+LLM_TOKENS = registry.counter(
+    "shadowai_llm_tokens_total", "Tokens reported by the upstream usage block.", ("feature", "model", "direction"))
+
+# Queues and storage
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "shadowai_queue_wait_seconds", "Time spent waiting in a queue before work started.", ("feature", "queue"))
+DB_WRITE_SECONDS = registry.histogram(
+    "shadowai_db_write_seconds", "History write latency.", ("feature", "outcome"))
+
+
+def render() -> str:
+    return registry.render()
+
+
+# First path segments that name a feature; anything else (scanners, typos) is "other",
+# so unknown paths cannot grow the label set
+FEATURES = frozenset({
+    "admin", "ask-qa", "git-scenarios", "gitops", "health", "history", "jobs", "metrics", "modules",
+    "refactor", "screen-assist",
+})
+
+
+def feature_from_path(path: str) -> str:
+    segment = path.strip("/").split("/")[0]
+    if not segment:
+        return "root"
+    return segment if segment in FEATURES else "other"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request latency by feature, method and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def tracking_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, tracking_send)
+        finally:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                feature=feature_from_path(scope.get("path", "")),
+                method=scope.get("method", ""),
+                status=status["code"],
+            )
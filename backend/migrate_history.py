@@ -0,0 +1,38 @@
+"""Rewrite history documents from before the compact format (see history_codec).
+
+    cd backend
+    python migrate_history.py --dry-run     # report what would change
+    python migrate_history.py
+
+Uses the same HISTORY_BACKEND / MONGODB_URI / HISTORY_DB_PATH as the server and is safe
+to re-run: documents already in the compact format are skipped. Prompts that a template
+reproduces exactly are stored as references; the rest keep their text, compressed if large.
+"""
+import argparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from history_store import HISTORY_BACKEND, HISTORY_BACKENDS, create_history_store  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=HISTORY_BACKEND, choices=HISTORY_BACKENDS)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="report sizes without writing")
+    args = parser.parse_args()
+
+    store = create_history_store(args.backend)
+    store.connect()
+    stats = store.migrate(batch_size=args.batch_size, dry_run=args.dry_run)
+    saved = stats["bytes_before"] - stats["bytes_after"]
+    ratio = stats["bytes_after"] / stats["bytes_before"] if stats["bytes_before"] else 1.0
+    verb = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{verb} {stats['documents']} documents ({store.name}), {stats['templated']} with template prompts")
+    print(f"Payload {stats['bytes_before']} -> {stats['bytes_after']} bytes ({ratio:.1%}, {saved} saved)")
+
+
+if __name__ == "__main__":
+    main()
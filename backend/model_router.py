@@ -0,0 +1,100 @@
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from token_diet import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Routing table: which model serves each tier, and per feature what counts as "simple".
+# Override any part with MODEL_ROUTING='{"models": {"fast": "..."}, "features": {...}}'.
+DEFAULT_ROUTING = {
+    "models": {
+        "fast": "claude-3-5-haiku-20241022",
+        "large": "claude-sonnet-4-20250514",
+    },
+    "features": {
+        "gitops": {
+            "max_simple_tokens": 80,
+            # Canned scenarios without an attached error are textbook answers
+            "simple_scenarios": ["undo", "branch", "merge", "stash", "reset"],
+        },
+        "ask-qa": {
+            "max_simple_tokens": 60,
+            "simple_scenarios": [],
+        },
+    },
+}
+
+
+def _load_routing() -> dict:
+    routing = json.loads(json.dumps(DEFAULT_ROUTING))
+    try:
+        override = json.loads(os.getenv("MODEL_ROUTING", "{}"))
+        routing["models"].update(override.get("models", {}))
+        for feature, rules in override.get("features", {}).items():
+            routing["features"].setdefault(feature, {}).update(rules)
+    except (ValueError, AttributeError) as e:
+        logger.warning(f"Ignoring invalid MODEL_ROUTING: {e}")
+    return routing
+
+
+ROUTING = _load_routing()
+
+
+@dataclass
+class RouteDecision:
+    feature: str
+    tier: str
+    model: str
+    reason: str
+
+    def telemetry(self, latency_ms: float, data: Optional[dict] = None, output: str = "") -> dict:
+        """Per-request routing record for history metadata (latency + cheap quality signals)."""
+        data = data or {}
+        usage = data.get("usage", {})
+        return {
+            "tier": self.tier,
+            "model": self.model,
+            "reason": self.reason,
+            "latency_ms": round(latency_ms, 1),
+            "quality": {
+                "stop_reason": data.get("stop_reason"),
+                "truncated": data.get("stop_reason") == "max_tokens",
+                "empty": not output.strip(),
+                "output_tokens": usage.get("output_tokens"),
+                "has_code_block": "```" in output,
+            },
+        }
+
+
+def route_model(
+    feature: str,
+    text: str,
+    scenario_type: Optional[str] = None,
+    has_code: bool = False,
+) -> RouteDecision:
+    """Pick the fast or large model with a local heuristic; no upstream call involved."""
+    models = ROUTING["models"]
+    rules = ROUTING["features"].get(feature)
+
+    def decide(tier: str, reason: str) -> RouteDecision:
+        return RouteDecision(feature, tier, models[tier], reason)
+
+    if not rules:
+        return decide("large", "feature not routed")
+    if has_code:
+        return decide("large", "code or diff attached")
+    if scenario_type:
+        # A canned scenario's prompt is ours, so only the scenario list decides
+        if scenario_type in rules.get("simple_scenarios", []):
+            return decide("fast", f"simple scenario '{scenario_type}'")
+        return decide("large", f"scenario '{scenario_type}'")
+    tokens = count_tokens(text or "")
+    if tokens == 0:
+        return decide("large", "no input text")
+    if tokens <= rules.get("max_simple_tokens", 0):
+        return decide("fast", f"short input ({tokens} tokens)")
+    return decide("large", f"long input ({tokens} tokens)")
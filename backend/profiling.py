@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from metrics import feature_from_path
+from logging_setup import request_id
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_DEPTH = 64
+
+
+class SamplingProfiler:
+    """Statistical profiler: samples every thread's stack at a fixed interval.
+
+    Unlike cProfile it also sees the OCR executor threads, and its overhead does not
+    depend on how many Python calls the request makes. Stacks are written in the
+    collapsed "frame;frame;frame count" format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileControl:
+    """Admin toggle: profile the next N matching requests, one at a time."""
+
+    def __init__(self):
+        self.remaining = 0
+        self.feature: Optional[str] = None
+        self.active = False
+        self.dumped: list = []
+
+    def arm(self, requests: int, feature: Optional[str] = None) -> None:
+        self.remaining = requests
+        self.feature = feature
+
+    def disarm(self) -> None:
+        self.remaining = 0
+
+    def claim(self, feature: str) -> bool:
+        if self.active or self.remaining <= 0 or (self.feature and feature != self.feature):
+            return False
+        self.remaining -= 1
+        self.active = True
+        return True
+
+    def status(self) -> dict:
+        return {"remaining": self.remaining, "feature": self.feature, "active": self.active, "dumped": self.dumped[-20:]}
+
+
+profile_control = ProfileControl()
+
+
+def write_profile(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware that runs armed requests under the sampling profiler.
+
+    Samples cover the whole process while the request runs, so concurrent requests
+    show up as well; profile on a quiet node for clean flame graphs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        feature = feature_from_path(scope.get("path", ""))
+        if feature == "admin" or not profile_control.claim(feature):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.stop()
+            profile_control.active = False
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{feature}-{request_id.get() or 'request'}.folded"
+            path = os.path.join(PROFILE_DIR, name)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, write_profile, path, profiler.collapsed())
+                profile_control.dumped.append(path)
+                logger.info(f"[Profile] Wrote {profiler.samples} samples for {scope.get('path')} to {path}")
+            except OSError as e:
+                logger.warning(f"[Profile] Could not write {path}: {e}")
@@ -0,0 +1,284 @@
+"""Prompt templates, so history can store a template id and its parameters instead of the text.
+
+A template's text must never change once history references it: to change a prompt, add
+a new id (bump the @version) and keep the old function for rendering older documents.
+"""
+import ast
+import re
+from typing import Callable, Dict, Optional
+
+
+class RenderedPrompt(str):
+    """The rendered prompt text, remembering which template and parameters produced it."""
+
+    template: str
+    params: dict
+
+    def __new__(cls, text: str, template: str, params: dict):
+        prompt = super().__new__(cls, text)
+        prompt.template = template
+        prompt.params = params
+        return prompt
+
+    def with_params(self, **params) -> "RenderedPrompt":
+        return render(self.template, **{**self.params, **params})
+
+
+TEMPLATES: Dict[str, Callable[..., str]] = {}
+# Rebuild a legacy document's parameters from its stored fields, for the history migration
+INFER: Dict[str, Callable[[dict], Optional[dict]]] = {}
+
+
+def template(template_id: str, infer: Optional[Callable[[dict], Optional[dict]]] = None):
+    def register(fn):
+        TEMPLATES[template_id] = fn
+        if infer is not None:
+            INFER[template_id] = infer
+        return fn
+    return register
+
+
+def render(template_id: str, **params) -> RenderedPrompt:
+    return RenderedPrompt(TEMPLATES[template_id](**params), template_id, params)
+
+
+def infer_prompt(doc: dict) -> Optional[RenderedPrompt]:
+    """The template rendering exactly a legacy document's claude_prompt, if any does."""
+    prompt = doc.get("claude_prompt")
+    if not prompt:
+        return None
+    for template_id, infer in INFER.items():
+        if template_id.split("@")[0].split(".")[0] != doc.get("feature"):
+            continue
+        try:
+            params = infer(doc)
+            rendered = render(template_id, **params) if params is not None else None
+        except Exception:
+            continue
+        if rendered == prompt:
+            return rendered
+    return None
+
+
+# --- ask-qa ---
+
+ASK_QA_SECTIONS = re.compile(r"Question: (?P<question>.*?)\n\n(?:Code:\n(?P<code>.*)\n\n)?Keep the total response", re.S)
+
+
+def _infer_ask_qa(doc: dict) -> Optional[dict]:
+    match = ASK_QA_SECTIONS.search(doc["claude_prompt"])
+    if not match:
+        return None
+    params = {"question": match.group("question")}
+    if match.group("code") is not None:
+        params["code"] = match.group("code")
+    return params
+
+
+@template("ask-qa@1", infer=_infer_ask_qa)
+def ask_qa_prompt(question: str, code: str = "") -> str:
+    if code:
+        return (
+            "Answer the following question about the code in a clear and concise way.\n\n"
+            "IMPORTANT: Keep your response focused and to the point. Include:\n\n"
+            "1. A brief, clear explanation (2-3 paragraphs max)\n"
+            "   - Use simple, professional language\n"
+            "   - Focus on the key points\n"
+            "   - Use emojis sparingly for clarity\n\n"
+            "2. Relevant code examples in code blocks\n"
+            "   - Include proper language specification\n"
+            "   - Add brief comments\n"
+            "   - Keep examples concise\n\n"
+            f"Question: {question}\n\n"
+            f"Code:\n{code}\n\n"
+            "Keep the total response under 500 words and focus on the most important information."
+        )
+    return (
+        "Answer the following programming question in a clear and concise way.\n\n"
+        "IMPORTANT: Keep your response focused and to the point. Include:\n\n"
+        "1. A brief, clear explanation (2-3 paragraphs max)\n"
+        "   - Use simple, professional language\n"
+        "   - Focus on the key points\n"
+        "   - Use emojis sparingly for clarity\n\n"
+        "2. Relevant code examples in code blocks\n"
+        "   - Include proper language specification\n"
+        "   - Add brief comments\n"
+        "   - Keep examples concise\n\n"
+        f"Question: {question}\n\n"
+        "Keep the total response under 500 words and focus on the most important information."
+    )
+
+
+# --- gitops ---
+
+GITOPS_KINDS = {
+    # kind: (opening line, what to provide, word limit)
+    "instruction": ("Generate a Git command for: {subject}", [
+        "A brief explanation of what the command does (1-2 sentences)",
+        "The exact Git command to run",
+        "Any important warnings or notes",
+    ], 300),
+    "error": ("Help me fix this Git error: {subject}", [
+        "A brief explanation of the error (1-2 sentences)",
+        "Step-by-step solution (3-4 steps max)",
+        "The commands to run",
+    ], 400),
+    "scenario": ("Help me with this Git scenario: {subject}", [
+        "A brief explanation of the scenario (1-2 sentences)",
+        "Step-by-step solution (3-4 steps max)",
+        "The commands to run",
+    ], 400),
+    "status": ("Analyze this Git status and provide guidance:\nGit Log: {git_log}\nBranch Status: {branch_status}", [
+        "A brief analysis of the current state (1-2 sentences)",
+        "Recommended next steps (2-3 steps max)",
+        "Any relevant commands",
+    ], 300),
+    "commits": ("Review these commit messages and provide feedback:\n{subject}", [
+        "Brief feedback on the commit messages (1-2 sentences)",
+        "Suggestions for improvement",
+        "Examples of better commit messages",
+    ], 300),
+    "pr_diff": ("Review this pull request diff and provide feedback:\n{subject}", [
+        "Brief analysis of the changes (1-2 sentences)",
+        "Key suggestions for improvement",
+        "Any potential issues to address",
+    ], 400),
+    "general": ("Provide general Git guidance and best practices.", [
+        "Brief overview of Git best practices (2-3 paragraphs max)",
+        "Key commands to remember",
+        "Common workflow tips",
+    ], 500),
+}
+
+
+def gitops_params(request: dict, scenarios: Dict[str, str]) -> dict:
+    """Template parameters for a gitops request (as a dict of its fields)."""
+    if request.get("instruction"):
+        return {"kind": "instruction", "subject": request["instruction"]}
+    if request.get("error_message"):
+        return {"kind": "error", "subject": request["error_message"]}
+    if request.get("scenario_type"):
+        return {"kind": "scenario", "subject": scenarios.get(request["scenario_type"], request["scenario_type"])}
+    if request.get("git_log") or request.get("branch_status"):
+        return {"kind": "status", "git_log": request.get("git_log"), "branch_status": request.get("branch_status")}
+    if request.get("commit_messages"):
+        return {"kind": "commits", "subject": "\n".join(request["commit_messages"])}
+    if request.get("pr_diff"):
+        return {"kind": "pr_diff", "subject": request["pr_diff"]}
+    return {"kind": "general"}
+
+
+def gitops_instructions(request: dict) -> dict:
+    """The parameters add_instructions sets on top of gitops_params."""
+    return {
+        "explain_terms": bool(request.get("explain_terms")),
+        "fix_steps": bool(request.get("scenario_type") or request.get("error_message")),
+    }
+
+
+def _infer_gitops(doc: dict) -> Optional[dict]:
+    # Legacy gitops documents stored str(request.dict()) as the input
+    from routes.gitops import GIT_SCENARIOS
+
+    request = ast.literal_eval(doc.get("input") or "")
+    if not isinstance(request, dict):
+        return None
+    return {**gitops_params(request, GIT_SCENARIOS), **gitops_instructions(request)}
+
+
+@template("gitops@1", infer=_infer_gitops)
+def gitops_prompt(kind: str, subject: str = "", git_log: Optional[str] = None, branch_status: Optional[str] = None,
+                  explain_terms: bool = False, fix_steps: bool = False) -> str:
+    opening, provide, words = GITOPS_KINDS[kind]
+    prompt = opening.format(subject=subject, git_log=git_log, branch_status=branch_status) + "\n\n"
+    prompt += "IMPORTANT: Keep your response focused and to the point. Provide:\n\n"
+    prompt += "".join(f"{n}. {item}\n" for n, item in enumerate(provide, 1)) + "\n"
+    prompt += f"Keep the total response under {words} words."
+    if explain_terms:
+        prompt += "\n\nAlso define any technical Git terms used in your explanation so a beginner can understand them easily."
+    if fix_steps:
+        prompt += "\n\nPlease provide:\n1. Step-by-step instructions to fix this\n2. A simple explanation for beginners"
+    return prompt
+
+
+@template("gitops@2")
+def gitops_answer_prompt(kind: str, subject: str = "", git_log: Optional[str] = None, branch_status: Optional[str] = None,
+                         explain_terms: bool = False, fix_steps: bool = False) -> str:
+    # Answered through the gitops_answer tool, so the prompt says what goes in which field
+    opening, provide, words = GITOPS_KINDS[kind]
+    prompt = opening.format(subject=subject, git_log=git_log, branch_status=branch_status) + "\n\n"
+    prompt += "Answer with the gitops_answer tool. Keep it focused and to the point, covering:\n\n"
+    prompt += "".join(f"{n}. {item}\n" for n, item in enumerate(provide, 1)) + "\n"
+    prompt += f"Keep the whole answer under {words} words. Put each command to run in `commands`, in order, and nowhere else."
+    if explain_terms:
+        prompt += "\n\nIn `beginner_explanation`, also define any technical Git terms used so a beginner can understand them easily."
+    if fix_steps:
+        prompt += "\n\nPut step-by-step instructions to fix this in `steps`, and a simple explanation for beginners in `beginner_explanation`."
+    return prompt
+
+
+# --- refactor ---
+
+def _infer_refactor_file(doc: dict) -> Optional[dict]:
+    metadata = doc.get("metadata") or {}
+    if metadata.get("large_file"):
+        return None
+    return {"code": doc.get("input") or "", "mode": metadata.get("mode"), "target_language": metadata.get("target_language") or "same"}
+
+
+@template("refactor.file@1", infer=_infer_refactor_file)
+def refactor_file_prompt(code: str, mode: str, target_language: str = "same") -> str:
+    # Only include language conversion for modern mode
+    language_conversion = f"Convert the code to {target_language} and " if mode == 'modern' and target_language != 'same' else ""
+    return f"""You are an expert code refactoring assistant. {language_conversion}Refactor the provided code according to the specified mode.
+
+Mode: {mode}
+
+If the mode is 'modern':
+  - Convert the code to modern JavaScript/TypeScript practices
+  - Use ES6+ features, async/await, arrow functions, destructuring, etc.
+  - {f"Convert the code to {target_language}" if target_language != 'same' else "Keep the same programming language but modernize the syntax"}
+If the mode is 'clean', improve code readability and structure.
+If the mode is 'optimize', focus on performance improvements.
+If the mode is 'security', focus on security improvements and vulnerability fixes.
+
+IMPORTANT: Keep your response focused and to the point. Include:
+
+1. A brief explanation of the changes made (1-2 paragraphs max)
+   - Use simple, professional language
+   - Focus on the key improvements
+   - Use emojis sparingly for clarity
+
+2. The refactored code in a code block with proper language specification
+   - Add brief comments
+   - Keep the code clean and readable
+
+Code to refactor:
+{code}
+
+Keep the total response under 500 words and focus on the most important changes."""
+
+
+@template("refactor.unit@1")
+def refactor_unit_prompt(mode: str, target_language: str, context: str, kind: str, name: str,
+                         start_line: int, end_line: int, source: str) -> str:
+    language_conversion = f"Convert the code to {target_language} and " if mode == 'modern' and target_language != 'same' else ""
+    return f"""You are an expert code refactoring assistant. {language_conversion}Refactor ONE part of a larger file according to the specified mode.
+
+Mode: {mode}
+
+If the mode is 'modern', modernize the syntax{f" and convert the code to {target_language}" if target_language != 'same' else ""}.
+If the mode is 'clean', improve code readability and structure.
+If the mode is 'optimize', focus on performance improvements.
+If the mode is 'security', focus on security improvements and vulnerability fixes.
+
+The rest of the file is refactored separately. Shared module context (imports and signatures of every unit, for reference only):
+{context}
+
+Rules:
+- Keep the public names and signatures of this part unchanged so the other parts still fit
+- Do not repeat the imports or any code outside this part
+- Reply with ONE sentence summarizing the changes, then the complete refactored part in a single code block
+
+Part to refactor ({kind} `{name}`, lines {start_line}-{end_line}):
+{source}"""
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from shared_state import SharedState, shared_state
+from token_diet import count_tokens
+
+QA_SESSION_MAX = int(os.getenv("QA_SESSION_MAX", "1000"))
+QA_SESSION_TTL = float(os.getenv("QA_SESSION_TTL", "3600"))
+# Once the verbatim turns exceed this many tokens, older ones are folded into the summary
+QA_SESSION_TURN_BUDGET = int(os.getenv("QA_SESSION_TURN_BUDGET", "3000"))
+# Most recent question/answer pairs that are always sent verbatim
+QA_SESSION_KEEP_TURNS = int(os.getenv("QA_SESSION_KEEP_TURNS", "2"))
+
+SESSION_SYSTEM_PROMPT = (
+    "You are answering a developer's questions about their code in an ongoing conversation. "
+    "Answer in a clear and concise way: a brief explanation (2-3 paragraphs max) and relevant, "
+    "commented code examples in code blocks with a language specification. "
+    "Keep each answer under 500 words."
+)
+
+
+@dataclass
+class QASession:
+    session_id: str
+    code: str = ""
+    code_hash: str = ""
+    summary: str = ""
+    turns: List[Dict[str, str]] = field(default_factory=list)
+    updated_at: float = field(default_factory=time.time)
+
+    def set_code(self, code: str) -> bool:
+        """Replace the code context; returns True when it actually changed."""
+        code_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        if code_hash == self.code_hash:
+            return False
+        self.code, self.code_hash = code, code_hash
+        return True
+
+    def turn_tokens(self) -> int:
+        return sum(count_tokens(turn["content"]) for turn in self.turns)
+
+    def system_blocks(self) -> List[dict]:
+        """System prompt with the code context marked cacheable, so follow-ups reuse it upstream."""
+        blocks = [{"type": "text", "text": SESSION_SYSTEM_PROMPT}]
+        if self.code:
+            blocks.append({
+                "type": "text",
+                "text": f"Code under discussion:\n{self.code}",
+                "cache_control": {"type": "ephemeral"},
+            })
+        if self.summary:
+            blocks.append({"type": "text", "text": f"Summary of the earlier conversation:\n{self.summary}"})
+        return blocks
+
+    def messages(self, question: str) -> List[dict]:
+        return [*self.turns, {"role": "user", "content": question}]
+
+    def add_exchange(self, question: str, answer: str) -> None:
+        self.turns.append({"role": "user", "content": question})
+        self.turns.append({"role": "assistant", "content": answer})
+        self.updated_at = time.time()
+
+
+def local_summary(previous: str, turns: List[Dict[str, str]], max_chars: int = 300) -> str:
+    """Extractive fallback used when the summarizer call fails."""
+    lines = [previous] if previous else []
+    for turn in turns:
+        text = " ".join(turn["content"].split())
+        if len(text) > max_chars:
+            text = text[:max_chars] + "..."
+        lines.append(f"{'Q' if turn['role'] == 'user' else 'A'}: {text}")
+    return "\n".join(lines)
+
+
+async def compact(session: QASession, summarize: Optional[Callable[[str, List[Dict[str, str]]], Awaitable[str]]] = None) -> bool:
+    """Fold all but the most recent turns into the rolling summary when over budget."""
+    if session.turn_tokens() <= QA_SESSION_TURN_BUDGET:
+        return False
+    split = max(len(session.turns) - QA_SESSION_KEEP_TURNS * 2, 0)
+    old, recent = session.turns[:split], session.turns[split:]
+    if not old:
+        return False
+    summary = None
+    if summarize is not None:
+        try:
+            summary = await summarize(session.summary, old)
+        except Exception:
+            summary = None
+    session.summary = summary or local_summary(session.summary, old)
+    session.turns = recent
+    return True
+
+
+class SessionStore:
+    """Ask-qa sessions in shared state, so follow-ups may land on any worker.
+
+    Idle sessions expire after `ttl`; past `max_sessions` the least recently used go first,
+    tracked in a shared index so the bound holds across all workers.
+    """
+
+    NAMESPACE = "qa-session"
+    INDEX = "qa-session-index"
+
+    def __init__(self, max_sessions: int = QA_SESSION_MAX, ttl: float = QA_SESSION_TTL, shared: Optional[SharedState] = None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.shared = shared or shared_state
+
+    async def get(self, session_id: str) -> QASession:
+        """The stored session, or a new empty one. Call save() after changing it."""
+        data = await self.shared.aget(self.NAMESPACE, session_id)
+        if data is None:
+            return QASession(session_id)
+        return QASession(**data)
+
+    async def save(self, session: QASession) -> None:
+        session.updated_at = time.time()
+        await self.shared.aset(self.NAMESPACE, session.session_id, asdict(session), ttl=self.ttl)
+        await self._track(session.session_id, session.updated_at)
+
+    async def _track(self, session_id: str, updated_at: float) -> None:
+        owner = uuid.uuid4().hex
+        for _ in range(50):
+            if await self.shared.aacquire(self.INDEX, owner, ttl=5):
+                break
+            await asyncio.sleep(0.02)
+        else:
+            return  # the session is saved; it is only missing from this round of eviction
+        try:
+            index = await self.shared.aget(self.INDEX, "sessions") or {}
+            # Expired sessions are already gone from the store
+            index = {sid: at for sid, at in index.items() if at > updated_at - self.ttl}
+            index[session_id] = updated_at
+            for sid in sorted(index, key=index.get)[:max(len(index) - self.max_sessions, 0)]:
+                del index[sid]
+                await self.shared.adelete(self.NAMESPACE, sid)
+            await self.shared.aset(self.INDEX, "sessions", index, ttl=self.ttl)
+        finally:
+            await self.shared.arelease(self.INDEX, owner)
+
+    async def count(self) -> int:
+        return len(await self.shared.aget(self.INDEX, "sessions") or {})
+
+
+qa_sessions = SessionStore()
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# Wall-clock budget for one logical request, across every retry and hedge
+LLM_REQUEST_DEADLINE = float(os.getenv("LLM_REQUEST_DEADLINE", "90"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# 529 is Anthropic's "overloaded"
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class UpstreamError(Exception):
+    """An upstream failure; retryable ones may carry the server's Retry-After hint."""
+
+    def __init__(self, message: str, status: Optional[int] = None, retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After is either delay-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = LLM_MAX_ATTEMPTS, base: float = LLM_BACKOFF_BASE, cap: float = LLM_BACKOFF_MAX):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff, never shorter than the server asked for."""
+        backoff = random.uniform(0, min(self.cap, self.base * (2 ** attempt)))
+        return max(backoff, retry_after or 0.0)
+
+
+class CircuitBreaker:
+    """Opens after consecutive upstream failures and fails fast until a probe succeeds."""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe: Optional[object] = None
+        self._probe_expires = 0.0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def allow(self, probe_timeout: Optional[float] = None) -> Optional[object]:
+        """Raise while open. Half-open lets one probe through and returns its claim; pass
+        the claim to release() once the attempt is over, whatever its outcome.
+
+        A claim also lapses after probe_timeout seconds, so a probe that never reports
+        back cannot keep the breaker half-open forever.
+        """
+        state = self.state
+        now = time.monotonic()
+        probing = self._probe is not None and now < self._probe_expires
+        if state == "open" or (state == "half-open" and probing):
+            retry_in = self.reset_seconds - (now - self.opened_at)
+            raise CircuitOpenError("Claude API circuit breaker is open; upstream is failing", retry_after=max(retry_in, 1.0))
+        if state == "half-open":
+            self._probe = object()
+            self._probe_expires = now + (probe_timeout or self.reset_seconds)
+            return self._probe
+        return None
+
+    def release(self, probe: Optional[object]) -> None:
+        """End a probe claim that produced no verdict (cancelled, rate limited)."""
+        if probe is not None and probe is self._probe:
+            self._probe = None
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probe = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probe = None
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies, per key (model)."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, key: str, seconds: float) -> None:
+        self._samples[key].append(seconds)
+
+    def percentile(self, key: str, q: float) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def hedged(call: Callable[[], Awaitable], hedge_after: Optional[float]):
+    """Run call(); if it has not finished after hedge_after seconds, race a second copy.
+
+    Whatever ends the race, including the caller being cancelled, cancels the copies still running.
+    """
+    first = asyncio.ensure_future(call())
+    tasks = [first]
+    try:
+        if hedge_after is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+breaker = CircuitBreaker()
+latency = LatencyTracker()
+retry_policy = RetryPolicy()
@@ -0,0 +1,187 @@
+import asyncio
+import gzip
+import json
+import os
+import zlib
+from typing import Any, Optional
+
+import orjson
+from fastapi.responses import JSONResponse
+
+try:
+    import brotli
+except ImportError:  # brotli is optional: without it only gzip is offered
+    brotli = None
+
+# Bodies smaller than this go out uncompressed; the headers would eat most of the saving
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+# Brotli's higher qualities are for static assets; 4 compresses better than gzip -6 at similar speed
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+
+# Bodies this large are compressed on a worker thread instead of the event loop
+COMPRESS_OFFLOAD_BYTES = 256 * 1024
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/plain", "text/html", "text/markdown")
+# Streamed types compressed chunk by chunk; event streams are left alone so proxies never buffer them
+STREAMED_TYPES = ("application/x-ndjson",)
+
+
+def _default(obj: Any) -> Any:
+    # Mongo ObjectIds, without importing bson for the sqlite backend
+    if type(obj).__name__ == "ObjectId":
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "dict"):
+        return obj.dict()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """orjson with datetimes as isoformat() and ObjectIds as strings."""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def sse(event: str, data: dict) -> str:
+    """One server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON rendered by orjson. Returned directly from a route it also skips jsonable_encoder."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """The best encoding we support from an Accept-Encoding header, or None."""
+    offered = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip().lower()] = quality
+    supported = ("br", "gzip") if brotli is not None else ("gzip",)
+    best, best_quality = None, 0.0
+    for encoding in supported:
+        quality = offered.get(encoding, offered.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+class _StreamCompressor:
+    """Compresses a streamed body, flushing after every chunk so none is held back."""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            self._brotli = None
+            self._gzip = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._gzip.compress(data) + self._gzip.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self._brotli is not None:
+            return self._brotli.finish()
+        return self._gzip.flush()
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware: gzip or brotli, as the client accepts, for JSON and text responses.
+
+    Whole bodies of COMPRESS_MIN_BYTES or more are compressed in one go; streamed NDJSON
+    is compressed as it is sent. Anything already encoded passes through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value.decode("latin-1") for name, value in scope.get("headers", []) if name == b"accept-encoding"), "")
+        encoding = negotiate(accept)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "mode": None, "compressor": None}
+
+        async def compressing_send(message):
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether compression pays off
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body, more = message.get("body", b""), message.get("more_body", False)
+            if state["mode"] is None and state["start"] is not None:
+                start, state["start"] = state["start"], None
+                headers = dict(start["headers"])
+                content_type = headers.get(b"content-type", b"").decode("latin-1").split(";")[0].strip()
+                eligible = content_type in COMPRESSIBLE_TYPES and b"content-encoding" not in headers
+                if eligible and not more and len(body) >= COMPRESS_MIN_BYTES:
+                    if len(body) >= COMPRESS_OFFLOAD_BYTES:
+                        body = await asyncio.get_running_loop().run_in_executor(None, compress, body, encoding)
+                    else:
+                        body = compress(body, encoding)
+                    await send({**start, "headers": _encoded_headers(start["headers"], encoding, len(body))})
+                    state["mode"] = "whole"
+                    await send({"type": "http.response.body", "body": body, "more_body": False})
+                    return
+                if eligible and more and content_type in STREAMED_TYPES:
+                    state["mode"], state["compressor"] = "stream", _StreamCompressor(encoding)
+                    await send({**start, "headers": _encoded_headers(start["headers"], encoding, None)})
+                else:
+                    state["mode"] = "pass"
+                    if eligible:
+                        start = {**start, "headers": _with_vary(start["headers"])}
+                    await send(start)
+                    await send(message)
+                    return
+
+            if state["mode"] == "stream":
+                data = state["compressor"].chunk(body) if body else b""
+                if not more:
+                    data += state["compressor"].finish()
+                await send({"type": "http.response.body", "body": data, "more_body": more})
+            else:
+                await send(message)
+
+        await self.app(scope, receive, compressing_send)
+
+
+def _with_vary(headers) -> list:
+    vary = [value for name, value in headers if name == b"vary"]
+    if any(b"accept-encoding" in value.lower() for value in vary):
+        return list(headers)
+    return [(n, v) for n, v in headers if n != b"vary"] + [(b"vary", b", ".join(vary + [b"Accept-Encoding"]))]
+
+
+def _encoded_headers(headers, encoding: str, length: Optional[int]) -> list:
+    headers = [(name, value) for name, value in _with_vary(headers) if name != b"content-length"]
+    headers.append((b"content-encoding", encoding.encode("latin-1")))
+    if length is not None:
+        headers.append((b"content-length", str(length).encode("latin-1")))
+    return headers
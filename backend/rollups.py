@@ -0,0 +1,220 @@
+"""Per-minute and per-hour usage rollups, so dashboards never scan raw history.
+
+Each worker adds requests to in-memory buckets keyed by (granularity, bucket start,
+feature, model, mode) and periodically merges them into the history store's rollup
+table/collection with increments, so several workers can flush into the same rows.
+Latency goes into a log-bucketed sketch (ratio GAMMA between bucket bounds), which
+merges by adding counts and gives p50/p95/p99 within about 2%.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from logging_setup import fields
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_FLUSH_SECONDS = float(os.getenv("ROLLUP_FLUSH_SECONDS", "10"))
+# Minute buckets are for recent activity; hour buckets are kept
+ROLLUP_MINUTE_RETENTION_HOURS = float(os.getenv("ROLLUP_MINUTE_RETENTION_HOURS", "48"))
+# Unflushed bucket rows a worker keeps while the store is down; past this the oldest are dropped
+ROLLUP_MAX_PENDING = int(os.getenv("ROLLUP_MAX_PENDING", "10000"))
+GRANULARITIES = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1)}
+GROUP_FIELDS = ("feature", "model", "mode")
+GAMMA = 1.04
+PRUNE_EVERY = 360
+
+# Per-request accumulator for upstream token usage; set by middleware
+request_usage: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_usage", default=None)
+
+
+def add_usage(usage: dict) -> None:
+    accumulator = request_usage.get()
+    if accumulator is not None:
+        for name in ("input_tokens", "output_tokens"):
+            accumulator[name] = accumulator.get(name, 0) + (usage.get(name) or 0)
+
+
+def bucket_start(when: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return when.replace(minute=0, second=0, microsecond=0)
+    return when.replace(second=0, microsecond=0)
+
+
+def sketch_index(latency_ms: float) -> int:
+    return math.ceil(math.log(max(latency_ms, 0.01)) / math.log(GAMMA))
+
+
+def sketch_quantile(sketch: Dict[int, int], q: float) -> Optional[float]:
+    """Approximate q-quantile of the latencies a sketch holds, in ms."""
+    total = sum(sketch.values())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for index in sorted(sketch):
+        seen += sketch[index]
+        if seen > rank:
+            # Midpoint of the bucket (GAMMA**(index-1), GAMMA**index]
+            return round(2 * GAMMA ** index / (GAMMA + 1), 1)
+    return None
+
+
+def new_row() -> dict:
+    return {"count": 0, "cache_hits": 0, "latency_count": 0, "latency_ms_sum": 0.0,
+            "input_tokens": 0, "output_tokens": 0, "sketch": Counter()}
+
+
+def merge_row(into: dict, row: dict) -> dict:
+    for name in ("count", "cache_hits", "latency_count", "latency_ms_sum", "input_tokens", "output_tokens"):
+        into[name] += row.get(name) or 0
+    for index, count in (row.get("sketch") or {}).items():
+        into["sketch"][int(index)] += count
+    return into
+
+
+def summarize(row: dict) -> dict:
+    return {
+        "count": row["count"],
+        "cache_hits": row["cache_hits"],
+        "cache_hit_ratio": round(row["cache_hits"] / row["count"], 4) if row["count"] else None,
+        "latency_ms": {
+            "avg": round(row["latency_ms_sum"] / row["latency_count"], 1) if row["latency_count"] else None,
+            "p50": sketch_quantile(row["sketch"], 0.50),
+            "p95": sketch_quantile(row["sketch"], 0.95),
+            "p99": sketch_quantile(row["sketch"], 0.99),
+        },
+        "tokens": {"input": row["input_tokens"], "output": row["output_tokens"]},
+    }
+
+
+class Rollups:
+    """This worker's unflushed rollup deltas, written to `store` in the background."""
+
+    def __init__(self, store, max_pending: int = ROLLUP_MAX_PENDING):
+        self.store = store
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending: Dict[Tuple, dict] = {}
+        self._lock = Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._flushes = 0
+
+    def record(self, feature: str, model: Optional[str] = None, mode: Optional[str] = None,
+               latency_ms: Optional[float] = None, cache_hit: bool = False,
+               input_tokens: int = 0, output_tokens: int = 0, when: Optional[datetime] = None) -> None:
+        when = when or datetime.utcnow()
+        with self._lock:
+            added = False
+            for granularity in GRANULARITIES:
+                key = (granularity, bucket_start(when, granularity), feature, model or "", mode or "")
+                row = self._pending.get(key)
+                if row is None:
+                    row = self._pending[key] = new_row()
+                    added = True
+                row["count"] += 1
+                row["cache_hits"] += int(cache_hit)
+                if latency_ms is not None:
+                    row["latency_count"] += 1
+                    row["latency_ms_sum"] += latency_ms
+                    row["sketch"][sketch_index(latency_ms)] += 1
+                row["input_tokens"] += input_tokens or 0
+                row["output_tokens"] += output_tokens or 0
+            if added:
+                self._trim()
+
+    def _trim(self) -> None:
+        # Called with self._lock held
+        excess = len(self._pending) - self.max_pending
+        if excess <= 0:
+            return
+        # Minute rows go first: the hour rows still carry the same requests
+        for key in sorted(self._pending, key=lambda key: (key[0] != "minute", key[1]))[:excess]:
+            del self._pending[key]
+        self.dropped += excess
+        logger.warning("rollup buckets dropped", extra=fields(dropped=excess, total_dropped=self.dropped))
+
+    def _take(self) -> List[Tuple[Tuple, dict]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return list(pending.items())
+
+    async def flush(self) -> None:
+        if not self.store.ready:
+            # Kept in memory until the store is back
+            return
+        rows = self._take()
+        if not rows:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.store.add_rollups, rows)
+        except Exception as e:
+            # Put them back so the next flush retries
+            with self._lock:
+                for key, row in rows:
+                    merge_row(self._pending.setdefault(key, new_row()), row)
+                self._trim()
+            logger.warning("rollup flush failed", extra=fields(rows=len(rows), error=str(e)))
+            return
+        self._flushes += 1
+        if self._flushes % PRUNE_EVERY == 0:
+            cutoff = datetime.utcnow() - timedelta(hours=ROLLUP_MINUTE_RETENTION_HOURS)
+            try:
+                await loop.run_in_executor(None, self.store.prune_rollups, "minute", cutoff)
+            except Exception as e:
+                # The rows are flushed; pruning is retried PRUNE_EVERY flushes later
+                logger.warning("rollup prune failed", extra=fields(error=str(e)))
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                # Keep flushing on the next tick rather than ending the task
+                logger.error("rollup flush crashed", extra=fields(error=str(e)))
+
+    def start(self, interval: float = ROLLUP_FLUSH_SECONDS) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def stats(self, granularity: str, start: datetime, end: datetime, filters: dict,
+                    group_by: Iterable[str], series: bool = False) -> dict:
+        """Totals per group over [start, end), merged from stored rollups only."""
+        # Include this worker's latest requests instead of waiting for the timer
+        await self.flush()
+        rows = await asyncio.get_running_loop().run_in_executor(
+            None, self.store.find_rollups, granularity, bucket_start(start, granularity), end, filters
+        )
+        group_by = [name for name in GROUP_FIELDS if name in group_by]
+        groups: Dict[Tuple, dict] = {}
+        buckets: Dict[datetime, dict] = {}
+        for row in rows:
+            merge_row(groups.setdefault(tuple(row[name] for name in group_by), new_row()), row)
+            if series:
+                merge_row(buckets.setdefault(row["bucket"], new_row()), row)
+        result = {
+            "granularity": granularity,
+            "start": bucket_start(start, granularity).isoformat(),
+            "end": end.isoformat(),
+            "groups": [
+                {**{name: value or None for name, value in zip(group_by, key)}, **summarize(row)}
+                for key, row in sorted(groups.items(), key=lambda item: -item[1]["count"])
+            ],
+        }
+        if series:
+            result["series"] = [{"bucket": bucket.isoformat(), **summarize(row)} for bucket, row in sorted(buckets.items())]
+        return result
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Header, HTTPException, Query
+from typing import Optional
+import hmac
+import os
+from profiling import profile_control
+
+router = APIRouter()
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(token: Optional[str]):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@router.post("/admin/profile")
+async def start_profiling(
+    requests: int = Query(1, ge=1, le=100),
+    feature: Optional[str] = Query(None),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Profile the next N requests (optionally of one feature) and dump collapsed stacks locally."""
+    require_admin(x_admin_token)
+    profile_control.arm(requests, feature)
+    return profile_control.status()
+
+@router.get("/admin/profile")
+async def profiling_status(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    return profile_control.status()
+
+@router.delete("/admin/profile")
+async def stop_profiling(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    profile_control.disarm()
+    return profile_control.status()
@@ -1,64 +1,163 @@
 from fastapi import APIRouter, Request
 from pydantic import BaseModel
+from typing import Optional
 import httpx
 import os
 import asyncio
+import logging
 from time import perf_counter
-from db import save_to_history, find_similar_history
+from db import log_history, find_similar_history, get_history
+from llm import make_claude_request, claude_headers, response_text
+from token_diet import TokenDiet
+from model_router import route_model, ROUTING
+from qa_sessions import qa_sessions, compact, QASession
+from logging_setup import fields
+from prompt_templates import render
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class AskQAInput(BaseModel):
     question: str
     code: str = ""  # Make code optional with default empty string
+    session_id: Optional[str] = None  # Follow-ups in a session may omit unchanged code
 
-CLAUDE_MODEL = "claude-sonnet-4-20250514"
-MAX_RETRIES = 3
 TIMEOUT = 60.0
 
+async def call_claude(headers: dict, body: dict, session_id: Optional[str] = None):
+    """Post a messages request and return (raw response, concatenated text)."""
+    async with httpx.AsyncClient(timeout=TIMEOUT) as client:
+        data = await make_claude_request(client, headers, body, feature="ask-qa", session_id=session_id)
+    return data, response_text(data)
+
+async def summarize_turns(headers: dict, previous: str, turns: list) -> str:
+    transcript = "\n\n".join(f"{turn['role'].upper()}: {turn['content']}" for turn in turns)
+    prompt = (
+        "Update the running summary of a Q&A conversation about some code. Keep facts, decisions, "
+        "names and conclusions a follow-up question might depend on; drop pleasantries and code listings. "
+        "Reply with the updated summary only, under 150 words.\n\n"
+        f"Current summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"
+    )
+    body = {
+        "model": ROUTING["models"]["fast"],
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 400,
+        "temperature": 0.2
+    }
+    _, text = await call_claude(headers, body)
+    return text.strip()
+
+async def ask_in_session(session: QASession, question: str, diet: TokenDiet, headers: dict, code_changed: bool = False) -> dict:
+    """Answer a follow-up using the cached code context, rolling summary and recent turns only.
+
+    The code is written to history with the turn that set it, so the session can be rebuilt
+    once it expires from shared state.
+    """
+    compacted = await compact(session, lambda previous, turns: summarize_turns(headers, previous, turns))
+    route = route_model("ask-qa", question, has_code=bool(session.code) or "```" in question)
+    body = {
+        "model": route.model,
+        "system": session.system_blocks(),
+        "messages": session.messages(question),
+        "max_tokens": 2048,
+        "temperature": 0.5
+    }
+
+    start = perf_counter()
+    data, full_response = await call_claude(headers, body, session.session_id)
+    if not full_response:
+        full_response = "No response received from Claude"
+    session.add_exchange(question, full_response)
+    # Publish the new turn so the next follow-up sees it whichever worker it lands on
+    await qa_sessions.save(session)
+
+    log_history(
+        feature="ask-qa",
+        user_input=question,
+        claude_prompt=question,
+        claude_response=full_response,
+        response_time_ms=(perf_counter() - start) * 1000,
+        metadata={
+            "model": route.model,
+            "session_id": session.session_id,
+            "session_turns": len(session.turns) // 2,
+            "session_compacted": compacted,
+            "code_hash": session.code_hash or None,
+            "session_code": session.code if code_changed else None,
+            "input_tokens": data.get("usage", {}).get("input_tokens"),
+            "routing": route.telemetry((perf_counter() - start) * 1000, data, full_response),
+            "token_diet": diet.report()
+        }
+    )
+    return {
+        "response": full_response,
+        "session_id": session.session_id,
+        "has_code_context": bool(session.code)
+    }
+
+async def rehydrate_session(session: QASession) -> bool:
+    """Rebuild a session that has expired from shared state from history: recent turns and code.
+
+    Returns False when the session had code that is no longer in the history window.
+    """
+    docs = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: get_history(feature="ask-qa", session_id=session.session_id, limit=10)
+    )
+    for doc in reversed(docs):
+        session.turns.append({"role": "user", "content": doc.get("input", "")})
+        session.turns.append({"role": "assistant", "content": doc.get("claude_response", "")})
+    # Newest first: the latest turn says which code was current, an earlier one may hold it
+    code_hash = docs[0].get("metadata", {}).get("code_hash") if docs else None
+    if not code_hash:
+        return True
+    for doc in docs:
+        metadata = doc.get("metadata", {})
+        if metadata.get("code_hash") == code_hash and metadata.get("session_code"):
+            session.set_code(metadata["session_code"])
+            return True
+    return False
+
 @router.post("/ask-qa")
 async def ask_qa(input: AskQAInput):
-    print(f"[DEBUG] Processing ask-qa request for question: {input.question[:50]}...")
-    
-    # Build prompt based on whether code is provided
-    if input.code.strip():
-        prompt = (
-            "Answer the following question about the code in a clear and concise way.\n\n"
-            "IMPORTANT: Keep your response focused and to the point. Include:\n\n"
-            "1. A brief, clear explanation (2-3 paragraphs max)\n"
-            "   - Use simple, professional language\n"
-            "   - Focus on the key points\n"
-            "   - Use emojis sparingly for clarity\n\n"
-            "2. Relevant code examples in code blocks\n"
-            "   - Include proper language specification\n"
-            "   - Add brief comments\n"
-            "   - Keep examples concise\n\n"
-            f"Question: {input.question}\n\n"
-            f"Code:\n{input.code}\n\n"
-            "Keep the total response under 500 words and focus on the most important information."
-        )
-    else:
-        prompt = (
-            "Answer the following programming question in a clear and concise way.\n\n"
-            "IMPORTANT: Keep your response focused and to the point. Include:\n\n"
-            "1. A brief, clear explanation (2-3 paragraphs max)\n"
-            "   - Use simple, professional language\n"
-            "   - Focus on the key points\n"
-            "   - Use emojis sparingly for clarity\n\n"
-            "2. Relevant code examples in code blocks\n"
-            "   - Include proper language specification\n"
-            "   - Add brief comments\n"
-            "   - Keep examples concise\n\n"
-            f"Question: {input.question}\n\n"
-            "Keep the total response under 500 words and focus on the most important information."
-        )
+    logger.debug("ask-qa request", extra=fields(question=input.question, code_chars=len(input.code), session_id=input.session_id))
+
+    diet = TokenDiet("ask-qa")
+    dieted = diet.apply_all({"question": (input.question, "prose"), "code": (input.code, "code")})
+    question, code = dieted["question"], dieted["code"]
+
+    if input.session_id:
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            return {"error": "ANTHROPIC_API_KEY not set in environment"}
+        session = await qa_sessions.get(input.session_id)
+        code_changed = False
+        if not session.turns and not session.code:
+            try:
+                code_restored = await rehydrate_session(session)
+            except Exception as e:
+                logger.warning("could not rehydrate session", extra=fields(session_id=input.session_id, error=str(e)))
+                code_restored = True
+            if not code_restored and not code.strip():
+                # Answering without the code would be wrong; the client resends it and retries
+                return {"session_id": input.session_id, "code_required": True, "has_code_context": False}
+            # Written again with the next turn, so it stays inside the history window
+            code_changed = bool(session.code)
+        if code.strip():
+            code_changed = session.set_code(code) or code_changed
+        try:
+            return await ask_in_session(session, question, diet, claude_headers(api_key), code_changed)
+        except Exception as e:
+            logger.error("session request failed", extra=fields(session_id=input.session_id, error=str(e)))
+            return {"error": str(e)}
+
+    prompt = render("ask-qa@1", question=question, code=code if code.strip() else "")
 
     # Check for similar question in history
     if len(input.question.split()) > 4 and not input.question.lower().startswith("solve this"):
         context = f"{input.question} {input.code}"
         similar_response = await find_similar_history("ask-qa", input.question, context)
         if similar_response:
-            print("[DEBUG] Found similar question in history, returning cached response")
+            logger.debug("returning cached response", extra=fields(source="mongo"))
             return {
                 "response": similar_response
             }
@@ -67,14 +166,12 @@ async def ask_qa(input: AskQAInput):
     if not api_key:
         return {"error": "ANTHROPIC_API_KEY not set in environment"}
 
-    headers = {
-        "x-api-key": api_key,
-        "anthropic-version": "2023-06-01",
-        "Content-Type": "application/json"
-    }
+    headers = claude_headers(api_key)
+
+    route = route_model("ask-qa", question, has_code=bool(code.strip()) or "```" in question)
 
     body = {
-        "model": CLAUDE_MODEL,
+        "model": route.model,
         "messages": [
             {
                 "role": "user",
@@ -89,45 +186,31 @@ async def ask_qa(input: AskQAInput):
     start = perf_counter()
     
     try:
-        print("[DEBUG] Making request to Claude API")
-        async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-            response = await client.post(
-                "https://api.anthropic.com/v1/messages",
-                headers=headers,
-                json=body,
-                timeout=TIMEOUT
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            print(f"[DEBUG] Claude API response received")
-            
-            # Extract the text content from Claude's response
-            full_response = ""
-            for block in data.get("content", []):
-                if block.get("type") == "text":
-                    text = block.get("text", "")
-                    full_response += text
-            
-            if not full_response:
-                full_response = "No response received from Claude"
-            
-            print(f"[DEBUG] Response length: {len(full_response)}")
-            
-            # Save to history
-            save_to_history(
-                feature="ask-qa",
-                user_input=body["messages"][0]["content"],
-                claude_prompt=body["messages"][0]["content"],
-                claude_response=full_response,
-                response_time_ms=(perf_counter() - start) * 1000,
-                metadata={"model": CLAUDE_MODEL}
-            )
-            
-            return {
-                "response": full_response
+        data, full_response = await call_claude(headers, body)
+
+        if not full_response:
+            full_response = "No response received from Claude"
+
+        logger.debug("claude response", extra=fields(model=route.model, response_chars=len(full_response)))
+
+        # Save to history
+        log_history(
+            feature="ask-qa",
+            user_input=question,
+            claude_prompt=prompt,
+            claude_response=full_response,
+            response_time_ms=(perf_counter() - start) * 1000,
+            metadata={
+                "model": route.model,
+                "routing": route.telemetry((perf_counter() - start) * 1000, data, full_response),
+                "token_diet": diet.report()
             }
-            
+        )
+
+        return {
+            "response": full_response
+        }
+
     except Exception as e:
-        print(f"[DEBUG] Exception in ask_qa: {e}")
+        logger.error("request failed", extra=fields(error=str(e)))
         return {"error": str(e)}
@@ -4,15 +4,23 @@ import httpx
 import os
 from typing import List, Optional, Dict
 import asyncio
+import json
+import logging
 from time import perf_counter
-from db import save_to_history
+from db import log_history, rollups
 from db import find_similar_history
+from metrics import CACHE_LOOKUP_SECONDS
+from llm import make_claude_request, claude_headers, response_text
+from token_diet import TokenDiet
+from model_router import route_model
+from scenario_library import ScenarioLibrary
+from logging_setup import fields
+from prompt_templates import RenderedPrompt, gitops_instructions, gitops_params, render
 
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-CLAUDE_MODEL = "claude-sonnet-4-20250514"
-MAX_RETRIES = 3
 TIMEOUT = 60.0  # Increased timeout to 60 seconds
 
 class GitOpsRequest(BaseModel):
@@ -36,26 +44,6 @@ GIT_SCENARIOS = {
     "conflict": "I have merge conflicts"
 }
 
-async def make_claude_request(client, headers, body, retry_count=0):
-    try:
-        response = await client.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=body,
-            timeout=TIMEOUT
-        )
-        response.raise_for_status()
-        return response.json()
-    except httpx.TimeoutException as e:
-        if retry_count < MAX_RETRIES:
-            print(f"Timeout occurred, retrying... (attempt {retry_count + 1}/{MAX_RETRIES})")
-            await asyncio.sleep(1 * (retry_count + 1))  # Exponential backoff
-            return await make_claude_request(client, headers, body, retry_count + 1)
-        raise Exception(f"Claude API timed out after {MAX_RETRIES} retries: {str(e)}")
-    except httpx.HTTPStatusError as e:
-        raise Exception(f"Claude API returned HTTP error: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Claude API failed: {str(e)}")
 
 def create_scenario_prompt(scenario_type: str, error_message: Optional[str] = None) -> str:
     base_prompts = {
@@ -78,225 +66,214 @@ async def get_git_scenarios():
     """Get available Git scenarios for non-coders"""
     return {"scenarios": GIT_SCENARIOS}
 
-@router.post("/gitops")
-async def gitops_handler(request: GitOpsRequest):
-    prompt = None
-    summary = None
-    suggestions = []
-    warnings = []
-    command = None
-    steps = []
-    beginner_explanation = None
-
-    # Build the prompt based on the request type
-    if request.instruction:
-        prompt = f"Generate a Git command for: {request.instruction}\n\n"
-        prompt += "IMPORTANT: Keep your response focused and to the point. Provide:\n\n"
-        prompt += "1. A brief explanation of what the command does (1-2 sentences)\n"
-        prompt += "2. The exact Git command to run\n"
-        prompt += "3. Any important warnings or notes\n\n"
-        prompt += "Keep the total response under 300 words."
-        
-    elif request.error_message:
-        prompt = f"Help me fix this Git error: {request.error_message}\n\n"
-        prompt += "IMPORTANT: Keep your response focused and to the point. Provide:\n\n"
-        prompt += "1. A brief explanation of the error (1-2 sentences)\n"
-        prompt += "2. Step-by-step solution (3-4 steps max)\n"
-        prompt += "3. The commands to run\n\n"
-        prompt += "Keep the total response under 400 words."
-        
-    elif request.scenario_type:
-        scenario = GIT_SCENARIOS.get(request.scenario_type, request.scenario_type)
-        prompt = f"Help me with this Git scenario: {scenario}\n\n"
-        prompt += "IMPORTANT: Keep your response focused and to the point. Provide:\n\n"
-        prompt += "1. A brief explanation of the scenario (1-2 sentences)\n"
-        prompt += "2. Step-by-step solution (3-4 steps max)\n"
-        prompt += "3. The commands to run\n\n"
-        prompt += "Keep the total response under 400 words."
-        
-    elif request.git_log or request.branch_status:
-        context = f"Git Log: {request.git_log}\nBranch Status: {request.branch_status}"
-        prompt = f"Analyze this Git status and provide guidance:\n{context}\n\n"
-        prompt += "IMPORTANT: Keep your response focused and to the point. Provide:\n\n"
-        prompt += "1. A brief analysis of the current state (1-2 sentences)\n"
-        prompt += "2. Recommended next steps (2-3 steps max)\n"
-        prompt += "3. Any relevant commands\n\n"
-        prompt += "Keep the total response under 300 words."
-        
-    elif request.commit_messages:
-        messages = "\n".join(request.commit_messages)
-        prompt = f"Review these commit messages and provide feedback:\n{messages}\n\n"
-        prompt += "IMPORTANT: Keep your response focused and to the point. Provide:\n\n"
-        prompt += "1. Brief feedback on the commit messages (1-2 sentences)\n"
-        prompt += "2. Suggestions for improvement\n"
-        prompt += "3. Examples of better commit messages\n\n"
-        prompt += "Keep the total response under 300 words."
-        
-    elif request.pr_diff:
-        prompt = f"Review this pull request diff and provide feedback:\n{request.pr_diff}\n\n"
-        prompt += "IMPORTANT: Keep your response focused and to the point. Provide:\n\n"
-        prompt += "1. Brief analysis of the changes (1-2 sentences)\n"
-        prompt += "2. Key suggestions for improvement\n"
-        prompt += "3. Any potential issues to address\n\n"
-        prompt += "Keep the total response under 400 words."
-        
-    else:
-        prompt = "Provide general Git guidance and best practices.\n\n"
-        prompt += "IMPORTANT: Keep your response focused and to the point. Provide:\n\n"
-        prompt += "1. Brief overview of Git best practices (2-3 paragraphs max)\n"
-        prompt += "2. Key commands to remember\n"
-        prompt += "3. Common workflow tips\n\n"
-        prompt += "Keep the total response under 500 words."
+def build_prompt(request: GitOpsRequest) -> RenderedPrompt:
+    """Base prompt for a request; this is also the text used for the similarity cache."""
+    return render("gitops@2", **gitops_params(request.dict(), GIT_SCENARIOS))
 
-    if len(prompt.split()) > 4 and not prompt.lower().startswith("solve this"):
-        context = prompt  # can include more if needed
-        cached = await find_similar_history("gitops", prompt, context)
-        if cached:
-            print("[DEBUG] Returning cached response from MongoDB...")
-            return {
-                "summary": cached,
-                "command": cached,
-                "warnings": [],
-                "suggestions": [cached],
-                "steps": [],
-                "beginner_explanation": None,
-                "explain_terms_enabled": request.explain_terms
-            }
 
-    if request.explain_terms:
-        prompt += "\n\nAlso define any technical Git terms used in your explanation so a beginner can understand them easily."
+def add_instructions(prompt: RenderedPrompt, request: GitOpsRequest) -> RenderedPrompt:
+    """Extra instructions appended after the cache lookup."""
+    return prompt.with_params(**gitops_instructions(request.dict()))
 
-    # Add request for step-by-step instructions and beginner explanation
-    if request.scenario_type or request.error_message:
-        prompt += "\n\nPlease provide:\n1. Step-by-step instructions to fix this\n2. A simple explanation for beginners"
 
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    if not api_key:
-        return {"error": "ANTHROPIC_API_KEY not set in environment"}
+def route_request(request: GitOpsRequest):
+    return route_model(
+        "gitops",
+        " ".join(filter(None, [request.instruction, request.error_message])),
+        scenario_type=None if request.error_message else request.scenario_type,
+        has_code=bool(request.pr_diff or request.git_log or request.branch_status or request.commit_messages),
+    )
 
-    headers = {
-        "x-api-key": api_key,
-        "anthropic-version": "2023-06-01",
-        "Content-Type": "application/json"
-    }
 
+# Forcing this tool makes every reply one JSON object of this shape, so nothing is parsed from prose
+GITOPS_ANSWER_TOOL = {
+    "name": "gitops_answer",
+    "description": "Answer the user's Git question.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "summary": {"type": "string", "description": "A brief explanation or analysis (1-2 sentences)."},
+            "commands": {"type": "array", "items": {"type": "string"}, "description": "Git commands to run, in order, one per item."},
+            "steps": {"type": "array", "items": {"type": "string"}, "description": "Step-by-step instructions, one step per item."},
+            "warnings": {"type": "array", "items": {"type": "string"}, "description": "Risks to know about before running the commands."},
+            "beginner_explanation": {"type": "string", "description": "A simple explanation for beginners."},
+        },
+        "required": ["summary", "commands", "steps", "warnings"],
+    },
+}
+
+# Dangerous command detector, applied to the commands only
+RISKY_PATTERNS = ("--force", "git push origin main", "rm -rf .git")
+RISKY_WARNING = "⚠️ This command is risky. Are you sure you want to do this?"
+
+
+def validate_answer(answer) -> dict:
+    """The tool input checked against GITOPS_ANSWER_TOOL, with optional fields filled in."""
+    if not isinstance(answer, dict) or not isinstance(answer.get("summary"), str):
+        raise ValueError("gitops answer has no summary")
+    result = {"summary": answer["summary"].strip()}
+    for name in ("commands", "steps", "warnings"):
+        items = answer.get(name) or []
+        if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+            raise ValueError(f"gitops answer field '{name}' is not a list of strings")
+        result[name] = [item.strip() for item in items if item.strip()]
+    explanation = answer.get("beginner_explanation")
+    if explanation is not None and not isinstance(explanation, str):
+        raise ValueError("gitops answer field 'beginner_explanation' is not a string")
+    result["beginner_explanation"] = (explanation or "").strip() or None
+    risky = any(pattern in command for command in result["commands"] for pattern in RISKY_PATTERNS)
+    if risky and RISKY_WARNING not in result["warnings"]:
+        result["warnings"].append(RISKY_WARNING)
+    return result
+
+
+def cached_answer(text: str) -> dict:
+    """A gitops response from history: the stored answer, or the free text older versions stored."""
+    try:
+        return validate_answer(json.loads(text))
+    except ValueError:
+        pass
+    return {"summary": text.strip(), "commands": [], "steps": [], "warnings": [], "beginner_explanation": None}
+
+
+def respond(request: GitOpsRequest, answer: dict) -> dict:
+    return {**answer, "explain_terms_enabled": request.explain_terms}
+
+
+async def call_claude(headers: dict, model: str, prompt: str):
+    """Send one gitops prompt upstream and return (raw response, validated answer)."""
     body = {
-        "model": CLAUDE_MODEL,
+        "model": model,
         "messages": [
             {"role": "user", "content": prompt}
         ],
+        "tools": [GITOPS_ANSWER_TOOL],
+        "tool_choice": {"type": "tool", "name": GITOPS_ANSWER_TOOL["name"]},
         "max_tokens": 2048,
         "temperature": 0.5
     }
+    async with httpx.AsyncClient(timeout=TIMEOUT) as client:
+        data = await make_claude_request(client, headers, body, feature="gitops")
+
+    tool_input = next((
+        block.get("input") for block in data.get("content", [])
+        if block.get("type") == "tool_use" and block.get("name") == GITOPS_ANSWER_TOOL["name"]
+    ), None)
+    if tool_input is None:
+        raise Exception(f"[Claude ERROR] No gitops answer in response (stop_reason {data.get('stop_reason')})")
+    return data, validate_answer(tool_input)
+
+
+async def generate_scenario_response(scenario_type: str, explain_terms: bool) -> dict:
+    """Render and answer a canned scenario; used to fill the precomputed library."""
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise Exception("ANTHROPIC_API_KEY not set in environment")
+    request = GitOpsRequest(scenario_type=scenario_type, explain_terms=explain_terms)
+    _, answer = await call_claude(claude_headers(api_key), route_request(request).model, render_scenario_prompt(scenario_type, explain_terms))
+    return respond(request, answer)
+
+
+def render_scenario_prompt(scenario_type: str, explain_terms: bool) -> str:
+    request = GitOpsRequest(scenario_type=scenario_type, explain_terms=explain_terms)
+    return add_instructions(build_prompt(request), request)
+
+
+def scenario_fingerprint(scenario_type: str, explain_terms: bool) -> str:
+    """Everything besides the prompt that shapes a stored answer: the model and the answer schema."""
+    request = GitOpsRequest(scenario_type=scenario_type, explain_terms=explain_terms)
+    return route_request(request).model + json.dumps(GITOPS_ANSWER_TOOL, sort_keys=True)
+
+
+scenario_library = ScenarioLibrary(
+    scenarios=list(GIT_SCENARIOS),
+    render_prompt=render_scenario_prompt,
+    generate=generate_scenario_response,
+    fingerprint=scenario_fingerprint,
+)
+
+
+@router.post("/gitops")
+async def gitops_handler(request: GitOpsRequest):
+    # Canned scenario buttons without an error message are answered from memory
+    if request.scenario_type and not (
+        request.instruction or request.error_message or request.git_log or request.branch_status
+        or request.commit_messages or request.pr_diff
+    ):
+        start = perf_counter()
+        with CACHE_LOOKUP_SECONDS.time(feature="gitops", layer="library", result="miss") as labels:
+            precomputed = scenario_library.lookup(request.scenario_type, bool(request.explain_terms))
+            if precomputed:
+                labels["result"] = "hit"
+        if precomputed:
+            rollups.record("gitops", latency_ms=(perf_counter() - start) * 1000, cache_hit=True)
+            return precomputed
+
+    # Normalize and bound the free-form inputs before they reach the prompt
+    diet = TokenDiet("gitops")
+    dieted = diet.apply_all({
+        "instruction": (request.instruction, "prose"),
+        "error_message": (request.error_message, "code"),
+        "git_log": (request.git_log, "git_log"),
+        "branch_status": (request.branch_status, "code"),
+        "pr_diff": (request.pr_diff, "code"),
+        "commit_messages": ("\n".join(request.commit_messages) if request.commit_messages else None, "git_log"),
+    })
+    request.instruction, request.error_message = dieted["instruction"], dieted["error_message"]
+    request.git_log, request.branch_status, request.pr_diff = dieted["git_log"], dieted["branch_status"], dieted["pr_diff"]
+    if request.commit_messages:
+        request.commit_messages = dieted["commit_messages"].split("\n")
+
+    prompt = build_prompt(request)
+
+    if len(prompt.split()) > 4 and not prompt.lower().startswith("solve this"):
+        context = prompt  # can include more if needed
+        cached = await find_similar_history("gitops", prompt, context)
+        if cached:
+            logger.debug("returning cached response", extra=fields(source="mongo"))
+            return respond(request, cached_answer(cached))
+
+    prompt = add_instructions(prompt, request)
+
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        return {"error": "ANTHROPIC_API_KEY not set in environment"}
+
+    route = route_request(request)
 
     start = perf_counter()
     try:
-        async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-            data = await make_claude_request(client, headers, body)
-            
-            output = ""
-            for block in data.get("content", []):
-                if block.get("type") == "text":
-                    text = block.get("text", "")
-                    output += text
-
-            if not output:
-                output = f"[Claude ERROR] Unexpected response: {data}"
-
-            # Improved parsing for steps and beginner explanation
-            if request.scenario_type or request.error_message:
-                # Look for step patterns in the response
-                lines = output.split('\n')
-                current_step = None
-                for line in lines:
-                    line = line.strip()
-                    if line.lower().startswith(('step', '1.', '2.', '3.', '4.', '5.')):
-                        if current_step:
-                            steps.append(current_step)
-                        current_step = line
-                    elif current_step and line:
-                        current_step += '\n' + line
-                    elif 'beginner' in line.lower() or 'simple' in line.lower():
-                        if not beginner_explanation:
-                            beginner_explanation = line
-                        else:
-                            beginner_explanation += '\n' + line
-                
-                if current_step:
-                    steps.append(current_step)
-
-            # Better parsing for steps and beginner explanation
-            if request.scenario_type or request.error_message:
-                # Clear any previous parsing
-                steps = []
-                beginner_explanation = None
-                
-                # Split by sections and look for step patterns
-                sections = output.split('\n\n')
-                for section in sections:
-                    section = section.strip()
-                    if not section:
-                        continue
-                    
-                    # Check if this section contains steps
-                    if any(section.lower().startswith(('step', '1.', '2.', '3.', '4.', '5.')) for line in section.split('\n')):
-                        steps.append(section)
-                    # Check if this section is for beginners
-                    elif 'beginner' in section.lower() or 'simple' in section.lower():
-                        beginner_explanation = section
-
-            # Dangerous Command Detector
-            risky_patterns = ["--force", "git push origin main", "rm -rf .git"]
-            if any(p in output for p in risky_patterns):
-                warnings.append("⚠️ This command is risky. Are you sure you want to do this?")
-
-            # Try to parse for command, summary, suggestions
-            if request.instruction:
-                command = output.strip()
-            elif request.error_message or request.git_log or request.branch_status:
-                summary = output.strip()
-            elif request.commit_messages or request.pr_diff:
-                suggestions.append(output.strip())
-
-            # Fallback parsing
-            if not command and 'git ' in output:
-                command = output.strip()
-            if not summary:
-                summary = output.strip()
-            if not suggestions:
-                suggestions.append(output.strip())
-
-            print("[DEBUG Claude Output]", output)
-            print("[DEBUG Command Parsed]", command)
-            print("[DEBUG Summary Parsed]", summary)
-            print("[DEBUG Suggestions Parsed]", suggestions)
-
-            # Save to history
-            save_to_history(
-                feature="gitops",
-                user_input=str(request.dict()),
-                claude_prompt=prompt,
-                claude_response=output,
-                response_time_ms=(perf_counter() - start) * 1000,
-                metadata={
-                    "model": CLAUDE_MODEL,
-                    "scenario_type": request.scenario_type,
-                    "has_steps": bool(steps),
-                    "has_beginner_explanation": bool(beginner_explanation)
-                }
-            )
-
-            return {
-                "summary": summary,
-                "command": command,
-                "warnings": warnings,
-                "suggestions": suggestions,
-                "steps": steps,
-                "beginner_explanation": beginner_explanation,
-                "explain_terms_enabled": request.explain_terms
+        data, answer = await call_claude(claude_headers(api_key), route.model, prompt)
+        # Stored as the answer JSON, so cache hits return it as it is
+        output = json.dumps(answer, ensure_ascii=False)
+
+        logger.debug(
+            "claude answer received",
+            extra=fields(model=route.model, output_chars=len(output), commands=len(answer["commands"]),
+                         steps=len(answer["steps"]), warnings=len(answer["warnings"])),
+        )
+
+        # Save to history
+        log_history(
+            feature="gitops",
+            user_input=str(request.dict()),
+            claude_prompt=prompt,
+            claude_response=output,
+            response_time_ms=(perf_counter() - start) * 1000,
+            metadata={
+                "model": route.model,
+                "routing": route.telemetry((perf_counter() - start) * 1000, data, output),
+                "scenario_type": request.scenario_type,
+                "has_steps": bool(answer["steps"]),
+                "has_beginner_explanation": bool(answer["beginner_explanation"]),
+                "response_format": GITOPS_ANSWER_TOOL["name"],
+                "token_diet": diet.report()
             }
+        )
+
+        return respond(request, answer)
 
     except Exception as e:
         error_msg = str(e)
-        print(f"Claude Exception: {error_msg}")
-        raise HTTPException(status_code=500, detail=error_msg)
\ No newline at end of file
+        logger.error("claude request failed", extra=fields(error=error_msg, model=route.model))
+        raise HTTPException(status_code=500, detail=error_msg)
@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from typing import Optional
 from datetime import datetime
-from db import get_history
+from db import export_history, get_history, rollups, utc_naive
+from responses import ORJSONResponse, dumps
+from rollups import GRANULARITIES, GROUP_FIELDS
 
 router = APIRouter()
 
@@ -29,9 +32,64 @@ async def history(
         end_date=end_date,
         limit=limit
     )
-    # Convert ObjectId and datetime to string for JSON serialization
-    for r in results:
-        r["_id"] = str(r["_id"])
-        if "timestamp" in r:
-            r["timestamp"] = r["timestamp"].isoformat()
-    return {"results": results}
+    # Returned as a response so orjson serializes ObjectIds and datetimes itself,
+    # instead of jsonable_encoder walking every document first
+    return ORJSONResponse({"results": results})
+
+
+@router.get("/history/export")
+def history_export(
+    feature: Optional[str] = Query(None),
+    session_id: Optional[str] = Query(None),
+    model: Optional[str] = Query(None),
+    mode: Optional[str] = Query(None),
+    file_type: Optional[str] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    include_archive: bool = Query(True)
+):
+    """
+    Stream matching history as NDJSON, oldest first, including archived documents.
+    """
+    docs = export_history(
+        feature=feature,
+        session_id=session_id,
+        model=model,
+        mode=mode,
+        file_type=file_type,
+        start_date=start_date,
+        end_date=end_date,
+        include_archive=include_archive
+    )
+
+    return StreamingResponse((dumps(doc) + b"\n" for doc in docs), media_type="application/x-ndjson")
+
+
+# Default window per granularity when no start_date is given
+STATS_WINDOWS = {"minute": 60, "hour": 24}
+
+@router.get("/history/stats")
+async def history_stats(
+    granularity: str = Query("hour"),
+    feature: Optional[str] = Query(None),
+    model: Optional[str] = Query(None),
+    mode: Optional[str] = Query(None),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    group_by: str = Query("feature"),
+    series: bool = Query(False)
+):
+    """
+    Request counts, cache-hit ratio, latency percentiles and token totals from the rollups.
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    groups = [name.strip() for name in group_by.split(",") if name.strip()]
+    unknown = [name for name in groups if name not in GROUP_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"cannot group by {', '.join(unknown)}")
+    end = utc_naive(end_date) or datetime.utcnow()
+    start = utc_naive(start_date) or end - GRANULARITIES[granularity] * STATS_WINDOWS[granularity]
+    values = {"feature": feature, "model": model, "mode": mode}
+    filters = {name: value for name, value in values.items() if value}
+    return await rollups.stats(granularity, start, end, filters, groups, series=series)
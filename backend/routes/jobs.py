@@ -0,0 +1,107 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+import asyncio
+from jobs import job_manager, TERMINAL_STATUSES
+from responses import sse
+from routes.refactor import RefactorInput, refactor_code
+from routes.screen_assist import ScreenAssistSessionInput, screen_assist
+
+router = APIRouter()
+
+SSE_KEEPALIVE_SECONDS = 15.0
+
+# Features that may run as background jobs, with the input model that validates them
+JOB_FEATURES = {
+    "refactor": RefactorInput,
+    "screen-assist": ScreenAssistSessionInput,
+}
+
+async def run_refactor_job(payload: dict) -> dict:
+    result = await refactor_code(RefactorInput(**payload))
+    if "error" in result:
+        raise Exception(result["error"])
+    return result
+
+async def run_screen_assist_job(payload: dict) -> dict:
+    result = await screen_assist(ScreenAssistSessionInput(**payload), None)
+    if "error" in result:
+        raise Exception(result["error"])
+    return result
+
+job_manager.register("refactor", run_refactor_job)
+job_manager.register("screen-assist", run_screen_assist_job)
+
+def public_job(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "feature": job["feature"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "expires_at": job["expires_at"],
+    }
+
+@router.post("/jobs/{feature}", status_code=202)
+async def submit_job(feature: str, request: Request):
+    """Queue a long-running refactor or screen-assist request and return its id immediately."""
+    model = JOB_FEATURES.get(feature)
+    if model is None:
+        raise HTTPException(status_code=404, detail=f"Jobs are not supported for '{feature}'")
+    try:
+        payload = model(**(await request.json())).dict()
+    except (ValidationError, ValueError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    job_id = await job_manager.submit(feature, payload)
+    return JSONResponse(status_code=202, content={
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+    })
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return public_job(job)
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: the current state, then progress until the job finishes."""
+    # Subscribe before reading the state so no event can slip in between
+    queue = job_manager.subscribe(job_id)
+    job = await job_manager.get(job_id)
+    if job is None:
+        job_manager.unsubscribe(job_id, queue)
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+
+    async def stream():
+        try:
+            yield sse("status", public_job(job))
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # The job may be running in another worker process; fall back to the store
+                    current = await job_manager.get(job_id)
+                    if current is None or current["status"] in TERMINAL_STATUSES:
+                        if current is not None:
+                            yield sse(current["status"], public_job(current))
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse(event, data)
+                if event in TERMINAL_STATUSES:
+                    return
+        finally:
+            job_manager.unsubscribe(job_id, queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -3,53 +3,184 @@ from pydantic import BaseModel
 import httpx
 import os
 from time import perf_counter
-from db import save_to_history
+from db import log_history
 from db import find_similar_history
+from llm import make_claude_request
+from chunking import split_code, reassemble, extract_code_block
+from unit_cache import unit_cache, unit_key
+from token_diet import TOKEN_BUDGETS, count_tokens
+from jobs import report_progress
+from metrics import CACHE_LOOKUP_SECONDS
+from logging_setup import fields
+from tracing import span
+from prompt_templates import RenderedPrompt, render
+from typing import Optional
 import asyncio
+import logging
 
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class RefactorInput(BaseModel):
     code: str
     mode: str = "readability"
     target_language: str = "same"  # Default to same language as input
+    large_file: Optional[bool] = None  # None = decide from the file size
+    incremental: bool = False  # Reuse cached refactorings of unchanged functions/classes
 
 CLAUDE_MODEL = "claude-sonnet-4-20250514"
 
-MAX_RETRIES = 3
+# Files longer than this are split into top-level units and refactored in parallel
+LARGE_FILE_LINES = int(os.getenv("REFACTOR_LARGE_FILE_LINES", "300"))
+CHUNK_CONCURRENCY = int(os.getenv("REFACTOR_CHUNK_CONCURRENCY", "8"))
+
 TIMEOUT = 60.0  # Increased timeout to 60 seconds
 
-async def make_claude_request(client, headers, body, retry_count=0):
-    try:
-        response = await client.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=body,
-            timeout=TIMEOUT
-        )
-        response.raise_for_status()
-        return response.json()
-    except httpx.TimeoutException as e:
-        if retry_count < MAX_RETRIES:
-            print(f"Timeout occurred, retrying... (attempt {retry_count + 1}/{MAX_RETRIES})")
-            await asyncio.sleep(1 * (retry_count + 1))  # Exponential backoff
-            return await make_claude_request(client, headers, body, retry_count + 1)
-        raise Exception(f"Claude API timed out after {MAX_RETRIES} retries: {str(e)}")
-    except httpx.HTTPStatusError as e:
-        raise Exception(f"Claude API returned HTTP error: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Claude API failed: {str(e)}")
+
+def build_unit_prompt(input: RefactorInput, unit, context: str) -> RenderedPrompt:
+    return render(
+        "refactor.unit@1", mode=input.mode, target_language=input.target_language, context=context,
+        kind=unit.kind, name=unit.name, start_line=unit.start_line, end_line=unit.end_line, source=unit.source,
+    )
+
+
+async def refactor_unit(client, headers, input: RefactorInput, unit, context: str, semaphore: asyncio.Semaphore, progress: Optional[dict] = None,
+                        feature: str = "refactor", session_id: Optional[str] = None) -> dict:
+    async with semaphore:
+        start = perf_counter()
+        body = {
+            "model": CLAUDE_MODEL,
+            "messages": [{"role": "user", "content": build_unit_prompt(input, unit, context)}],
+            # Room for the whole unit plus a summary line: roughly 1 token per 3 characters
+            "max_tokens": min(8192, max(1024, len(unit.source) // 3 + 512)),
+            "temperature": 0.5
+        }
+        try:
+            with span("refactor.unit", unit=unit.name):
+                data = await make_claude_request(client, headers, body, feature=feature, session_id=session_id)
+            text = "".join(block.get("text", "") for block in data.get("content", []) if block.get("type") == "text")
+            summary, code = extract_code_block(text)
+            if code is None or data.get("stop_reason") == "max_tokens":
+                raise Exception("incomplete response, keeping original code")
+            status = "ok"
+        except Exception as e:
+            logger.warning("unit refactor failed", extra=fields(unit=unit.name, error=str(e)))
+            summary, code, status = str(e), unit.source, "error"
+        elapsed_ms = round((perf_counter() - start) * 1000, 1)
+        if progress is not None:
+            progress["done"] += 1
+            await report_progress(stage="refactor", unit=unit.name, status=status, elapsed_ms=elapsed_ms, **progress)
+        return {
+            "name": unit.name,
+            "kind": unit.kind,
+            "start_line": unit.start_line,
+            "end_line": unit.end_line,
+            "status": status,
+            "summary": summary,
+            "code": code,
+            "elapsed_ms": elapsed_ms,
+        }
+
+
+def cached_unit_result(unit, cached: dict) -> dict:
+    return {
+        "name": unit.name,
+        "kind": unit.kind,
+        "start_line": unit.start_line,
+        "end_line": unit.end_line,
+        "status": "cached",
+        "summary": cached["summary"],
+        "code": cached["code"],
+        "elapsed_ms": 0.0,
+    }
+
+
+async def refactor_large_file(input: RefactorInput, headers: dict, feature: str = "refactor", session_id: Optional[str] = None) -> dict:
+    """Refactor a file unit by unit in parallel and stitch the results back in order.
+
+    In incremental mode every function/class is its own unit and units whose content
+    hash is already cached are reused, so only edited units go upstream.
+    """
+    with span("refactor.split"):
+        split = split_code(input.code, merge=not input.incremental)
+    context = "\n".join(filter(None, [split.header, *split.signatures]))
+    semaphore = asyncio.Semaphore(CHUNK_CONCURRENCY)
+    target_language = input.target_language if input.mode == 'modern' else "same"
+    keys = [unit_key(unit.source, input.mode, target_language, CLAUDE_MODEL) for unit in split.units]
+
+    results = [None] * len(split.units)
+    pending = []
+    for i, unit in enumerate(split.units):
+        cached = None
+        if input.incremental:
+            with CACHE_LOOKUP_SECONDS.time(feature=feature, layer="l1", result="miss") as labels:
+                cached = await unit_cache.get(keys[i])
+                if cached is not None:
+                    labels["result"] = "hit"
+        if cached is not None:
+            results[i] = cached_unit_result(unit, cached)
+        else:
+            pending.append(i)
+
+    start = perf_counter()
+    if pending:
+        progress = {"done": 0, "total": len(pending)}
+        async with httpx.AsyncClient(timeout=TIMEOUT) as client:
+            computed = await asyncio.gather(*(
+                refactor_unit(client, headers, input, split.units[i], context, semaphore, progress, feature, session_id)
+                for i in pending
+            ))
+        for i, result in zip(pending, computed):
+            results[i] = result
+            if result["status"] == "ok":
+                await unit_cache.set(keys[i], {"summary": result["summary"], "code": result["code"]})
+    elapsed_ms = (perf_counter() - start) * 1000
+
+    fence = split.language if split.language == "python" and input.target_language == "same" else ""
+    if input.mode == 'modern' and input.target_language != 'same':
+        fence = input.target_language.lower()
+    notes = "\n".join(f"- **{r['name']}**: {r['summary']}" for r in results if r["summary"])
+    code = reassemble(split.header, [r["code"] for r in results])
+    reused = len(results) - len(pending)
+    reuse_note = f" Reused {reused} unchanged units from cache." if reused else ""
+    output = f"Refactored {len(pending)} units in parallel ({input.mode} mode).{reuse_note}\n\n{notes}\n\n```{fence}\n{code}```"
+
+    log_history(
+        feature="refactor",
+        user_input=input.code,
+        claude_prompt=build_unit_prompt(input, split.units[0], context) if split.units else "",
+        claude_response=output,
+        response_time_ms=elapsed_ms,
+        metadata={
+            "mode": input.mode,
+            "target_language": input.target_language if input.mode == 'modern' else None,
+            "model": CLAUDE_MODEL,
+            "large_file": True,
+            "incremental": input.incremental,
+            "units": len(results),
+            "recomputed_units": len(pending),
+            "failed_units": sum(1 for r in results if r["status"] != "ok")
+        }
+    )
+
+    return {
+        "refactored": output,
+        "units": [{k: v for k, v in r.items() if k != "code"} for r in results],
+        "recomputed": [split.units[i].name for i in pending],
+        "elapsed_ms": round(elapsed_ms, 1),
+    }
+
 
 @router.post("/refactor")
 async def refactor_code(input: RefactorInput):
-    if len(input.code.split()) > 4:
+    if len(input.code.split()) > 4 and not input.incremental:
         context = f"{input.code} {input.mode}"
         if input.mode == 'modern':
             context += f" {input.target_language}"
         cached = await find_similar_history("refactor", input.code, context)
         if cached:
-            print("[DEBUG] Returning cached response from MongoDB...")
+            logger.debug("returning cached response", extra=fields(source="mongo"))
             return {"refactored": cached}
 
     api_key = os.getenv("ANTHROPIC_API_KEY")
@@ -61,42 +192,32 @@ async def refactor_code(input: RefactorInput):
         "anthropic-version": "2023-06-01",
         "Content-Type": "application/json"
     }
+    return await refactor_file(input, headers)
+
+
+async def refactor_file(input: RefactorInput, headers: dict, feature: str = "refactor", session_id: Optional[str] = None) -> dict:
+    """Refactor one file, in a single request or unit by unit; `feature` and `session_id` set its upstream priority."""
+    large_file = input.large_file
+    if large_file is None:
+        # Code over the single-request budget would be truncated, so chunk it instead
+        large_file = (
+            input.code.count("\n") + 1 > LARGE_FILE_LINES
+            or count_tokens(input.code) > TOKEN_BUDGETS["refactor"]
+        )
+    if large_file or input.incremental:
+        try:
+            return await refactor_large_file(input, headers, feature, session_id)
+        except Exception as e:
+            logger.error("large file refactor failed", extra=fields(error=str(e)))
+            return {"error": str(e)}
 
-    # Only include language conversion for modern mode
-    language_conversion = f"Convert the code to {input.target_language} and " if input.mode == 'modern' and input.target_language != 'same' else ""
-    
+    prompt = render("refactor.file@1", code=input.code, mode=input.mode, target_language=input.target_language)
     body = {
         "model": CLAUDE_MODEL,
         "messages": [
             {
                 "role": "user",
-                "content": f"""You are an expert code refactoring assistant. {language_conversion}Refactor the provided code according to the specified mode.
-
-Mode: {input.mode}
-
-If the mode is 'modern':
-  - Convert the code to modern JavaScript/TypeScript practices
-  - Use ES6+ features, async/await, arrow functions, destructuring, etc.
-  - {f"Convert the code to {input.target_language}" if input.target_language != 'same' else "Keep the same programming language but modernize the syntax"}
-If the mode is 'clean', improve code readability and structure.
-If the mode is 'optimize', focus on performance improvements.
-If the mode is 'security', focus on security improvements and vulnerability fixes.
-
-IMPORTANT: Keep your response focused and to the point. Include:
-
-1. A brief explanation of the changes made (1-2 paragraphs max)
-   - Use simple, professional language
-   - Focus on the key improvements
-   - Use emojis sparingly for clarity
-
-2. The refactored code in a code block with proper language specification
-   - Add brief comments
-   - Keep the code clean and readable
-
-Code to refactor:
-{input.code}
-
-Keep the total response under 500 words and focus on the most important changes."""
+                "content": prompt
             }
         ],
         "max_tokens": 2048,
@@ -106,7 +227,7 @@ Keep the total response under 500 words and focus on the most important changes.
     start = perf_counter()
     try:
         async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-            data = await make_claude_request(client, headers, body)
+            data = await make_claude_request(client, headers, body, feature=feature, session_id=session_id)
             
             output = ""
             for block in data.get("content", []):
@@ -118,10 +239,10 @@ Keep the total response under 500 words and focus on the most important changes.
                 output = f"[Claude ERROR] Unexpected response: {data}"
 
             # Save to history
-            save_to_history(
+            log_history(
                 feature="refactor",
                 user_input=input.code,
-                claude_prompt=body["messages"][0]["content"],
+                claude_prompt=prompt,
                 claude_response=output,
                 response_time_ms=(perf_counter() - start) * 1000,
                 metadata={
@@ -135,5 +256,5 @@ Keep the total response under 500 words and focus on the most important changes.
 
     except Exception as e:
         error_msg = str(e)
-        print(f"Claude Exception: {error_msg}")
+        logger.error("claude request failed", extra=fields(error=error_msg))
         return {"error": error_msg}
@@ -0,0 +1,222 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from collections import Counter
+from time import perf_counter
+from typing import AsyncIterator, Dict, List
+import asyncio
+import logging
+import os
+import re
+import uuid
+from batch_files import (
+    ARCHIVE_FORMATS, ARCHIVE_MEDIA_TYPES, BatchInputError, SourceFile,
+    archive_path, output_collisions, output_path, purge_archives, read_list, read_upload, write_archive,
+)
+from chunking import extract_code_block
+from llm import claude_headers
+from logging_setup import fields
+from responses import dumps, sse
+from routes.refactor import CLAUDE_MODEL, RefactorInput, refactor_file
+from unit_cache import file_cache, unit_key
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+class BatchFile(BaseModel):
+    path: str
+    code: str
+
+class RefactorBatchInput(BaseModel):
+    files: List[BatchFile] = []
+    mode: str = "readability"
+    target_language: str = "same"
+    incremental: bool = False
+    format: str = "zip"  # result archive: zip or tar (.tar.gz)
+
+# Files refactored at once per batch; the upstream scheduler still bounds the total
+BATCH_CONCURRENCY = int(os.getenv("REFACTOR_BATCH_CONCURRENCY", "8"))
+
+BATCH_ID = re.compile(r"^[0-9a-f]{32}$")
+# Statuses whose code in the archive is the refactored version
+REFACTORED = ("ok", "cached", "duplicate")
+
+
+async def read_batch(request: Request):
+    """(files, options) from a multipart zip/tar upload or a JSON body with a file list."""
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("archive")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=422, detail="multipart uploads need a zip or tar file in the 'archive' field")
+            options = RefactorBatchInput(**{name: form[name] for name in ("mode", "target_language", "incremental", "format") if name in form})
+            files = await asyncio.get_running_loop().run_in_executor(None, read_upload, upload.filename, upload.file)
+        else:
+            options = RefactorBatchInput(**(await request.json()))
+            files = read_list(file.dict() for file in options.files)
+    except (ValidationError, BatchInputError, ValueError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if options.format not in ARCHIVE_FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {', '.join(ARCHIVE_FORMATS)}")
+    if not files:
+        raise HTTPException(status_code=422, detail="no files to refactor")
+    return files, options
+
+
+async def refactor_source(source: SourceFile, key: str, options: RefactorBatchInput, headers: dict,
+                          batch_id: str, semaphore: asyncio.Semaphore) -> dict:
+    """Refactor one distinct file, or reuse the result for identical content from any earlier batch."""
+    cached = await file_cache.get(key)
+    if cached is not None:
+        return {"status": "cached", "summary": cached["summary"], "code": cached["code"], "elapsed_ms": 0.0}
+    async with semaphore:
+        start = perf_counter()
+        # Always unit by unit, even for small files: the unit prompt asks for code only, sizes
+        # max_tokens to it and rejects truncated answers, where the chat-style single-file
+        # prompt caps the answer at 500 words
+        input = RefactorInput(code=source.code, mode=options.mode, target_language=options.target_language,
+                              incremental=options.incremental, large_file=True)
+        # Bulk priority, and one scheduler session per batch so batches share upstream capacity fairly
+        result = await refactor_file(input, headers, feature="refactor-batch", session_id=batch_id)
+        elapsed_ms = round((perf_counter() - start) * 1000, 1)
+    if "error" in result:
+        return {"status": "error", "summary": result["error"], "code": source.code, "elapsed_ms": elapsed_ms}
+    failed = [unit["name"] for unit in result["units"] if unit["status"] == "error"]
+    if failed:
+        # Never archived or cached half-refactored: the next batch retries it
+        return {"status": "error", "summary": f"incomplete response for {', '.join(failed)}, keeping original code",
+                "code": source.code, "elapsed_ms": elapsed_ms}
+    summary, code = extract_code_block(result["refactored"])
+    if code is None:
+        return {"status": "error", "summary": "no code block in the response, keeping original code",
+                "code": source.code, "elapsed_ms": elapsed_ms}
+    await file_cache.set(key, {"summary": summary, "code": code})
+    return {"status": "ok", "summary": summary, "code": code, "elapsed_ms": elapsed_ms}
+
+
+async def run_batch(batch_id: str, files: List[SourceFile], options: RefactorBatchInput, headers: dict) -> AsyncIterator[dict]:
+    """Yield a start event, one event per file as it completes, then a done event with the archive URL.
+
+    Files with identical content (same mode and target language) are refactored once; the
+    copies are reported as soon as the first one finishes. A batch that cannot produce its
+    archive (two files mapping to one archive name, or a failed write) ends with an error event.
+    """
+    start = perf_counter()
+    collisions = output_collisions((source.path for source in files if source.code is not None),
+                                   options.mode, options.target_language)
+    if collisions:
+        yield {"event": "error", "batch_id": batch_id, "reason": "output_collision",
+               "detail": f"files would overwrite each other in the archive: {', '.join(collisions)}"}
+        return
+    target_language = options.target_language if options.mode == "modern" else "same"
+    groups: Dict[str, List[SourceFile]] = {}
+    for source in files:
+        if source.code is not None:
+            groups.setdefault(unit_key(source.code, options.mode, target_language, CLAUDE_MODEL), []).append(source)
+    skipped = [source for source in files if source.code is None]
+    results: Dict[str, dict] = {}
+    progress = {"done": 0, "total": len(files)}
+
+    def file_event(source: SourceFile, result: dict) -> dict:
+        results[source.path] = result
+        progress["done"] += 1
+        result["output_path"] = source.path
+        if result["status"] in REFACTORED:
+            result["output_path"] = output_path(source.path, options.mode, options.target_language)
+        event = {"event": "file", "path": source.path}
+        event.update({name: value for name, value in result.items() if name != "code"})
+        return {**event, **progress}
+
+    yield {"event": "start", "batch_id": batch_id, "files": len(files), "unique": len(groups), "skipped": len(skipped)}
+    for source in skipped:
+        yield file_event(source, {"status": "skipped", "summary": source.skipped, "elapsed_ms": 0.0})
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def refactor_group(key: str):
+        source = groups[key][0]
+        try:
+            return key, await refactor_source(source, key, options, headers, batch_id, semaphore)
+        except Exception as e:
+            # One file's failure must not end the batch
+            logger.error("batch file refactor failed", extra=fields(batch_id=batch_id, path=source.path, error=str(e)))
+            return key, {"status": "error", "summary": str(e), "code": source.code, "elapsed_ms": 0.0}
+
+    tasks = [asyncio.ensure_future(refactor_group(key)) for key in groups]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, result = await next_done
+            first, *copies = groups[key]
+            yield file_event(first, result)
+            for duplicate in copies:
+                status = "duplicate" if result["status"] in REFACTORED else result["status"]
+                yield file_event(duplicate, {**result, "status": status, "duplicate_of": first.path, "elapsed_ms": 0.0})
+    finally:
+        # The client went away: stop the rest
+        for task in tasks:
+            task.cancel()
+
+    counts = Counter(result["status"] for result in results.values())
+    manifest = {
+        "batch_id": batch_id,
+        "mode": options.mode,
+        "target_language": options.target_language,
+        "files": [{"path": path, **{name: value for name, value in result.items() if name != "code"}} for path, result in results.items()],
+    }
+    outputs = [(result["output_path"], result["code"]) for result in results.values() if "code" in result]
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, write_archive, archive_path(batch_id, options.format), options.format, outputs, manifest)
+        await loop.run_in_executor(None, purge_archives)
+    except Exception as e:
+        logger.error("refactor batch archive failed", extra=fields(batch_id=batch_id, error=str(e)))
+        yield {"event": "error", "batch_id": batch_id, "reason": "archive_failed", "detail": str(e)}
+        return
+    elapsed_ms = round((perf_counter() - start) * 1000, 1)
+    logger.info("refactor batch finished", extra=fields(batch_id=batch_id, files=len(files), unique=len(groups),
+                                                         elapsed_ms=elapsed_ms, **counts))
+    yield {"event": "done", "batch_id": batch_id, "archive_url": f"/refactor/batch/{batch_id}/archive",
+           "counts": dict(counts), "elapsed_ms": elapsed_ms}
+
+
+@router.post("/refactor/batch")
+async def refactor_batch(request: Request):
+    """
+    Refactor many files at once: a zip/tar upload (multipart field 'archive', plus mode,
+    target_language, incremental and format fields) or a JSON body with a 'files' list.
+
+    Progress streams as NDJSON, or as server-sent events with Accept: text/event-stream.
+    With Accept: application/zip (or application/gzip for format=tar) the response is
+    the result archive itself, once every file is done.
+    """
+    files, options = await read_batch(request)
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        return {"error": "ANTHROPIC_API_KEY not set in environment"}
+
+    batch_id = uuid.uuid4().hex
+    events = run_batch(batch_id, files, options, claude_headers(api_key))
+    accept = request.headers.get("accept", "")
+    if ARCHIVE_MEDIA_TYPES[options.format] in accept:
+        async for event in events:
+            if event["event"] == "error":
+                status = 409 if event["reason"] == "output_collision" else 500
+                raise HTTPException(status_code=status, detail=event["detail"])
+        return FileResponse(archive_path(batch_id, options.format), media_type=ARCHIVE_MEDIA_TYPES[options.format],
+                            filename=f"refactored-{batch_id}{ARCHIVE_FORMATS[options.format]}")
+    if "text/event-stream" in accept:
+        stream = (sse(event["event"], event) async for event in events)
+        return StreamingResponse(stream, media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    return StreamingResponse((dumps(event) + b"\n" async for event in events), media_type="application/x-ndjson")
+
+
+@router.get("/refactor/batch/{batch_id}/archive")
+async def refactor_batch_archive(batch_id: str):
+    """The result archive of a finished batch, for REFACTOR_BATCH_TTL seconds."""
+    if BATCH_ID.match(batch_id):
+        for fmt, extension in ARCHIVE_FORMATS.items():
+            path = archive_path(batch_id, fmt)
+            if os.path.exists(path):
+                return FileResponse(path, media_type=ARCHIVE_MEDIA_TYPES[fmt], filename=f"refactored-{batch_id}{extension}")
+    raise HTTPException(status_code=404, detail="Batch archive not found or expired")
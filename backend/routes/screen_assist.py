@@ -13,11 +13,27 @@ import datetime
 from time import perf_counter
 from typing import Dict, List, Optional
 import asyncio
+import contextvars
+import functools
+import hashlib
+import logging
 import re
+import uuid
 from difflib import get_close_matches
 from anthropic import Anthropic
+from token_diet import TokenDiet, merge_ocr_frames
+from db import log_history
+from llm import make_claude_request
+from deadline import bounded, remaining, DeadlineExceeded
+from jobs import report_progress
+from admission import admission
+from logging_setup import fields
+from tracing import span
+from metrics import CACHE_LOOKUP_SECONDS, OCR_DECODE_SECONDS, OCR_ENGINE_SECONDS, OCR_FRAME_SECONDS, OCR_PREPROCESS_SECONDS
+from shared_state import shared_state
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 class ScreenAssistInput(BaseModel):
     image_base64: str
@@ -29,15 +45,23 @@ class ScreenAssistSessionInput(BaseModel):
     session_id: str
     is_final: bool = False
 
-session_ocr_blobs: Dict[str, Dict] = {}
+# OCR text of frames sent with is_final=false, kept until the session's final call
+SCREEN_SESSION_TTL = float(os.getenv("SCREEN_SESSION_TTL", "600"))
+# Identical frames (the same screen captured twice, retries) reuse the earlier OCR text
+OCR_CACHE_TTL = float(os.getenv("OCR_CACHE_TTL", "3600"))
 
+# Include recognised text (truncated) in debug logs; off by default since it can be large
 DEBUG_OCR_LOG = os.getenv("DEBUG_OCR_LOG", "false").lower() == "true"
 
+def ocr_fields(text: str, **values) -> dict:
+    if DEBUG_OCR_LOG:
+        values["text"] = text
+    return fields(chars=len(text), **values)
+
 # Initialize EasyOCR reader once
 easyocr_reader = easyocr.Reader(['en'], gpu=False)
 
 CLAUDE_MODEL = "claude-sonnet-4-20250514"
-MAX_RETRIES = 3
 TIMEOUT = 20.0  # Reduced timeout to 20 seconds
 OCR_TIMEOUT = 5.0  # OCR timeout
 
@@ -123,7 +147,7 @@ def extract_simple_text_from_image(image):
         return f"Found {len(text_regions)} potential text regions in image"
         
     except Exception as e:
-        print(f"Simple text extraction error: {str(e)}")
+        logger.warning("simple text extraction failed", extra=fields(error=str(e)))
         return "Image processing failed"
 
 # Common programming keywords for fuzzy matching
@@ -167,26 +191,90 @@ def clean_ocr_text(text: str, lang="python") -> str:
         cleaned_lines.append(cleaned_line)
     return "\n".join(cleaned_lines)
 
-async def make_claude_request(client, headers, body, retry_count=0):
+
+def ocr_image(img_b64: str, idx: int, tesseract_timeout: float = 0) -> str:
+    """Decode one frame and run the Tesseract -> EasyOCR -> contour fallback chain."""
+    frame_start = perf_counter()
+    with OCR_DECODE_SECONDS.time():
+        with span("ocr.base64"):
+            image_data = base64.b64decode(img_b64.split(',')[-1])
+        with span("ocr.imdecode"):
+            np_arr = np.frombuffer(image_data, np.uint8)
+            img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+    if img is None:
+        logger.warning("failed to decode image", extra=fields(frame=idx + 1))
+        return ""
+
+    # Preprocess image
+    with OCR_PREPROCESS_SECONDS.time(), span("ocr.preprocess"):
+        processed_img = preprocess_image(img)
+
+    # Use pytesseract first, fallback to easyocr, then fallback to simple extraction
+    ocr_text = ""
+    engine = "tesseract"
     try:
-        response = await client.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=body,
-            timeout=TIMEOUT
-        )
-        response.raise_for_status()
-        return response.json()
-    except httpx.TimeoutException as e:
-        if retry_count < MAX_RETRIES:
-            print(f"Timeout occurred, retrying... (attempt {retry_count + 1}/{MAX_RETRIES})")
-            await asyncio.sleep(1 * (retry_count + 1))  # Exponential backoff
-            return await make_claude_request(client, headers, body, retry_count + 1)
-        raise Exception(f"Claude API timed out after {MAX_RETRIES} retries: {str(e)}")
-    except httpx.HTTPStatusError as e:
-        raise Exception(f"Claude API returned HTTP error: {str(e)}")
-    except Exception as e:
-        raise Exception(f"Claude API failed: {str(e)}")
+        with OCR_ENGINE_SECONDS.time(engine="tesseract", outcome="error") as labels, span("ocr.tesseract"):
+            # A timeout kills the tesseract subprocess instead of letting it outlive the request
+            ocr_text = pytesseract.image_to_string(processed_img, timeout=tesseract_timeout)
+            if not ocr_text.strip():
+                labels["outcome"] = "empty"
+                raise ValueError("Tesseract returned empty text")
+            labels["outcome"] = "ok"
+        logger.debug("tesseract result", extra=ocr_fields(ocr_text, frame=idx + 1))
+    except Exception as tesseract_error:
+        logger.debug("tesseract failed", extra=fields(frame=idx + 1, error=str(tesseract_error)))
+        try:
+            engine = "easyocr"
+            with OCR_ENGINE_SECONDS.time(engine="easyocr", outcome="error") as labels, span("ocr.easyocr"):
+                result = easyocr_reader.readtext(processed_img)
+                labels["outcome"] = "ok"
+            ocr_text = "\n".join([line[1] for line in result if line[1].strip()])
+            logger.debug("easyocr result", extra=ocr_fields(ocr_text, frame=idx + 1))
+        except Exception as easyocr_error:
+            logger.warning("easyocr failed", extra=fields(frame=idx + 1, error=str(easyocr_error)))
+            engine = "contour"
+            with OCR_ENGINE_SECONDS.time(engine="contour", outcome="ok"), span("ocr.contour"):
+                ocr_text = extract_simple_text_from_image(img)
+            ocr_text = f"[OCR failed, fallback]: {ocr_text}"
+    OCR_FRAME_SECONDS.observe(perf_counter() - frame_start, engine=engine)
+    return ocr_text
+
+def timed_ocr_image(img_b64: str, idx: int, tesseract_timeout: float = 0):
+    """ocr_image plus the seconds it took, measured inside the worker thread."""
+    start = perf_counter()
+    with span("ocr.frame", frame=idx + 1):
+        ocr_text = ocr_image(img_b64, idx, tesseract_timeout)
+    return ocr_text, perf_counter() - start
+
+def frame_key(img_b64: str) -> str:
+    return hashlib.sha256(img_b64.split(',')[-1].encode("ascii", "ignore")).hexdigest()
+
+async def cached_ocr(key: str) -> Optional[str]:
+    with CACHE_LOOKUP_SECONDS.time(feature="screen-assist", layer="shared", result="miss") as labels:
+        text = await shared_state.aget("ocr", key)
+        if text is not None:
+            labels["result"] = "hit"
+    return text
+
+async def session_frames(session_id: str, ocr_texts: List[str], is_final: bool) -> List[str]:
+    """Add this call's frames to the session's; the final call takes them all and clears the session.
+
+    Stored in shared state under a lock, so a session's calls may land on different workers.
+    """
+    lock, owner = f"ocr-session:{session_id}", uuid.uuid4().hex
+    while not await shared_state.aacquire(lock, owner, ttl=10):
+        await asyncio.sleep(0.02)
+    try:
+        stored = await shared_state.aget("ocr-session", session_id) or []
+        frames = stored + ocr_texts
+        if is_final:
+            await shared_state.adelete("ocr-session", session_id)
+        else:
+            await shared_state.aset("ocr-session", session_id, frames, ttl=SCREEN_SESSION_TTL)
+        return frames
+    finally:
+        await shared_state.arelease(lock, owner)
 
 @router.post("/screen-assist")
 async def screen_assist(input: ScreenAssistSessionInput, request: Request):
@@ -197,56 +285,65 @@ async def screen_assist(input: ScreenAssistSessionInput, request: Request):
     if not image_list:
         return {"error": "No images provided."}
 
-    print(f"[DEBUG] Processing {len(image_list)} images for session {session_id}")
+    logger.debug("screen-assist request", extra=fields(frames=len(image_list), session_id=session_id))
     ocr_texts = []
     
-    for idx, img_b64 in enumerate(image_list):
-        try:
-            print(f"[DEBUG] Processing image {idx + 1}/{len(image_list)}")
-            image_data = base64.b64decode(img_b64.split(',')[-1])
-            np_arr = np.frombuffer(image_data, np.uint8)
-            img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-
-            if img is None:
-                print(f"[DEBUG] Failed to decode image {idx}")
+    loop = asyncio.get_running_loop()
+    # Reserve the estimated OCR cost up front so admission control sees the backlog
+    with admission.ocr.reserve(len(image_list)) as reservation:
+        for idx, img_b64 in enumerate(image_list):
+            key = frame_key(img_b64)
+            cached = await cached_ocr(key)
+            if cached is not None:
+                reservation.frame_done(0)
+                if cached.strip():
+                    ocr_texts.append(cached.strip())
+                logger.debug("frame done", extra=fields(frame=idx + 1, chars=len(cached.strip()), cached=True))
+                await report_progress(stage="ocr", frame=idx + 1, total=len(image_list))
                 continue
-
-            # Preprocess image
-            processed_img = preprocess_image(img)
-
-            # Use pytesseract first, fallback to easyocr, then fallback to simple extraction
-            print(f"[DEBUG] Running OCR on image {idx + 1}")
-            ocr_text = ""
             try:
-                ocr_text = pytesseract.image_to_string(processed_img)
-                if not ocr_text.strip():
-                    raise ValueError("Tesseract returned empty text")
-                print(f"[DEBUG] Tesseract OCR result for image {idx + 1}:\n{ocr_text}")
-            except Exception as tesseract_error:
-                print(f"[DEBUG] Tesseract failed: {tesseract_error}")
-                try:
-                    result = easyocr_reader.readtext(processed_img)
-                    ocr_text = "\n".join([line[1] for line in result if line[1].strip()])
-                    print(f"[DEBUG] EasyOCR fallback result for image {idx + 1}:\n{ocr_text}")
-                except Exception as easyocr_error:
-                    print(f"[DEBUG] EasyOCR failed: {easyocr_error}")
-                    ocr_text = extract_simple_text_from_image(img)
-                    ocr_text = f"[OCR failed, fallback]: {ocr_text}"
-
-            if ocr_text.strip():
-                ocr_texts.append(ocr_text.strip())
-                print(f"[DEBUG] Extracted text from image {idx + 1}")
-            else:
-                print(f"[DEBUG] No text extracted from image {idx + 1}")
+                # OCR runs in a worker thread so the event loop stays responsive and the
+                # request can be cancelled between frames when the client goes away
+                # Copy the context so log lines from the worker thread keep the request id
+                # Tesseract reads a timeout of 0 as "no limit", so an exhausted deadline must not get there
+                left = remaining()
+                if left is not None and left <= 0:
+                    raise DeadlineExceeded("Request deadline exceeded during ocr")
+                ocr_call = functools.partial(contextvars.copy_context().run, timed_ocr_image, img_b64, idx,
+                                             0 if left is None else left)
+                ocr_text, ocr_seconds = await bounded(
+                    loop.run_in_executor(None, ocr_call),
+                    stage="ocr",
+                )
+                reservation.frame_done(ocr_seconds)
+                if not ocr_text.startswith("[OCR failed"):
+                    await shared_state.aset("ocr", key, ocr_text, ttl=OCR_CACHE_TTL)
+                if ocr_text.strip():
+                    ocr_texts.append(ocr_text.strip())
+                logger.debug("frame done", extra=fields(frame=idx + 1, chars=len(ocr_text.strip()), ocr_ms=round(ocr_seconds * 1000, 1)))
+                await report_progress(stage="ocr", frame=idx + 1, total=len(image_list))
+
+            except DeadlineExceeded as e:
+                logger.info("deadline exceeded during ocr", extra=fields(frames_done=idx, frames=len(image_list)))
+                return {"error": str(e)}
+            except Exception as e:
+                logger.warning("error processing frame", extra=fields(frame=idx + 1, error=str(e)))
+                continue
 
-        except Exception as e:
-            print(f"[DEBUG] Error processing image {idx}: {str(e)}")
-            continue
-            
-    full_ocr = '\n'.join(ocr_texts)
-    full_ocr = clean_ocr_text(full_ocr, lang="python")
-    print(f"[DEBUG] Cleaned OCR Text:\n{full_ocr}")
-    print(f"[DEBUG] Total extracted text length: {len(full_ocr)}")
+    if session_id:
+        ocr_texts = await session_frames(session_id, ocr_texts, input.is_final)
+        if not input.is_final:
+            return {"session_id": session_id, "status": "pending", "frames": len(ocr_texts)}
+
+    # Consecutive frames mostly show the same screen; drop repeats and scroll overlap
+    with span("ocr.merge_frames"):
+        full_ocr = '\n'.join(merge_ocr_frames(ocr_texts))
+    with span("clean_ocr_text"):
+        full_ocr = clean_ocr_text(full_ocr, lang="python")
+    diet = TokenDiet("screen-assist")
+    with span("token_diet"):
+        full_ocr = diet.apply("ocr_text", full_ocr, kind="ocr")
+    logger.debug("cleaned ocr text", extra=ocr_fields(full_ocr))
     
     if not full_ocr.strip():
         fallback_message = (
@@ -281,9 +378,9 @@ async def screen_assist(input: ScreenAssistSessionInput, request: Request):
     
     start = perf_counter()
     try:
-        print(f"[DEBUG] Sending to Claude API")
+        await report_progress(stage="analysis")
         async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-            data = await make_claude_request(client, headers, body)
+            data = await make_claude_request(client, headers, body, feature="screen-assist", session_id=session_id, timeout=TIMEOUT)
             
             output = ""
             for block in data.get("content", []):
@@ -295,7 +392,21 @@ async def screen_assist(input: ScreenAssistSessionInput, request: Request):
                 output = f"[Claude ERROR] Unexpected response: {data}"
 
             processing_time = (perf_counter() - start) * 1000
-            print(f"[DEBUG] Total processing time: {processing_time:.2f}ms")
+            logger.debug("claude response", extra=fields(model=CLAUDE_MODEL, response_chars=len(output), elapsed_ms=round(processing_time, 1)))
+
+            log_history(
+                feature="screen-assist",
+                user_input=input.query,
+                claude_prompt=prompt,
+                claude_response=output,
+                response_time_ms=processing_time,
+                metadata={
+                    "model": CLAUDE_MODEL,
+                    "session_id": session_id,
+                    "frames": len(ocr_texts),
+                    "token_diet": diet.report()
+                }
+            )
 
             return {
                 "analysis": output,
@@ -305,5 +416,5 @@ async def screen_assist(input: ScreenAssistSessionInput, request: Request):
 
     except Exception as e:
         error_msg = str(e)
-        print(f"[DEBUG] Claude Exception: {error_msg}")
+        logger.error("claude request failed", extra=fields(error=error_msg))
         return {"error": error_msg}
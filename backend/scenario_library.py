@@ -0,0 +1,169 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+SCENARIO_LIBRARY_PATH = os.getenv(
+    "SCENARIO_LIBRARY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenario_library.json"),
+)
+SCENARIO_REFRESH_SECONDS = float(os.getenv("SCENARIO_REFRESH_SECONDS", str(24 * 3600)))
+SCENARIO_LIBRARY_WARM = os.getenv("SCENARIO_LIBRARY_WARM", "true").lower() == "true"
+
+
+class ScenarioLibrary:
+    """Precomputed gitops answers for the fixed scenario x explain_terms combinations.
+
+    Entries are keyed by a version hash of the rendered prompts plus whatever else shapes
+    an answer (`fingerprint`: the model and the answer schema), so editing a prompt
+    template, rerouting a scenario or changing the schema silently invalidates the
+    stored answers instead of serving stale ones.
+    The library can be generated offline (`python scenario_library.py`) and is
+    otherwise warmed at startup and refreshed in the background. Only the worker holding
+    the shared "scenario-library" lock regenerates; the others reload what it wrote.
+    """
+
+    LOCK_TTL = 600
+
+    def __init__(
+        self,
+        scenarios: List[str],
+        render_prompt: Callable[[str, bool], str],
+        generate: Callable[[str, bool], Awaitable[dict]],
+        path: str = SCENARIO_LIBRARY_PATH,
+        fingerprint: Optional[Callable[[str, bool], str]] = None,
+        state=None,
+    ):
+        self.scenarios = scenarios
+        self.render_prompt = render_prompt
+        self.generate = generate
+        self.path = path
+        self.fingerprint = fingerprint or (lambda scenario, explain: "")
+        self.state = state or shared_state
+        self.entries: Dict[str, dict] = {}
+        self.generated_at: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def key(scenario_type: str, explain_terms: bool) -> str:
+        return f"{scenario_type}|{int(bool(explain_terms))}"
+
+    def combinations(self):
+        return [(scenario, explain) for scenario in self.scenarios for explain in (False, True)]
+
+    @property
+    def version(self) -> str:
+        digest = hashlib.sha256()
+        for scenario, explain in self.combinations():
+            digest.update(self.render_prompt(scenario, explain).encode("utf-8"))
+            digest.update(self.fingerprint(scenario, explain).encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def lookup(self, scenario_type: str, explain_terms: bool) -> Optional[dict]:
+        entry = self.entries.get(self.key(scenario_type, explain_terms))
+        # Callers may mutate the response, so never hand out the stored object
+        return copy.deepcopy(entry) if entry is not None else None
+
+    def load(self) -> int:
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Scenario Library] Could not read {self.path}: {e}")
+            return 0
+        if stored.get("version") != self.version:
+            logger.info("[Scenario Library] Stored answers are for an older prompt version, ignoring them")
+            return 0
+        self.entries = stored.get("entries", {})
+        self.generated_at = stored.get("generated_at")
+        return len(self.entries)
+
+    def save(self) -> None:
+        # A temporary file of its own, so a concurrent save can never interleave with this one
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({
+                    "version": self.version,
+                    "generated_at": self.generated_at,
+                    "entries": self.entries,
+                }, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def refresh(self, only_missing: bool = False) -> int:
+        """Regenerate answers and swap them in; failed combinations keep their old answer.
+
+        Returns 0 without generating anything while another worker holds the lock.
+        """
+        owner = f"{os.getpid()}:{id(self)}"
+        if not await self.state.aacquire("scenario-library", owner, self.LOCK_TTL):
+            # Pick up whatever the regenerating worker saved last
+            self.load()
+            return 0
+        try:
+            return await self._refresh(only_missing)
+        finally:
+            await self.state.arelease("scenario-library", owner)
+
+    async def _refresh(self, only_missing: bool) -> int:
+        entries = dict(self.entries)
+        generated = 0
+        for scenario, explain in self.combinations():
+            key = self.key(scenario, explain)
+            if only_missing and key in entries:
+                continue
+            try:
+                entries[key] = await self.generate(scenario, explain)
+                generated += 1
+            except Exception as e:
+                logger.warning(f"[Scenario Library] Failed to generate {key}: {e}")
+        if generated:
+            self.entries = entries
+            self.generated_at = datetime.utcnow().isoformat()
+            try:
+                self.save()
+            except OSError as e:
+                logger.warning(f"[Scenario Library] Could not write {self.path}: {e}")
+        return generated
+
+    async def _run(self, interval: float) -> None:
+        await self.refresh(only_missing=True)
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh()
+
+    def start(self, interval: float = SCENARIO_REFRESH_SECONDS) -> None:
+        loaded = self.load()
+        logger.info(f"[Scenario Library] Loaded {loaded}/{len(self.combinations())} precomputed answers")
+        if SCENARIO_LIBRARY_WARM and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run(interval))
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+if __name__ == "__main__":
+    # Offline generation: python scenario_library.py
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from routes.gitops import scenario_library
+
+    count = asyncio.run(scenario_library.refresh())
+    print(f"Generated {count} answers into {scenario_library.path} (version {scenario_library.version})")
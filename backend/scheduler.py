@@ -0,0 +1,218 @@
+import asyncio
+import contextvars
+import itertools
+import os
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from metrics import QUEUE_WAIT_SECONDS
+
+# Upstream limits for the whole deployment; keep them a little under the account's real rate limits
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "50"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "80000"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Processes sharing those limits: each worker's buckets get an even share (gunicorn's WEB_CONCURRENCY)
+LLM_WORKERS = max(1, int(os.getenv("LLM_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+
+# Lower number = served first. Interactive features go ahead of bulk work.
+FEATURE_PRIORITY = {
+    "gitops": 0,
+    "ask-qa": 1,
+    "screen-assist": 2,
+    "refactor": 3,
+    "refactor-batch": 4,
+}
+DEFAULT_PRIORITY = 2
+
+# Per-request accumulator for time spent waiting on the scheduler; set by middleware
+request_queue_wait: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_queue_wait", default=None)
+
+
+class TokenBucket:
+    """Continuous-refill token bucket; capacity equals one minute of budget."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (0 if it is available now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def drain(self, seconds: float) -> None:
+        """Pretend the next `seconds` of refill were already spent (used after a 429)."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class Ticket:
+    def __init__(self, feature: str, session_key: str, tokens: int):
+        self.feature = feature
+        self.session_key = session_key
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.granted: Optional[float] = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def wait_ms(self) -> float:
+        end = self.granted if self.granted is not None else time.monotonic()
+        return (end - self.enqueued) * 1000
+
+
+class UpstreamScheduler:
+    """Admits upstream LLM calls under RPM/TPM buckets and a concurrency cap.
+
+    Waiting calls are grouped by feature priority; within a priority level sessions
+    are served round-robin so one busy session cannot starve the others.
+
+    The buckets live in this process, so the limits are split evenly across `workers`:
+    N workers together stay under the configured rate. Keeping them local means no
+    shared-state round trip per call; the cost is that one idle worker's share is not
+    lent to a busy one, and a 429 only holds back the worker that saw it.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = LLM_TOKENS_PER_MINUTE,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        workers: int = LLM_WORKERS,
+    ):
+        self.workers = workers
+        self.requests = TokenBucket(requests_per_minute / workers)
+        self.tokens = TokenBucket(tokens_per_minute / workers)
+        self.max_concurrency = max(1, max_concurrency // workers)
+        self.in_flight = 0
+        # priority -> session key -> waiting tickets (OrderedDict gives round-robin order)
+        self._queues: Dict[int, "OrderedDict[str, Deque[Ticket]]"] = defaultdict(OrderedDict)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._anonymous = itertools.count()
+        self.total_wait_ms: Dict[str, float] = defaultdict(float)
+        self.granted_count: Dict[str, int] = defaultdict(int)
+
+    def queued(self) -> Dict[str, int]:
+        counts: Dict[str, int] = defaultdict(int)
+        for sessions in self._queues.values():
+            for tickets in sessions.values():
+                for ticket in tickets:
+                    counts[ticket.feature] += 1
+        return dict(counts)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "workers": self.workers,
+            "queued": self.queued(),
+            "avg_wait_ms": {
+                feature: round(self.total_wait_ms[feature] / count, 1)
+                for feature, count in self.granted_count.items() if count
+            },
+        }
+
+    def _next_ticket(self) -> Optional[Ticket]:
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            while sessions:
+                session_key, tickets = next(iter(sessions.items()))
+                if tickets and tickets[0].future.cancelled():
+                    tickets.popleft()
+                if not tickets:
+                    del sessions[session_key]
+                    continue
+                return tickets[0]
+        return None
+
+    def _pop(self, ticket: Ticket) -> None:
+        sessions = self._queues[FEATURE_PRIORITY.get(ticket.feature, DEFAULT_PRIORITY)]
+        tickets = sessions.pop(ticket.session_key)
+        tickets.popleft()
+        if tickets:
+            # Re-insert at the back so the next session at this priority goes first
+            sessions[ticket.session_key] = tickets
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        while self.in_flight < self.max_concurrency:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(ticket.tokens))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            self._pop(ticket)
+            self.requests.take(1)
+            self.tokens.take(ticket.tokens)
+            self.in_flight += 1
+            ticket.granted = time.monotonic()
+            self.total_wait_ms[ticket.feature] += ticket.wait_ms
+            self.granted_count[ticket.feature] += 1
+            ticket.future.set_result(None)
+
+    def _schedule_dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    def penalize(self, seconds: float) -> None:
+        """Hold back all callers for `seconds`, e.g. when upstream answered 429."""
+        self.requests.drain(seconds)
+        self._schedule_dispatch()
+
+    def settle(self, ticket: Ticket, actual_tokens: Optional[int]) -> None:
+        """Correct the token bucket once the real usage of a call is known."""
+        if actual_tokens is not None:
+            self.tokens.take(actual_tokens - ticket.tokens)
+
+    @asynccontextmanager
+    async def slot(self, feature: str, session_id: Optional[str] = None, tokens: int = 1000):
+        ticket = Ticket(feature, session_id or f"anon-{next(self._anonymous)}", tokens)
+        sessions = self._queues[FEATURE_PRIORITY.get(feature, DEFAULT_PRIORITY)]
+        sessions.setdefault(ticket.session_key, deque()).append(ticket)
+        self._schedule_dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.granted is None:
+                # Still queued: drop it so it never takes a slot
+                tickets = sessions.get(ticket.session_key)
+                if tickets and ticket in tickets:
+                    tickets.remove(ticket)
+                raise
+            self._release()
+            raise
+
+        QUEUE_WAIT_SECONDS.observe(ticket.wait_ms / 1000, feature=feature, queue="upstream")
+        accumulator = request_queue_wait.get()
+        if accumulator is not None:
+            accumulator["ms"] = accumulator.get("ms", 0.0) + ticket.wait_ms
+        try:
+            yield ticket
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._schedule_dispatch()
+
+
+upstream_scheduler = UpstreamScheduler()
@@ -0,0 +1,398 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from logging_setup import fields
+
+logger = logging.getLogger(__name__)
+
+# State that must look the same from every gunicorn worker: caches, session blobs and
+# in-flight locks. "sqlite" shares a file between the workers of one node, "redis" shares
+# across nodes, and "local" keeps everything in this process (single worker only).
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "sqlite").lower()
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "shared_state.db"))
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "redis://localhost:6379/0")
+SHARED_STATE_PREFIX = os.getenv("SHARED_STATE_PREFIX", "shadowai")
+# Entry cap for the in-process backend
+SHARED_STATE_LOCAL_MAX = int(os.getenv("SHARED_STATE_LOCAL_MAX", "10000"))
+# How often a single-flight follower checks whether the leader has finished
+FLIGHT_POLL_MIN = 0.02
+FLIGHT_POLL_MAX = 0.25
+
+
+class SharedState:
+    """JSON values by (namespace, key) with optional TTLs, plus named locks with an owner.
+
+    Values are copied in and out, so callers never share mutable objects, whatever the backend.
+    Async code uses the a-prefixed methods, which keep blocking backend I/O off the event loop.
+    """
+
+    name = "base"
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str) -> None:
+        raise NotImplementedError
+
+    def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """Take the lock unless someone else holds an unexpired one."""
+        raise NotImplementedError
+
+    def release(self, name: str, owner: str) -> None:
+        raise NotImplementedError
+
+    def ping(self) -> bool:
+        return True
+
+    async def _call(self, fn: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def aget(self, namespace: str, key: str) -> Optional[Any]:
+        return await self._call(self.get, namespace, key)
+
+    async def aset(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self._call(self.set, namespace, key, value, ttl)
+
+    async def adelete(self, namespace: str, key: str) -> None:
+        await self._call(self.delete, namespace, key)
+
+    async def aacquire(self, name: str, owner: str, ttl: float) -> bool:
+        return await self._call(self.acquire, name, owner, ttl)
+
+    async def arelease(self, name: str, owner: str) -> None:
+        await self._call(self.release, name, owner)
+
+    def stats(self) -> dict:
+        try:
+            ok = self.ping()
+        except Exception as e:
+            logger.warning("shared state ping failed", extra=fields(backend=self.name, error=str(e)))
+            ok = False
+        return {"backend": self.name, "ok": ok}
+
+
+class LocalState(SharedState):
+    """In-process dicts; correct only when a single worker serves the app."""
+
+    name = "local"
+
+    def __init__(self, max_entries: int = SHARED_STATE_LOCAL_MAX):
+        self.max_entries = max_entries
+        self._values: "OrderedDict[Tuple[str, str], Tuple[str, Optional[float]]]" = OrderedDict()
+        self._locks: Dict[str, Tuple[str, float]] = {}
+        self._lock = Lock()
+
+    async def _call(self, fn, *args):
+        # Plain dict operations: an executor hop would cost more than the call
+        return fn(*args)
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._values.get((namespace, key))
+            if entry is None:
+                return None
+            raw, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._values[(namespace, key)]
+                return None
+            self._values.move_to_end((namespace, key))
+        return json.loads(raw)
+
+    def set(self, namespace, key, value, ttl=None):
+        raw = json.dumps(value)
+        with self._lock:
+            self._values[(namespace, key)] = (raw, time.time() + ttl if ttl else None)
+            self._values.move_to_end((namespace, key))
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._values.pop((namespace, key), None)
+
+    def acquire(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            holder = self._locks.get(name)
+            if holder is not None and holder[0] != owner and holder[1] > now:
+                return False
+            self._locks[name] = (owner, now + ttl)
+            return True
+
+    def release(self, name, owner):
+        with self._lock:
+            if self._locks.get(name, (None,))[0] == owner:
+                del self._locks[name]
+
+
+class SQLiteState(SharedState):
+    """A WAL-mode SQLite file shared by every worker on the node."""
+
+    name = "sqlite"
+    # Expired rows are swept every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str = SHARED_STATE_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = Lock()
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Reconnect after a fork: gunicorn --preload workers must not share the parent's handle
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS kv (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires_at) WHERE expires_at IS NOT NULL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS locks (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )"""
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, namespace, key, value, ttl=None):
+        raw = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, raw, now + ttl if ttl else None),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._connection().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def acquire(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            # One statement, so two workers racing for the same lock cannot both win
+            cursor = self._connection().execute(
+                """INSERT INTO locks (name, owner, expires_at) VALUES (?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                   WHERE locks.expires_at <= ? OR locks.owner = excluded.owner""",
+                (name, owner, now + ttl, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, name, owner):
+        with self._lock:
+            self._connection().execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+    def ping(self):
+        with self._lock:
+            self._connection().execute("SELECT 1").fetchone()
+        return True
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisState(SharedState):
+    """Redis (or anything speaking RESP) for state shared across nodes.
+
+    Speaks the protocol directly over one socket so redis-py is not a dependency.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = SHARED_STATE_URL, prefix: str = SHARED_STATE_PREFIX, timeout: float = 2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.strip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self._pid: Optional[int] = None
+        self._lock = Lock()
+
+    def _connect(self) -> None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._file = self._sock.makefile("rb")
+        self._pid = os.getpid()
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", self.db)
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._file = None
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.sendall(b"".join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._file.read(size + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            size = int(rest)
+            return None if size < 0 else [self._read() for _ in range(size)]
+        raise RedisError(f"unexpected reply: {line!r}")
+
+    def command(self, *args):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None or self._pid != os.getpid():
+                        self._connect()
+                    return self._send(*args)
+                except (OSError, ConnectionError):
+                    # One reconnect covers a restarted server or an idle connection it dropped
+                    self._close()
+                    if attempt:
+                        raise
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def get(self, namespace, key):
+        raw = self.command("GET", self._key(namespace, key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, namespace, key, value, ttl=None):
+        args = ["SET", self._key(namespace, key), json.dumps(value)]
+        if ttl:
+            args += ["PX", max(1, int(ttl * 1000))]
+        self.command(*args)
+
+    def delete(self, namespace, key):
+        self.command("DEL", self._key(namespace, key))
+
+    def acquire(self, name, owner, ttl):
+        key = self._key("lock", name)
+        if self.command("SET", key, owner, "NX", "PX", max(1, int(ttl * 1000))) == "OK":
+            return True
+        return self.command("GET", key) == owner
+
+    def release(self, name, owner):
+        # Not atomic, but a lock only changes hands after it expires, and the TTL bounds the damage
+        key = self._key("lock", name)
+        if self.command("GET", key) == owner:
+            self.command("DEL", key)
+
+    def ping(self):
+        return self.command("PING") == "PONG"
+
+
+def create_shared_state(backend: str = SHARED_STATE_BACKEND) -> SharedState:
+    if backend == "redis":
+        return RedisState()
+    if backend == "local":
+        return LocalState()
+    if backend != "sqlite":
+        logger.warning("unknown SHARED_STATE_BACKEND, using sqlite", extra=fields(backend=backend))
+    return SQLiteState()
+
+
+shared_state = create_shared_state()
+
+
+async def single_flight(namespace: str, key: str, compute: Callable[[], Awaitable[Any]], lock_ttl: float,
+                        result_ttl: float, state: Optional[SharedState] = None) -> Tuple[Any, bool]:
+    """Run `compute` once for identical concurrent callers on any worker.
+
+    The caller holding the lock computes and publishes the result; the rest poll for it.
+    Only callers that were already waiting when the result was published take it, so this
+    never turns into a response cache: a later identical call computes afresh. `result_ttl`
+    only has to outlast the waiters' polling. If the leader fails (or dies and its lock
+    expires), a waiting caller takes over. Returns (value, shared) where shared is True
+    when the value came from another caller's computation.
+    """
+    state = state or shared_state
+    joined = time.time()
+    owner = uuid.uuid4().hex
+    lock_name = f"{namespace}:{key}"
+
+    async def published() -> Optional[Any]:
+        entry = await state.aget(namespace, key)
+        # Results that finished before this caller arrived belong to someone else's flight
+        if entry is not None and entry["at"] >= joined:
+            return entry
+        return None
+
+    delay = FLIGHT_POLL_MIN
+    while True:
+        if await state.aacquire(lock_name, owner, lock_ttl):
+            try:
+                # The previous leader may have published just before we took over
+                entry = await published()
+                if entry is not None:
+                    return entry["value"], True
+                value = await compute()
+                await state.aset(namespace, key, {"value": value, "at": time.time()}, ttl=result_ttl)
+                return value, False
+            finally:
+                await state.arelease(lock_name, owner)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, FLIGHT_POLL_MAX)
+        entry = await published()
+        if entry is not None:
+            return entry["value"], True
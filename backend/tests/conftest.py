@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+# Tests import the backend's flat modules directly, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep every store the modules open at import time out of the working tree
+_tmp = tempfile.mkdtemp(prefix="shadowai-tests-")
+os.environ.setdefault("SHARED_STATE_BACKEND", "local")
+os.environ.setdefault("HISTORY_BACKEND", "sqlite")
+os.environ.setdefault("HISTORY_DB_PATH", os.path.join(_tmp, "history.db"))
+os.environ.setdefault("HISTORY_ARCHIVE_DIR", os.path.join(_tmp, "history_archive"))
+os.environ.setdefault("HISTORY_JOURNAL_DIR", os.path.join(_tmp, "history_journal"))
+os.environ.setdefault("JOBS_DB_PATH", os.path.join(_tmp, "jobs.db"))
+os.environ.setdefault("REFACTOR_BATCH_DIR", os.path.join(_tmp, "refactor_batches"))
+os.environ.setdefault("SCENARIO_LIBRARY_PATH", os.path.join(_tmp, "scenario_library.json"))
+os.environ.setdefault("PROFILE_DIR", os.path.join(_tmp, "profiles"))
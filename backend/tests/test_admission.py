@@ -0,0 +1,30 @@
+import asyncio
+
+from admission import DEFAULT_LIMITS, AdmissionController, _load_limits
+
+
+def test_overrides_merge_into_the_defaults():
+    limits = _load_limits('{"screen-assist": {"max_ocr_seconds": 120}, "batch": {"max_in_flight": 2}}')
+    assert limits["screen-assist"]["max_ocr_seconds"] == 120
+    assert limits["screen-assist"]["max_in_flight"] == DEFAULT_LIMITS["screen-assist"]["max_in_flight"]
+    assert limits["batch"] == {"max_in_flight": 2}
+
+
+def test_invalid_overrides_fall_back_to_the_defaults(caplog):
+    for raw in ("{not json", "[1, 2]", '{"gitops": 5}', '{"gitops": {"max_in_flight": "many"}}'):
+        assert _load_limits(raw) == DEFAULT_LIMITS
+    assert "Ignoring invalid ADMISSION_LIMITS" in caplog.text
+
+
+def test_feature_is_judged_by_its_own_limits():
+    admission = AdmissionController(limits={"gitops": {"max_in_flight": 1}, "refactor": {"max_db_queue": 1}})
+
+    async def scenario():
+        async with admission.running("gitops"):
+            assert admission.check("gitops") == ("in_flight", 5.0)
+            assert admission.check("ask-qa") is None
+            with admission.track("db"):
+                assert admission.check("refactor")[0] == "db_queue"
+        assert admission.check("gitops") is None
+
+    asyncio.run(scenario())
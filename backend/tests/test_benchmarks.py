@@ -0,0 +1,59 @@
+from fastapi.testclient import TestClient
+
+from benchmarks.load_test import percentile
+from benchmarks.mock_anthropic import MockSettings, create_app
+from benchmarks.mongo_standin import StandInClient
+from benchmarks.ocr_bench import CER_TOLERANCE, regressions, unmatched
+
+FAST = MockSettings(ttfb_ms=0, jitter_ms=0, tokens_per_second=1e9, output_tokens=5)
+
+
+def test_mock_answers_forced_tools_with_tool_use():
+    client = TestClient(create_app(FAST))
+    body = {"model": "m", "messages": [{"role": "user", "content": "undo"}], "tool_choice": {"type": "tool", "name": "gitops_answer"}}
+    data = client.post("/v1/messages", json=body).json()
+    assert data["stop_reason"] == "tool_use"
+    assert data["content"][0]["type"] == "tool_use" and data["content"][0]["input"]["commands"]
+
+
+def test_mock_echoes_refactor_code_and_streams():
+    client = TestClient(create_app(FAST))
+    prompt = "Code to refactor:\nx = 1\n\nKeep the total response short."
+    data = client.post("/v1/messages", json={"messages": [{"role": "user", "content": prompt}]}).json()
+    assert data["content"][0]["text"].endswith("```\nx = 1\n```")
+
+    streamed = client.post("/v1/messages", json={"stream": True, "messages": [{"role": "user", "content": prompt}]}).text
+    assert streamed.startswith("event: message_start") and "event: message_stop" in streamed
+
+
+def test_mongo_standin_text_search_and_upserts():
+    history = StandInClient()["shadowai"]["history"]
+    history.create_index([("input", "text")])
+    history.insert_one({"feature": "gitops", "input": "undo my last commit"})
+    history.insert_one({"feature": "gitops", "input": "create a branch"})
+    match = history.find_one({"$text": {"$search": "undo commit"}}, sort=[("score", {"$meta": "textScore"})])
+    assert match["input"] == "undo my last commit"
+
+    rollups = StandInClient()["shadowai"]["rollups"]
+    for _ in range(2):
+        rollups.update_one({"bucket": "m1"}, {"$inc": {"counts.requests": 1}}, upsert=True)
+    assert rollups.find_one({"bucket": "m1"})["counts"]["requests"] == 2
+
+
+def test_percentile_in_milliseconds():
+    assert percentile([], 0.5) is None
+    assert percentile([0.1, 0.2, 0.3, 0.4], 0.5) == 300.0
+    assert percentile([0.1, 0.2], 0.99) == 200.0
+
+
+def test_ocr_regressions_respect_the_tolerances():
+    baseline = {"dejavu-16-light": {"cer": 0.01, "line_error_rate": 0.1, "frames_per_sec": 10.0}}
+    same = {"dejavu-16-light": {"cer": 0.01 + CER_TOLERANCE / 2, "line_error_rate": 0.1, "frames_per_sec": 9.0}}
+    worse = {"dejavu-16-light": {"cer": 0.1, "line_error_rate": 0.1, "frames_per_sec": 5.0}}
+    assert regressions(same, baseline, check_speed=True) == []
+    assert len(regressions(worse, baseline, check_speed=True)) == 2
+    assert len(regressions(worse, baseline, check_speed=False)) == 1
+    assert regressions(worse, {}, check_speed=True) == []
+    # ...which is why configurations missing from the baseline are reported separately
+    assert unmatched(worse, {}) == ["dejavu-16-light"]
+    assert unmatched(worse, baseline) == []
@@ -0,0 +1,64 @@
+from chunking import extract_code_block, reassemble, split_code, split_python
+
+
+PYTHON = '''"""Module docstring."""
+import os
+
+def one_liner(): return os.sep
+
+def wrapped(a,  # first argument
+            b: int = 2,
+) -> int:  # note: returns a
+    """Docstring."""
+    return a + b
+
+class Shape(object):  # base class
+    def area(self): return 0
+    async def draw(self, canvas):
+        pass
+
+VALUE = 1
+'''
+
+
+def test_python_units_keep_every_definition_separate_without_merge():
+    result = split_code(PYTHON, merge=False)
+    assert result.language == "python"
+    assert result.header == '"""Module docstring."""\nimport os'
+    assert [unit.name for unit in result.units] == ["one_liner", "wrapped", "Shape", "statements@16"]
+
+
+def test_python_signatures_never_include_body_or_comments():
+    assert split_python(PYTHON).signatures == [
+        "def one_liner():",
+        "def wrapped(a, b: int = 2, ) -> int:",
+        "class Shape(object):",
+        "    def area(self):",
+        "    async def draw(self, canvas):",
+    ]
+
+
+def test_reassemble_round_trips_the_units():
+    result = split_code(PYTHON, merge=False)
+    rebuilt = reassemble(result.header, [unit.source for unit in result.units])
+    assert split_code(rebuilt, merge=False).signatures == result.signatures
+
+
+def test_small_units_are_merged():
+    code = "\n\n".join(f"def f{i}():\n    return {i}" for i in range(10))
+    result = split_code(code)
+    assert len(result.units) == 1
+    assert result.units[0].name == "f0..f9"
+
+
+def test_brace_code_splits_where_depth_returns_to_zero():
+    code = "import x from 'x';\n\nfunction a() {\n  return '}';\n}\n\nconst b = () => {\n  return 2;\n};\n"
+    result = split_code(code, merge=False)
+    assert result.language == "brace"
+    assert result.header == "import x from 'x';"
+    assert [unit.name for unit in result.units] == ["a", "b"]
+
+
+def test_extract_code_block():
+    assert extract_code_block("Summary.\n\n```python\nx = 1\n```\n") == ("Summary.", "x = 1")
+    assert extract_code_block("no code") == ("no code", None)
@@ -0,0 +1,82 @@
+import asyncio
+
+from deadline import DeadlineMiddleware, remaining
+from metrics import REQUEST_CANCELLATIONS, feature_from_path
+
+PATH = "/gitops"
+
+
+def cancellations(reason):
+    return REQUEST_CANCELLATIONS.value(feature=feature_from_path(PATH), reason=reason)
+
+
+def run(app, client_gone: asyncio.Event = None, headers=()):
+    """Drive the middleware like a server: the disconnect arrives once `client_gone` is set."""
+    sent = []
+
+    async def receive():
+        if client_gone is None:
+            await asyncio.Event().wait()
+        await client_gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": PATH, "headers": list(headers)}
+    asyncio.run(DeadlineMiddleware(app)(scope, receive, send))
+    return sent
+
+
+def test_disconnect_after_the_response_is_not_a_cancellation():
+    finished = []
+    before = cancellations("client_disconnect")
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+        # Background work after the response, while the client hangs up
+        client_gone.set()
+        await asyncio.sleep(0.01)
+        finished.append(True)
+
+    client_gone = asyncio.Event()
+    run(app, client_gone)
+    assert finished == [True]
+    assert cancellations("client_disconnect") == before
+
+
+def test_disconnect_mid_request_cancels_the_endpoint():
+    cancelled = []
+    before = cancellations("client_disconnect")
+
+    async def app(scope, receive, send):
+        client_gone.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    client_gone = asyncio.Event()
+    run(app, client_gone)
+    assert cancelled == [True]
+    assert cancellations("client_disconnect") == before + 1
+
+
+def test_deadline_answers_504_and_is_visible_to_the_endpoint():
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(remaining())
+        await asyncio.sleep(10)
+
+    sent = run(app, headers=[(b"x-request-timeout", b"0.05")])
+    assert 0 < seen[0] <= 0.05
+    assert sent[0]["status"] == 504
+
+
+def test_unknown_paths_share_one_feature_label():
+    assert feature_from_path("/refactor/batch/abc/archive") == "refactor"
+    assert feature_from_path("/") == "root"
+    assert feature_from_path("/wp-login.php") == feature_from_path("/random-1234") == "other"
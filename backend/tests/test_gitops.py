@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+import pytest
+
+from routes import gitops
+from routes.gitops import RISKY_WARNING, cached_answer, call_claude, validate_answer
+
+
+def test_validate_answer_fills_optional_fields_and_strips_blanks():
+    answer = validate_answer({"summary": " Undo it. ", "commands": ["git reset HEAD~1", " "], "steps": [], "warnings": []})
+    assert answer == {"summary": "Undo it.", "commands": ["git reset HEAD~1"], "steps": [], "warnings": [],
+                      "beginner_explanation": None}
+
+
+@pytest.mark.parametrize("bad", [None, {}, {"summary": 1}, {"summary": "s", "commands": "git status"},
+                                 {"summary": "s", "steps": [1]}, {"summary": "s", "beginner_explanation": ["x"]}])
+def test_validate_answer_rejects_off_schema_input(bad):
+    with pytest.raises(ValueError):
+        validate_answer(bad)
+
+
+def test_risky_commands_are_flagged_once():
+    answer = validate_answer({"summary": "s", "commands": ["git push --force"], "steps": [], "warnings": []})
+    assert answer["warnings"] == [RISKY_WARNING]
+    assert validate_answer(answer)["warnings"] == [RISKY_WARNING]
+
+
+def test_cached_answers_read_stored_json_and_legacy_text():
+    stored = validate_answer({"summary": "s", "commands": ["git status"], "steps": [], "warnings": []})
+    assert cached_answer(json.dumps(stored)) == stored
+    legacy = cached_answer("Run git status to see what changed.\n")
+    assert legacy["summary"] == "Run git status to see what changed." and legacy["commands"] == []
+    # JSON that is not an answer is shown as text rather than trusted
+    assert cached_answer('{"unexpected": true}')["summary"] == '{"unexpected": true}'
+
+
+def test_call_claude_forces_the_answer_tool(monkeypatch):
+    bodies = []
+
+    async def make_claude_request(client, headers, body, **kwargs):
+        bodies.append(body)
+        return {"content": [{"type": "tool_use", "name": "gitops_answer",
+                             "input": {"summary": "s", "commands": [], "steps": [], "warnings": []}}]}
+
+    monkeypatch.setattr(gitops, "make_claude_request", make_claude_request)
+    _, answer = asyncio.run(call_claude({}, "m", "undo my last commit"))
+    assert bodies[0]["tool_choice"] == {"type": "tool", "name": "gitops_answer"}
+    assert answer["summary"] == "s"
+
+
+def test_call_claude_fails_without_a_tool_answer(monkeypatch):
+    async def make_claude_request(client, headers, body, **kwargs):
+        return {"content": [{"type": "text", "text": "prose"}], "stop_reason": "max_tokens"}
+
+    monkeypatch.setattr(gitops, "make_claude_request", make_claude_request)
+    with pytest.raises(Exception, match="max_tokens"):
+        asyncio.run(call_claude({}, "m", "undo my last commit"))
@@ -0,0 +1,74 @@
+import json
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import db
+from history_archive import HistoryArchiver, append_segment, read_archive, segment_path, segments
+from history_store import HistoryConnection, SQLiteHistoryStore
+from shared_state import LocalState
+
+
+def doc(_id, when, feature="gitops", **metadata):
+    return {"_id": _id, "timestamp": when, "feature": feature, "input": f"input {_id}", "metadata": metadata}
+
+
+def test_reads_drop_duplicates_from_a_retried_batch(tmp_path):
+    day = datetime(2024, 3, 1, 10, 0)
+    path = segment_path(str(tmp_path), day.date())
+    append_segment(path, [doc(1, day), doc(2, day, mode="clean")])
+    # A crash after the append but before the delete archives the batch again
+    append_segment(path, [doc(1, day), doc(2, day, mode="clean")])
+
+    assert [d["_id"] for d in read_archive(str(tmp_path), {}, None, None)] == ["1", "2"]
+    assert [d["_id"] for d in read_archive(str(tmp_path), {"mode": "clean"}, None, None)] == ["2"]
+    assert list(read_archive(str(tmp_path), {"feature": "ask-qa"}, None, None)) == []
+
+
+def test_segments_are_selected_by_day(tmp_path):
+    for day in (1, 2, 3):
+        append_segment(segment_path(str(tmp_path), datetime(2024, 3, day).date()), [doc(day, datetime(2024, 3, day))])
+    selected = segments(str(tmp_path), datetime(2024, 3, 2), datetime(2024, 3, 3, 23))
+    assert [path.rsplit("history-", 1)[1] for path in selected] == ["2024-03-02.jsonl.gz", "2024-03-03.jsonl.gz"]
+
+
+def test_archiver_moves_only_expired_documents(tmp_path):
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    store.connect()
+    now = datetime.utcnow()
+    store.insert({"feature": "gitops", "timestamp": now - timedelta(days=40), "input": "old one"})
+    store.insert({"feature": "gitops", "timestamp": now - timedelta(days=35), "input": "old two"})
+    store.insert({"feature": "gitops", "timestamp": now, "input": "fresh"})
+
+    archiver = HistoryArchiver(store, directory=str(tmp_path / "archive"), retention_days=30, state=LocalState())
+    assert archiver.run_once(batch_size=1) == 2
+    assert [d["input"] for d in store.find({}, None, None, 10)] == ["fresh"]
+    assert [d["input"] for d in read_archive(str(tmp_path / "archive"), {}, None, None)] == ["old one", "old two"]
+
+
+def test_only_one_archiver_runs_at_a_time(tmp_path):
+    state = LocalState()
+    state.acquire("history-archive", "another worker", ttl=60)
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    store.connect()
+    store.insert({"feature": "gitops", "timestamp": datetime.utcnow() - timedelta(days=40), "input": "old"})
+    assert HistoryArchiver(store, directory=str(tmp_path), retention_days=30, state=state).run_once() == 0
+
+
+def test_export_accepts_utc_offsets(tmp_path, monkeypatch):
+    day = datetime(2024, 3, 1, 10, 0)
+    append_segment(segment_path(str(tmp_path / "archive"), day.date()), [doc(1, day), doc(2, day - timedelta(days=2))])
+    connection = HistoryConnection("sqlite", factory=lambda backend: SQLiteHistoryStore(str(tmp_path / "history.db")))
+    connection._connect()
+    connection.ready = True
+    connection.store.insert({"feature": "gitops", "timestamp": day + timedelta(hours=1), "input": "hot"})
+    monkeypatch.setattr(db, "store", connection)
+    monkeypatch.setattr(db, "HISTORY_ARCHIVE_DIR", str(tmp_path / "archive"))
+
+    from routes.history import router
+    app = FastAPI()
+    app.include_router(router)
+    response = TestClient(app).get("/history/export", params={"start_date": "2024-03-01T00:00:00Z"})
+    assert response.status_code == 200
+    assert [json.loads(line)["input"] for line in response.text.splitlines()] == ["input 1", "hot"]
@@ -0,0 +1,48 @@
+import history_codec
+from history_codec import compact, expand, pack_text, unpack_text, upgrade
+from prompt_templates import ask_qa_prompt, render
+
+CODE = "def total(items):\n    return sum(item.price for item in items)\n" * 40
+
+
+def test_large_text_is_compressed_and_small_text_is_not():
+    assert pack_text("short") == "short"
+    packed = pack_text(CODE)
+    assert isinstance(packed, bytes) and len(packed) < len(CODE)
+    assert unpack_text(packed) == CODE
+    assert pack_text(None) is None
+
+
+def test_incompressible_text_stays_plain(monkeypatch):
+    monkeypatch.setattr(history_codec, "HISTORY_COMPRESS_MIN_BYTES", 4)
+    assert pack_text("abcdefgh") == "abcdefgh"
+
+
+def test_templated_prompts_round_trip_without_a_second_copy_of_the_input():
+    prompt = render("refactor.file@1", code=CODE, mode="clean", target_language="same")
+    doc = {"feature": "refactor", "input": CODE, "claude_prompt": prompt, "claude_response": "done"}
+    stored = compact(doc)
+    assert stored["v"] == 2 and "claude_prompt" not in stored
+    assert CODE.encode() not in (stored["prompt"] if isinstance(stored["prompt"], bytes) else stored["prompt"].encode())
+    assert expand(stored) == doc
+
+
+def test_plain_and_input_prompts_round_trip():
+    verbatim = {"feature": "gitops", "input": "undo", "claude_prompt": "some free-form prompt", "claude_response": "ok"}
+    same_as_input = {"feature": "ask-qa", "input": "what is x?", "claude_prompt": "what is x?", "claude_response": "ok"}
+    assert expand(compact(verbatim)) == verbatim
+    assert expand(compact(same_as_input)) == same_as_input
+
+
+def test_legacy_documents_read_as_they_are():
+    legacy = {"feature": "gitops", "input": "undo", "claude_prompt": "p", "claude_response": "ok"}
+    assert expand(legacy) == legacy
+
+
+def test_upgrade_reattaches_legacy_ask_qa_prompts_to_their_template():
+    prompt = ask_qa_prompt("what does total do?", "def total(): ...")
+    legacy = {"feature": "ask-qa", "input": prompt, "claude_prompt": prompt, "claude_response": "it sums"}
+    upgraded = upgrade(legacy)
+    assert upgraded["input"] == "what does total do?"
+    assert upgraded["claude_prompt"].template == "ask-qa@1"
+    assert expand(compact(upgraded))["claude_prompt"] == prompt
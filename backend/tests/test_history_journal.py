@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from history_journal import DEAD_LETTER, HistoryJournal
+from history_store import HistoryConnection, HistoryStore, HistoryUnavailable
+from prompt_templates import render
+from resilience import RetryPolicy
+
+
+def doc(text):
+    return {"feature": "ask-qa", "timestamp": datetime(2024, 1, 1), "input": text,
+            "claude_prompt": render("ask-qa@1", question=text)}
+
+
+def test_replay_inserts_in_order_and_keeps_templated_prompts(tmp_path):
+    journal = HistoryJournal(str(tmp_path))
+    for text in ("one", "two"):
+        journal.append(doc(text))
+    inserted = []
+    assert journal.replay(inserted.append) == 2
+    assert [d["input"] for d in inserted] == ["one", "two"]
+    assert inserted[0]["claude_prompt"].template == "ask-qa@1"
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_replay_keeps_the_rest_for_next_time(tmp_path):
+    journal = HistoryJournal(str(tmp_path))
+    for text in ("one", "two", "three"):
+        journal.append(doc(text))
+    # Another worker's file, claimed along with this worker's own
+    os.rename(journal._path(), str(tmp_path / "journal-1.jsonl"))
+    journal.append(doc("four"))
+
+    def flaky(d):
+        if d["input"] == "two":
+            raise ConnectionError("store went away again")
+        inserted.append(d["input"])
+
+    inserted = []
+    assert journal.replay(flaky) == 1
+    assert journal.replay(lambda d: inserted.append(d["input"])) == 3
+    assert inserted == ["one", "two", "three", "four"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_a_rejected_document_is_dead_lettered_and_the_replay_goes_on(tmp_path):
+    journal = HistoryJournal(str(tmp_path))
+    for text in ("one", "poison", "three"):
+        journal.append(doc(text))
+    with open(journal._path(), "a", encoding="utf-8") as f:
+        f.write("not json\n")
+
+    def insert(d):
+        if d["input"] == "poison":
+            raise ValueError("document too large")
+        inserted.append(d["input"])
+
+    inserted = []
+    assert journal.replay(insert) == 2
+    assert inserted == ["one", "three"]
+    assert os.listdir(tmp_path) == [DEAD_LETTER]
+    with open(tmp_path / DEAD_LETTER, encoding="utf-8") as f:
+        dead = [json.loads(line) for line in f]
+    assert [entry["error"] for entry in dead][0] == "document too large" and len(dead) == 2
+    # The dead-letter file is never claimed for replay
+    assert journal.replay(insert) == 0 and journal.stats()["dead_lettered"] == 2
+
+
+def test_store_outages_stop_the_replay(tmp_path):
+    journal = HistoryJournal(str(tmp_path))
+    journal.append(doc("one"))
+
+    def down(d):
+        raise HistoryUnavailable("history store (mongo) is connecting")
+
+    assert journal.replay(down) == 0
+    assert os.listdir(tmp_path) == [os.path.basename(journal._path())]
+
+
+class FlakyStore(HistoryStore):
+    name = "flaky"
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    def connect(self):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection refused")
+
+    def find(self, filters, start_date, end_date, limit):
+        return []
+
+
+def test_connection_retries_in_the_background_then_runs_on_ready():
+    async def scenario():
+        connection = HistoryConnection("sqlite", factory=lambda backend: FlakyStore(failures=2))
+        connection._retry = RetryPolicy(base=0.001, cap=0.001)
+        ready = asyncio.Event()
+
+        async def on_ready():
+            ready.set()
+
+        connection.on_ready.append(on_ready)
+        with pytest.raises(HistoryUnavailable):
+            connection.find({}, None, None, 1)
+        connection.start()
+        await asyncio.wait_for(ready.wait(), 2)
+        connection.stop()
+        return connection.stats(), connection.find({}, None, None, 1)
+
+    stats, found = asyncio.run(scenario())
+    assert found == []
+    assert stats["state"] == "ready" and stats["backend"] == "flaky"
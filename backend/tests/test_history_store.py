@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+from history_store import HistoryConnection, SQLiteHistoryStore, create_history_store
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_unknown_backends_fail_loudly():
+    with pytest.raises(ValueError):
+        create_history_store("postgres")
+    with pytest.raises(ValueError):
+        HistoryConnection("mangodb")
+
+
+def test_mongo_stays_the_default():
+    # A fresh interpreter, so the module-level default is read without the test environment's override
+    env = {key: value for key, value in os.environ.items() if key not in ("HISTORY_BACKEND", "MONGODB_URI")}
+    out = subprocess.run([sys.executable, "-c", "import history_store; print(history_store.HISTORY_BACKEND)"],
+                         cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "mongo"
+
+
+def test_sqlite_store_round_trips_and_finds_similar_inputs(tmp_path):
+    store = SQLiteHistoryStore(str(tmp_path / "history.db"))
+    store.connect()
+    now = datetime.utcnow()
+    store.insert({"feature": "gitops", "timestamp": now - timedelta(days=2), "input": "create a branch", "claude_response": "git switch -c x"})
+    store.insert({"feature": "gitops", "timestamp": now, "input": "undo my last commit", "claude_response": "git reset HEAD~1",
+                  "metadata": {"model": "m"}})
+
+    docs = store.find({"feature": "gitops"}, None, None, 10)
+    assert [doc["input"] for doc in docs] == ["undo my last commit", "create a branch"]
+    assert docs[0]["metadata"] == {"model": "m"}
+
+    if store.has_fts:
+        match, score = store.find_similar("gitops", "undo last commit", None)
+        assert match["claude_response"] == "git reset HEAD~1" and score >= store.similarity_threshold
+
+    expired = store.expired(now - timedelta(days=1), 10)
+    assert [doc["input"] for doc in expired] == ["create a branch"]
+    store.delete(expired)
+    assert [doc["input"] for doc in store.scan({}, None, None)] == ["undo my last commit"]
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+import jobs
+from jobs import JobManager, JobStore, report_progress
+
+
+def run_job(tmp_path, handler, payload=None):
+    """Submit one job to a fresh manager and return (events seen, final stored job)."""
+
+    async def scenario():
+        manager = JobManager(store_path=str(tmp_path / "jobs.db"), workers=1)
+        manager.register("refactor", handler)
+        await manager.start()
+        try:
+            job_id = await manager.submit("refactor", payload or {})
+            queue = manager.subscribe(job_id)
+            events = []
+            while not events or events[-1][0] not in jobs.TERMINAL_STATUSES:
+                events.append(await asyncio.wait_for(queue.get(), 5))
+            return events, await manager.get(job_id)
+        finally:
+            await manager.stop()
+
+    return asyncio.run(scenario())
+
+
+def test_claim_is_exclusive_and_recover_requeues_stale_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.create("refactor", {"code": "x"})
+    assert store.claim(job_id)
+    assert not store.claim(job_id)
+    assert store.recover(stale_after=60) == []
+    assert store.recover(stale_after=-1) == [job_id]
+
+
+def test_job_result_is_stored(tmp_path):
+    async def handler(payload):
+        return {"echo": payload["code"]}
+
+    events, job = run_job(tmp_path, handler, {"code": "x = 1"})
+    assert [event for event, _ in events] == ["status", "done"]
+    assert job["status"] == "done" and job["result"] == {"echo": "x = 1"}
+
+
+def test_handler_error_fails_the_job(tmp_path):
+    async def handler(payload):
+        raise ValueError("no code")
+
+    events, job = run_job(tmp_path, handler)
+    assert job["status"] == "failed" and job["error"] == "no code"
+
+
+def test_unstorable_result_fails_the_job_instead_of_leaving_it_running(tmp_path):
+    async def handler(payload):
+        return {(1, 2): "tuple keys are not JSON"}
+
+    events, job = run_job(tmp_path, handler)
+    assert events[-1][0] == "failed"
+    assert job["status"] == "failed" and "keys must be" in job["error"]
+
+
+def test_store_errors_after_the_claim_fail_the_job(tmp_path, monkeypatch):
+    original_get = JobStore.get
+    calls = []
+
+    def flaky_get(self, job_id):
+        calls.append(job_id)
+        if len(calls) == 1:
+            raise jobs.sqlite3.OperationalError("database is locked")
+        return original_get(self, job_id)
+
+    monkeypatch.setattr(JobStore, "get", flaky_get)
+
+    async def handler(payload):
+        pytest.fail("the handler must not run")
+
+    events, job = run_job(tmp_path, handler)
+    assert events == [("failed", {"status": "failed", "error": "database is locked"})]
+    assert job["status"] == "failed"
+
+
+def test_report_progress_is_a_no_op_outside_jobs():
+    asyncio.run(report_progress(done=1, total=2))
@@ -0,0 +1,54 @@
+import json
+import logging
+import queue
+
+import logging_setup
+from logging_setup import (
+    LOG_DROPPED, ContextFilter, JsonFormatter, NonBlockingQueueHandler, fields, request_feature, request_id, truncate,
+)
+
+
+def make_record(level=logging.INFO, msg="ocr done", **extra):
+    record = logging.LogRecord("routes.screen_assist", level, __file__, 1, msg, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_truncate_marks_what_was_cut():
+    assert truncate("x" * 10, limit=4) == "xxxx...[+6 chars]"
+    assert truncate(12, limit=1) == 12
+
+
+def test_context_filter_stamps_request_and_applies_feature_levels(monkeypatch):
+    monkeypatch.setattr(logging_setup, "LOG_LEVELS", {"gitops": "WARNING"})
+    monkeypatch.setattr(logging_setup, "LOG_SAMPLING", {"ask-qa": 0.0})
+    context_filter = ContextFilter()
+    id_token, feature_token = request_id.set("req-1"), request_feature.set("gitops")
+    try:
+        record = make_record(logging.WARNING)
+        assert context_filter.filter(record)
+        assert (record.request_id, record.feature) == ("req-1", "gitops")
+        assert not context_filter.filter(make_record(logging.INFO))
+        # A record's own feature wins over the request's
+        assert not context_filter.filter(make_record(logging.INFO, feature="ask-qa"))
+        assert context_filter.filter(make_record(logging.ERROR, feature="ask-qa"))
+    finally:
+        request_id.reset(id_token)
+        request_feature.reset(feature_token)
+
+
+def test_json_formatter_writes_extra_fields():
+    record = make_record(**fields(chars=42, text="y" * 1000))
+    record.request_id, record.exc_text = "req-1", None
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["msg"] == "ocr done" and entry["chars"] == 42 and entry["request_id"] == "req-1"
+    assert entry["text"].endswith(f"...[+{1000 - logging_setup.LOG_MAX_FIELD_CHARS} chars]")
+
+
+def test_full_queue_drops_and_counts_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    before = LOG_DROPPED.value()
+    handler.handle(make_record(msg="first"))
+    handler.handle(make_record(msg="second"))
+    assert LOG_DROPPED.value() == before + 1
+    assert handler.queue.get_nowait().msg == "first"
@@ -0,0 +1,36 @@
+from model_router import ROUTING, route_model
+from routes.gitops import GitOpsRequest, route_request
+
+
+def test_short_question_goes_to_the_fast_model():
+    decision = route_model("gitops", "how do I undo my last commit?")
+    assert decision.tier == "fast"
+    assert decision.model == ROUTING["models"]["fast"]
+
+
+def test_long_question_and_attached_code_go_to_the_large_model():
+    assert route_model("gitops", "why " * 200).tier == "large"
+    assert route_model("gitops", "undo", has_code=True).tier == "large"
+
+
+def test_scenarios_are_decided_by_the_simple_list_only():
+    assert route_model("gitops", "", scenario_type="undo").tier == "fast"
+    decision = route_model("gitops", "", scenario_type="rebase")
+    assert decision.tier == "large"
+    assert decision.reason == "scenario 'rebase'"
+
+
+def test_empty_text_is_not_a_short_input():
+    assert route_model("gitops", "").tier == "large"
+    assert route_model("ask-qa", "   ").tier == "large"
+
+
+def test_unrouted_feature_uses_the_large_model():
+    assert route_model("refactor", "x").reason == "feature not routed"
+
+
+def test_route_request_ignores_the_scenario_when_an_error_is_attached():
+    assert route_request(GitOpsRequest(scenario_type="rebase")).tier == "large"
+    assert route_request(GitOpsRequest(scenario_type="undo")).tier == "fast"
+    request = GitOpsRequest(scenario_type="undo", error_message="fatal: " + "x " * 200)
+    assert route_request(request).tier == "large"
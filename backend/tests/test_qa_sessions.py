@@ -0,0 +1,84 @@
+import asyncio
+
+import qa_sessions
+from qa_sessions import QASession, SessionStore, compact, local_summary
+from routes import ask_qa
+from shared_state import LocalState
+
+
+def history_doc(question, answer, code_hash=None, code=None):
+    return {"input": question, "claude_response": answer, "metadata": {"code_hash": code_hash, "session_code": code}}
+
+
+def test_set_code_reports_changes_only():
+    session = QASession("s1")
+    assert session.set_code("print(1)")
+    assert not session.set_code("print(1)")
+    assert session.set_code("print(2)")
+
+
+def test_store_round_trips_sessions():
+    store = SessionStore(shared=LocalState())
+    session = asyncio.run(store.get("s1"))
+    session.set_code("x = 1")
+    session.add_exchange("what is x?", "one")
+    asyncio.run(store.save(session))
+    loaded = asyncio.run(store.get("s1"))
+    assert loaded.code == "x = 1" and loaded.turns == session.turns
+    assert asyncio.run(store.get("unknown")).turns == []
+
+
+def test_store_evicts_the_least_recently_used_past_the_cap():
+    store = SessionStore(max_sessions=2, shared=LocalState())
+
+    async def scenario():
+        for session_id in ("s1", "s2"):
+            await store.save(QASession(session_id))
+        await store.save(await store.get("s1"))  # s1 is now the most recently used
+        await store.save(QASession("s3"))
+        return [bool(await store.shared.aget(store.NAMESPACE, sid)) for sid in ("s1", "s2", "s3")]
+
+    assert asyncio.run(scenario()) == [True, False, True]
+    assert asyncio.run(store.count()) == 2
+
+
+def test_compact_folds_old_turns_into_the_summary(monkeypatch):
+    monkeypatch.setattr(qa_sessions, "QA_SESSION_TURN_BUDGET", 10)
+    session = QASession("s1")
+    for i in range(4):
+        session.add_exchange(f"question {i} " * 5, f"answer {i} " * 5)
+
+    async def failing_summarizer(previous, turns):
+        raise RuntimeError("upstream down")
+
+    assert asyncio.run(compact(session, failing_summarizer))
+    assert len(session.turns) == qa_sessions.QA_SESSION_KEEP_TURNS * 2
+    assert session.summary == local_summary("", [
+        {"role": role, "content": f"{kind} {i} " * 5}
+        for i in range(2) for role, kind in (("user", "question"), ("assistant", "answer"))
+    ])
+
+
+def test_rehydrate_restores_turns_and_code(monkeypatch):
+    code = "def f():\n    return 1"
+    session = QASession("s1")
+    session.set_code(code)
+    code_hash = session.code_hash
+    docs = [  # newest first, like get_history
+        history_doc("and now?", "still one", code_hash),
+        history_doc("what does f return?", "one", code_hash, code),
+    ]
+    monkeypatch.setattr(ask_qa, "get_history", lambda **kwargs: docs)
+    restored = QASession("s1")
+    assert asyncio.run(ask_qa.rehydrate_session(restored))
+    assert restored.code == code
+    assert [turn["content"] for turn in restored.turns] == ["what does f return?", "one", "and now?", "still one"]
+
+
+def test_session_with_lost_code_asks_the_client_to_resend(monkeypatch):
+    docs = [history_doc("and now?", "still one", "abc123")]
+    monkeypatch.setattr(ask_qa, "get_history", lambda **kwargs: docs)
+    monkeypatch.setattr(ask_qa, "qa_sessions", SessionStore(shared=LocalState()))
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    result = asyncio.run(ask_qa.ask_qa(ask_qa.AskQAInput(question="and then?", session_id="s1")))
+    assert result == {"session_id": "s1", "code_required": True, "has_code_context": False}
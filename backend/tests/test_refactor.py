@@ -0,0 +1,27 @@
+import asyncio
+
+from chunking import split_code
+from metrics import CACHE_LOOKUP_SECONDS
+from routes import refactor
+from routes.refactor import CLAUDE_MODEL, RefactorInput, refactor_large_file
+from shared_state import LocalState
+from unit_cache import UnitCache, unit_key
+
+CODE = "def a():\n    return 1\n\n\ndef b():\n    return 2\n"
+
+
+def test_incremental_refactor_reuses_cached_units_under_the_callers_feature(monkeypatch):
+    cache = UnitCache(shared=LocalState())
+    monkeypatch.setattr(refactor, "unit_cache", cache)
+    monkeypatch.setattr(refactor, "log_history", lambda **kwargs: None)
+    for unit in split_code(CODE, merge=False).units:
+        asyncio.run(cache.set(unit_key(unit.source, "readability", "same", CLAUDE_MODEL),
+                              {"summary": f"tidied {unit.name}", "code": unit.source}))
+    hits = CACHE_LOOKUP_SECONDS.count(feature="refactor-batch", layer="l1", result="hit")
+
+    input = RefactorInput(code=CODE, mode="readability", incremental=True)
+    result = asyncio.run(refactor_large_file(input, headers={}, feature="refactor-batch"))
+
+    assert result["recomputed"] == []
+    assert [unit["status"] for unit in result["units"]] == ["cached", "cached"]
+    assert CACHE_LOOKUP_SECONDS.count(feature="refactor-batch", layer="l1", result="hit") == hits + 2
@@ -0,0 +1,100 @@
+import asyncio
+import io
+import zipfile
+
+import pytest
+
+from batch_files import BatchInputError, clean_path, output_collisions, read_list, read_upload
+from routes import refactor, refactor_batch
+from routes.refactor import CLAUDE_MODEL
+from routes.refactor_batch import RefactorBatchInput, run_batch
+from shared_state import LocalState
+from unit_cache import UnitCache, unit_key
+
+CODE = "function add(a, b) {\n  return a + b;\n}\n"
+
+
+def test_clean_path_rejects_escaping_names():
+    assert clean_path("src\\app/../main.js") == "src/main.js"
+    assert clean_path("/etc/passwd") == "etc/passwd"
+    assert clean_path("../secret") is None
+    assert clean_path("C:/windows") is None
+    assert clean_path(".") is None
+
+
+def test_paths_that_clean_to_the_same_name_are_rejected():
+    with pytest.raises(BatchInputError):
+        read_list([{"path": "src/a.js", "code": CODE}, {"path": "src/./a.js", "code": CODE}])
+
+    upload = io.BytesIO()
+    with zipfile.ZipFile(upload, "w") as archive:
+        archive.writestr("a.js", CODE)
+        archive.writestr("x/../a.js", CODE)
+    with pytest.raises(BatchInputError):
+        read_upload("src.zip", upload)
+
+
+def test_output_collisions_count_both_names():
+    assert output_collisions(["a.js", "a.ts"], "modern", "TypeScript") == ["a.ts"]
+    assert output_collisions(["a.js", "b.js"], "modern", "TypeScript") == []
+    assert output_collisions(["a.js", "a.ts"], "clean", "TypeScript") == []
+
+
+def events_of(files, options, monkeypatch, reply):
+    monkeypatch.setattr(refactor_batch, "file_cache", UnitCache(namespace="refactor-file", shared=LocalState()))
+    monkeypatch.setattr(refactor, "unit_cache", UnitCache(shared=LocalState()))
+    monkeypatch.setattr(refactor, "log_history", lambda **kwargs: None)
+
+    async def make_claude_request(client, headers, body, **kwargs):
+        return reply(body)
+
+    monkeypatch.setattr(refactor, "make_claude_request", make_claude_request)
+
+    async def collect():
+        return [event async for event in run_batch("b" * 32, read_list(files), options, headers={})]
+
+    return asyncio.run(collect())
+
+
+def test_colliding_output_names_end_the_batch_with_an_error(monkeypatch):
+    files = [{"path": "a.js", "code": CODE}, {"path": "a.ts", "code": CODE + "// typed\n"}]
+    events = events_of(files, RefactorBatchInput(mode="modern", target_language="TypeScript"), monkeypatch,
+                       reply=lambda body: pytest.fail("nothing should go upstream"))
+    assert [event["event"] for event in events] == ["error"]
+    assert events[0]["reason"] == "output_collision" and "a.ts" in events[0]["detail"]
+
+
+def test_truncated_answers_keep_the_original_and_are_not_cached(monkeypatch):
+    def truncated(body):
+        return {"content": [{"type": "text", "text": "Tidied.\n```js\nfunction add(a, b) {"}], "stop_reason": "max_tokens"}
+
+    events = events_of([{"path": "a.js", "code": CODE}], RefactorBatchInput(mode="clean"), monkeypatch, truncated)
+    file_event = next(event for event in events if event["event"] == "file")
+    assert file_event["status"] == "error" and file_event["output_path"] == "a.js"
+    assert events[-1]["event"] == "done" and events[-1]["counts"] == {"error": 1}
+    key = unit_key(CODE, "clean", "same", CLAUDE_MODEL)
+    assert asyncio.run(refactor_batch.file_cache.get(key)) is None
+    assert asyncio.run(refactor.unit_cache.get(key)) is None
+
+
+def test_batches_use_the_code_only_unit_prompt(monkeypatch):
+    prompts = []
+
+    def reply(body):
+        prompts.append(body["messages"][0]["content"])
+        return {"content": [{"type": "text", "text": f"Tidied.\n```js\n{CODE}```"}], "stop_reason": "end_turn"}
+
+    events = events_of([{"path": "a.js", "code": CODE}], RefactorBatchInput(mode="clean"), monkeypatch, reply)
+    assert [prompt.template for prompt in prompts] == ["refactor.unit@1"]
+    assert events[-1]["event"] == "done" and events[-1]["counts"] == {"ok": 1}
+
+
+def test_an_unexpected_failure_in_one_file_does_not_end_the_batch(monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(refactor_batch, "refactor_source", broken)
+    events = events_of([{"path": "a.js", "code": CODE}, {"path": "b.js", "code": CODE + "\n// b\n"}],
+                       RefactorBatchInput(mode="clean"), monkeypatch, reply=lambda body: None)
+    assert [event["status"] for event in events if event["event"] == "file"] == ["error", "error"]
+    assert events[-1]["event"] == "done"
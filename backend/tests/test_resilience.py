@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+import llm
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, UpstreamError, hedged, parse_retry_after
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def open_breaker(clock, threshold=2, reset=30):
+    breaker = CircuitBreaker(failure_threshold=threshold, reset_seconds=reset)
+    for _ in range(threshold):
+        breaker.record_failure()
+    clock[0] += reset
+    return breaker
+
+
+def test_retry_policy_honours_retry_after_and_the_cap():
+    policy = RetryPolicy(max_attempts=4, base=1.0, cap=3.0)
+    assert all(0 <= policy.delay(attempt) <= 3.0 for attempt in range(10))
+    assert policy.delay(0, retry_after=12.0) == 12.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow() is None
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = open_breaker(clock)
+    assert breaker.state == "half-open"
+    probe = breaker.allow()
+    assert probe is not None
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens(clock):
+    breaker = open_breaker(clock)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_released_or_expired_probe_frees_the_claim(clock):
+    breaker = open_breaker(clock)
+    probe = breaker.allow(probe_timeout=10)
+    breaker.release(probe)
+    stale = breaker.allow(probe_timeout=10)
+    clock[0] += 11
+    fresh = breaker.allow(probe_timeout=10)
+    # The stale probe finishing late must not drop the new claim
+    breaker.release(stale)
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.release(fresh)
+    assert breaker.allow() is not None
+
+
+def test_hedged_returns_the_first_success():
+    calls = []
+
+    async def call():
+        calls.append(None)
+        await asyncio.sleep(0.05 if len(calls) == 1 else 0)
+        return len(calls)
+
+    assert asyncio.run(hedged(call, hedge_after=0.01)) == 2
+
+
+@pytest.mark.parametrize("hedge_after", [None, 10.0])
+def test_cancelling_hedged_cancels_the_call(hedge_after):
+    cancelled = []
+
+    async def call():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        # The request deadline fires before the hedge would
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(hedged(call, hedge_after=hedge_after), timeout=0.01)
+        await asyncio.sleep(0)
+        # Checked before asyncio.run cancels leftover tasks on its own
+        assert cancelled == [True]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_probe_is_released(clock, monkeypatch):
+    breaker = open_breaker(clock)
+    monkeypatch.setattr(llm, "breaker", breaker)
+
+    async def hang(*args):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(llm, "_post_once", hang)
+
+    async def scenario():
+        task = asyncio.create_task(llm._request_with_retries(None, {}, {}, "gitops", None, 5.0, 10.0, False))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpenError):
+            breaker.allow()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert breaker.state == "half-open"
+    assert breaker.allow() is not None
+
+
+@pytest.mark.parametrize("error, state", [
+    (UpstreamError("rate limited", status=429, retryable=True), "half-open"),
+    (ValueError("body is not JSON"), "open"),
+])
+def test_probe_outcomes(clock, monkeypatch, error, state):
+    breaker = open_breaker(clock)
+    monkeypatch.setattr(llm, "breaker", breaker)
+    monkeypatch.setattr(llm, "retry_policy", RetryPolicy(max_attempts=1))
+
+    async def fail(*args):
+        raise error
+
+    monkeypatch.setattr(llm, "_post_once", fail)
+    with pytest.raises(type(error)):
+        asyncio.run(llm._request_with_retries(None, {}, {}, "gitops", None, 5.0, 10.0, False))
+    assert breaker.state == state
+    if state == "half-open":
+        assert breaker.allow() is not None
@@ -0,0 +1,70 @@
+import asyncio
+import gzip
+import zlib
+from datetime import datetime
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import responses
+from responses import CompressionMiddleware, ORJSONResponse, dumps, negotiate
+
+
+def test_dumps_handles_datetimes_object_ids_and_sets():
+    class ObjectId:
+        def __str__(self):
+            return "65f0c0ffee"
+
+    assert dumps({"at": datetime(2024, 1, 2, 3, 4, 5), "_id": ObjectId(), "tags": {"a"}}) == (
+        b'{"at":"2024-01-02T03:04:05","_id":"65f0c0ffee","tags":["a"]}'
+    )
+
+
+def test_negotiate_respects_quality_values(monkeypatch):
+    monkeypatch.setattr(responses, "brotli", None)
+    assert negotiate("gzip, deflate") == "gzip"
+    assert negotiate("gzip;q=0, identity") is None
+    assert negotiate("*") == "gzip"
+    assert negotiate("") is None
+
+
+def app_with(payload_size):
+    app = FastAPI(default_response_class=ORJSONResponse)
+    app.add_middleware(CompressionMiddleware)
+
+    @app.get("/data")
+    def data():
+        return {"items": ["x" * 10] * payload_size}
+
+    return app
+
+
+def test_large_json_is_gzipped_and_small_json_is_not(monkeypatch):
+    monkeypatch.setattr(responses, "brotli", None)
+    big = TestClient(app_with(500)).get("/data", headers={"Accept-Encoding": "gzip"})
+    assert big.headers["content-encoding"] == "gzip" and "Accept-Encoding" in big.headers["vary"]
+    assert len(big.json()["items"]) == 500
+
+    small = TestClient(app_with(1)).get("/data", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+
+def test_streamed_ndjson_is_compressed_chunk_by_chunk(monkeypatch):
+    monkeypatch.setattr(responses, "brotli", None)
+    sent = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/x-ndjson")]})
+        await send({"type": "http.response.body", "body": b'{"n":1}\n', "more_body": True})
+        await send({"type": "http.response.body", "body": b'{"n":2}\n', "more_body": False})
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(CompressionMiddleware(app)({"type": "http", "headers": [(b"accept-encoding", b"gzip")]}, None, send))
+    headers = dict(sent[0]["headers"])
+    assert headers[b"content-encoding"] == b"gzip" and b"content-length" not in headers
+    chunks = [message["body"] for message in sent[1:]]
+    # Every chunk is flushed, so the first line can be decoded before the stream ends
+    assert zlib.decompressobj(31).decompress(chunks[0]) == b'{"n":1}\n'
+    assert gzip.decompress(b"".join(chunks)) == b'{"n":1}\n{"n":2}\n'
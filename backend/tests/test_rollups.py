@@ -0,0 +1,67 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import rollups
+from rollups import Rollups, merge_row, new_row, sketch_index, sketch_quantile
+
+
+class FakeStore:
+    ready = True
+
+    def __init__(self, fail_prune=False):
+        self.rows = []
+        self.fail_prune = fail_prune
+
+    def add_rollups(self, rows):
+        self.rows.extend(rows)
+
+    def prune_rollups(self, granularity, before):
+        if self.fail_prune:
+            raise RuntimeError("prune failed")
+
+
+def test_sketch_quantiles_are_within_a_few_percent():
+    rng = random.Random(7)
+    latencies = [rng.uniform(5, 5000) for _ in range(5000)]
+    sketch = {}
+    for latency in latencies:
+        index = sketch_index(latency)
+        sketch[index] = sketch.get(index, 0) + 1
+    ordered = sorted(latencies)
+    for q in (0.5, 0.95, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert abs(sketch_quantile(sketch, q) - exact) / exact < 0.03
+    assert sketch_quantile({}, 0.5) is None
+
+
+def test_sketches_merge_by_adding_counts():
+    a, b = new_row(), new_row()
+    a["sketch"][sketch_index(10)] += 1
+    b["sketch"][sketch_index(1000)] += 3
+    merged = merge_row(merge_row(new_row(), a), b)
+    assert sum(merged["sketch"].values()) == 4
+    assert sketch_quantile(merged["sketch"], 0.99) > 900
+
+
+def test_flush_survives_a_failing_prune(monkeypatch):
+    monkeypatch.setattr(rollups, "PRUNE_EVERY", 1)
+    store = FakeStore(fail_prune=True)
+    tracker = Rollups(store)
+    tracker.record("gitops", latency_ms=12.0)
+    asyncio.run(tracker.flush())
+    assert len(store.rows) == 2  # one minute row and one hour row
+
+
+def test_pending_rows_are_capped_oldest_minutes_first():
+    store = FakeStore()
+    store.ready = False
+    tracker = Rollups(store, max_pending=4)
+    start = datetime(2024, 1, 1, 12, 0)
+    for minute in range(5):
+        tracker.record("gitops", when=start + timedelta(minutes=minute))
+    asyncio.run(tracker.flush())
+    keys = sorted(key[:2] for key, _ in tracker._take())
+    # The hour row survives alongside the three newest minutes
+    assert keys == [("hour", start)] + [("minute", start + timedelta(minutes=m)) for m in (2, 3, 4)]
+    assert tracker.dropped == 2
@@ -0,0 +1,62 @@
+import asyncio
+import os
+
+from scenario_library import ScenarioLibrary
+from shared_state import LocalState
+
+
+def make_library(path, prompt="prompt", fingerprint=None, fail=(), state=None):
+    async def generate(scenario, explain):
+        if scenario in fail:
+            raise RuntimeError("upstream down")
+        return {"summary": f"{scenario}/{explain}", "commands": []}
+
+    return ScenarioLibrary(
+        scenarios=["undo", "merge"],
+        render_prompt=lambda scenario, explain: f"{prompt} {scenario} {explain}",
+        generate=generate,
+        path=str(path),
+        fingerprint=fingerprint,
+        state=state or LocalState(),
+    )
+
+
+def test_version_covers_prompt_and_fingerprint(tmp_path):
+    base = make_library(tmp_path / "lib.json").version
+    assert make_library(tmp_path / "lib.json", prompt="edited").version != base
+    assert make_library(tmp_path / "lib.json", fingerprint=lambda s, e: "other-model").version != base
+    assert make_library(tmp_path / "lib.json").version == base
+
+
+def test_saved_answers_load_only_for_the_same_version(tmp_path):
+    path = tmp_path / "lib.json"
+    library = make_library(path, fingerprint=lambda s, e: "model-a")
+    assert asyncio.run(library.refresh()) == 4
+    assert make_library(path, fingerprint=lambda s, e: "model-a").load() == 4
+    assert make_library(path, fingerprint=lambda s, e: "model-b").load() == 0
+
+
+def test_lookup_returns_a_copy_and_failures_keep_old_answers(tmp_path):
+    library = make_library(tmp_path / "lib.json")
+    asyncio.run(library.refresh())
+    library.lookup("undo", True)["summary"] = "mutated"
+    assert library.lookup("undo", True)["summary"] == "undo/True"
+
+    library.generate = make_library(tmp_path / "lib.json", fail=("merge",)).generate
+    assert asyncio.run(library.refresh()) == 2
+    assert library.lookup("merge", False)["summary"] == "merge/False"
+
+
+def test_only_the_lock_holder_regenerates_and_others_reload(tmp_path):
+    state = LocalState()
+    path = tmp_path / "lib.json"
+    writer, reader = make_library(path, state=state), make_library(path, state=state)
+    asyncio.run(writer.refresh())
+
+    assert state.acquire("scenario-library", "another-worker", ttl=60)
+    reader.generate = None  # would fail if called
+    assert asyncio.run(reader.refresh()) == 0
+    assert reader.lookup("undo", False)["summary"] == "undo/False"
+    state.release("scenario-library", "another-worker")
+    assert asyncio.run(writer.refresh()) == 4
+    assert os.listdir(tmp_path) == ["lib.json"]
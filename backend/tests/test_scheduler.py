@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import scheduler
+from scheduler import TokenBucket, UpstreamScheduler
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduler.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_refills_continuously_up_to_capacity(clock):
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock[0] += 30
+    assert bucket.wait_time(30) == 0.0
+    clock[0] += 1000
+    bucket.take(0)
+    assert bucket.tokens == 60
+
+
+def test_bucket_drain_holds_back_callers(clock):
+    bucket = TokenBucket(60)
+    bucket.drain(5)
+    assert bucket.wait_time(1) == pytest.approx(6.0)
+
+
+def test_bucket_never_asks_for_more_than_its_capacity(clock):
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    assert bucket.wait_time(10_000) == pytest.approx(60.0)
+
+
+def test_limits_are_split_across_workers():
+    upstream = UpstreamScheduler(requests_per_minute=60, tokens_per_minute=90_000, max_concurrency=16, workers=4)
+    assert upstream.requests.capacity == 15
+    assert upstream.tokens.capacity == 22_500
+    assert upstream.max_concurrency == 4
+    assert UpstreamScheduler(max_concurrency=2, workers=8).max_concurrency == 1
+
+
+def test_priority_then_round_robin_by_session():
+    async def scenario():
+        upstream = UpstreamScheduler(requests_per_minute=6000, tokens_per_minute=10**7, max_concurrency=1, workers=1)
+        order = []
+        blocker = asyncio.Event()
+
+        async def call(feature, session):
+            async with upstream.slot(feature, session, tokens=10):
+                order.append((feature, session))
+                if not order[1:]:
+                    await blocker.wait()
+
+        first = asyncio.create_task(call("gitops", "busy"))
+        await asyncio.sleep(0)
+        queued = [
+            asyncio.create_task(call(feature, session))
+            for feature, session in [("refactor", "a"), ("ask-qa", "busy"), ("ask-qa", "busy"), ("ask-qa", "quiet")]
+        ]
+        await asyncio.sleep(0)
+        assert upstream.stats()["queued"] == {"refactor": 1, "ask-qa": 3}
+        blocker.set()
+        await asyncio.gather(first, *queued)
+        return order
+
+    assert asyncio.run(scenario()) == [
+        ("gitops", "busy"), ("ask-qa", "busy"), ("ask-qa", "quiet"), ("ask-qa", "busy"), ("refactor", "a"),
+    ]
@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import pytest
+
+from shared_state import LocalState, SQLiteState, single_flight
+
+
+@pytest.fixture(params=["local", "sqlite"])
+def state(request, tmp_path):
+    if request.param == "local":
+        return LocalState()
+    return SQLiteState(str(tmp_path / "state.db"))
+
+
+def test_values_expire_and_locks_are_exclusive(state):
+    state.set("ns", "k", {"a": 1}, ttl=0.05)
+    assert state.get("ns", "k") == {"a": 1}
+    time.sleep(0.1)
+    assert state.get("ns", "k") is None
+
+    assert state.acquire("lock", "one", ttl=10)
+    assert not state.acquire("lock", "two", ttl=10)
+    state.release("lock", "two")  # only the owner can release
+    assert not state.acquire("lock", "two", ttl=10)
+    state.release("lock", "one")
+    assert state.acquire("lock", "two", ttl=10)
+
+
+def test_async_methods_match_the_sync_ones(state):
+    async def scenario():
+        await state.aset("ns", "k", [1, 2])
+        value = await state.aget("ns", "k")
+        await state.adelete("ns", "k")
+        return value, await state.aget("ns", "k")
+
+    assert asyncio.run(scenario()) == ([1, 2], None)
+
+
+def test_local_state_drops_the_least_recently_used():
+    state = LocalState(max_entries=2)
+    state.set("ns", "a", 1)
+    state.set("ns", "b", 2)
+    state.get("ns", "a")
+    state.set("ns", "c", 3)
+    assert state.get("ns", "a") == 1 and state.get("ns", "b") is None
+
+
+def test_single_flight_shares_one_computation_between_concurrent_callers():
+    state = LocalState()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def scenario():
+        return await asyncio.gather(*(single_flight("llm", "k", compute, lock_ttl=5, result_ttl=5, state=state) for _ in range(3)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True]
+    assert {value for value, _ in results} == {"answer"}
+
+
+def test_single_flight_is_not_a_cache():
+    state = LocalState()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    first = asyncio.run(single_flight("llm", "k", compute, lock_ttl=5, result_ttl=60, state=state))
+    second = asyncio.run(single_flight("llm", "k", compute, lock_ttl=5, result_ttl=60, state=state))
+    assert first == (1, False) and second == (2, False)
+
+
+def test_a_waiter_takes_over_when_the_leader_fails():
+    state = LocalState()
+    attempts = []
+
+    async def compute():
+        attempts.append(1)
+        await asyncio.sleep(0.02)
+        if len(attempts) == 1:
+            raise RuntimeError("upstream down")
+        return "recovered"
+
+    async def scenario():
+        return await asyncio.gather(
+            single_flight("llm", "k", compute, lock_ttl=5, result_ttl=5, state=state),
+            single_flight("llm", "k", compute, lock_ttl=5, result_ttl=5, state=state),
+            return_exceptions=True,
+        )
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first, RuntimeError)
+    assert second == ("recovered", False)
@@ -0,0 +1,69 @@
+from token_diet import (
+    TokenDiet, collapse_whitespace, count_tokens, merge_ocr_frames, strip_ocr_garbage, trim_git_log,
+    truncate_to_budget,
+)
+
+
+def test_collapse_whitespace_keeps_tabs_and_squeezes_blank_lines():
+    text = "def f():\n\treturn 1   \n\n\n\nx = 2\r\n"
+    assert collapse_whitespace(text) == "def f():\n\treturn 1\n\nx = 2"
+    assert collapse_whitespace("why   does\tthis  fail", keep_indentation=False) == "why does this fail"
+
+
+def test_strip_ocr_garbage_keeps_short_code_lines():
+    text = "int x = 0;\n    x;\n  }\n~'\n.-~^~-.\ni++\n});"
+    assert strip_ocr_garbage(text).splitlines() == ["int x = 0;", "    x;", "  }", "i++", "});"]
+
+
+def test_merge_ocr_frames_drops_repeats_and_scroll_overlap():
+    frames = ["a = 1\nb = 2\nc = 3", "a = 1\nb = 2\nc = 3", "b = 2\nc = 3\nd = 4"]
+    assert merge_ocr_frames(frames) == ["a = 1\nb = 2\nc = 3", "d = 4"]
+
+
+def test_trim_git_log_keeps_newest_entries():
+    log = "\n".join(f"commit {i:07x}abc\n    message {i}" for i in range(5))
+    trimmed = trim_git_log(log, max_entries=2)
+    assert "message 1" in trimmed and "message 2" not in trimmed
+    assert trimmed.endswith("[... 3 older commits omitted ...]")
+
+
+def test_truncate_to_budget_cuts_the_middle():
+    text = "\n".join(f"line number {i}" for i in range(200))
+    result = truncate_to_budget(text, 100)
+    assert result.startswith("line number 0\n")
+    assert result.endswith("line number 199")
+    assert "truncated" in result
+    assert count_tokens(result) < count_tokens(text)
+
+
+def test_truncate_to_budget_slices_a_single_long_line():
+    text = "x=" + "+".join(f"value{i}" for i in range(2000))
+    result = truncate_to_budget(text, 200)
+    head, marker, tail = result.split("\n")
+    assert text.startswith(head) and text.endswith(tail)
+    assert head and tail and "truncated" in marker
+    assert count_tokens(head) + count_tokens(tail) <= 200
+
+
+def test_token_diet_reports_savings_and_truncation():
+    diet = TokenDiet("gitops", budget=50)
+    diet.apply("instruction", "please   help\n\n\n\nme", kind="prose")
+    diet.apply("pr_diff", "\n".join(f"+ added line {i}" for i in range(100)))
+    report = diet.report()
+    assert report["truncated"] == ["pr_diff"]
+    assert report["tokens_saved"] == report["tokens_before"] - report["tokens_after"] > 0
+
+
+def test_budget_covers_the_whole_request_and_trims_the_largest_field():
+    diet = TokenDiet("gitops", budget=300)
+    diff = "\n".join(f"+ added line {i}" for i in range(200))
+    log = "\n".join(f"commit {i:07x}\n    fix thing {i}" for i in range(15))
+    fields = diet.apply_all({"instruction": ("undo my last commit", "prose"), "git_log": (log, "git_log"),
+                             "pr_diff": (diff, "code"), "branch_status": (None, "code")})
+    assert fields["instruction"] == "undo my last commit" and fields["branch_status"] is None
+    assert "pr_diff" in diet.truncated
+    assert diet.after <= 300 + 20  # the truncation markers may add a few tokens
+
+    # Later fields only get what is left
+    rest = diet.apply("error_message", diff)
+    assert count_tokens(rest) < count_tokens(diff) // 4
@@ -0,0 +1,57 @@
+import asyncio
+
+import tracing
+from tracing import Trace, TracingMiddleware, current_trace, record_span, span
+
+
+def test_spans_are_free_without_a_trace():
+    with span("ocr"):
+        record_span("queue", 0.5)
+    assert current_trace() is None
+
+
+def test_trace_records_nesting_and_totals():
+    trace = Trace()
+    token = tracing._trace.set(trace)
+    try:
+        with span("ocr.frame", frame=1):
+            with span("ocr.tesseract"):
+                pass
+        with span("ocr.frame", frame=2):
+            pass
+        record_span("claude.queue", 0.25)
+    finally:
+        tracing._trace.reset(token)
+
+    spans = trace.to_metadata()["spans"]
+    depths = {(s["name"], s.get("frame")): s["depth"] for s in spans}
+    assert depths[("ocr.frame", 1)] == 0 and depths[("ocr.tesseract", None)] == 1
+    header = trace.server_timing()
+    assert 'ocr.frame;dur=' in header and 'desc="x2"' in header
+    assert "claude.queue;dur=250.0" in header
+    assert header.split(", ")[-1].startswith("total;dur=")
+
+
+def test_trace_drops_spans_past_the_cap(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_MAX_SPANS", 2)
+    trace = Trace()
+    for i in range(5):
+        trace.add("s", 0.0, 0.0, 0, {})
+    assert trace.to_metadata()["dropped"] == 3
+
+
+def test_middleware_adds_server_timing():
+    sent = []
+
+    async def app(scope, receive, send):
+        with span("db.find"):
+            pass
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(TracingMiddleware(app)({"type": "http", "path": "/history"}, None, send))
+    headers = dict(sent[0]["headers"])
+    assert headers[b"server-timing"].startswith(b"db.find;dur=")
@@ -0,0 +1,37 @@
+import asyncio
+
+from shared_state import LocalState
+from unit_cache import UnitCache, unit_key
+
+
+def test_unit_key_ignores_surrounding_whitespace_but_not_settings():
+    key = unit_key("def f():\n    return 1\n", "clean", "same", "model")
+    assert key == unit_key("\ndef f():\n    return 1", "clean", "same", "model")
+    assert key != unit_key("def f():\n    return 1", "optimize", "same", "model")
+    assert key != unit_key("def f():\n    return 1", "clean", "same", "other-model")
+    assert key != unit_key("def f():\n    return 2", "clean", "same", "model")
+
+
+def test_local_entries_are_bounded_and_backed_by_shared_state():
+    shared = LocalState()
+    cache = UnitCache(max_entries=2, shared=shared)
+
+    async def scenario():
+        for name in ("a", "b", "c"):
+            await cache.set(name, {"summary": name, "code": name})
+        assert len(cache) == 2
+        # Evicted locally, still found in shared state (another worker's view)
+        assert await cache.get("a") == {"summary": "a", "code": "a"}
+        assert await UnitCache(shared=shared).get("c") == {"summary": "c", "code": "c"}
+
+    asyncio.run(scenario())
+
+
+def test_namespaces_keep_file_and_unit_results_apart():
+    shared = LocalState()
+
+    async def scenario():
+        await UnitCache(shared=shared).set("k", {"summary": "unit", "code": "u"})
+        assert await UnitCache(shared=shared, namespace="refactor-file").get("k") is None
+
+    asyncio.run(scenario())
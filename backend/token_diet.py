@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Per-feature input budgets (in estimated tokens) for the free-form parts of a prompt.
+# Override with TOKEN_BUDGETS='{"gitops": 4000}'.
+DEFAULT_BUDGETS = {
+    "ask-qa": 12000,
+    "gitops": 6000,
+    "screen-assist": 6000,
+    "refactor": 24000,
+}
+GIT_LOG_MAX_ENTRIES = int(os.getenv("GIT_LOG_MAX_ENTRIES", "20"))
+
+
+def _load_budgets() -> Dict[str, int]:
+    budgets = dict(DEFAULT_BUDGETS)
+    try:
+        budgets.update({k: int(v) for k, v in json.loads(os.getenv("TOKEN_BUDGETS", "{}")).items()})
+    except (ValueError, AttributeError) as e:
+        logger.warning(f"Ignoring invalid TOKEN_BUDGETS: {e}")
+    return budgets
+
+
+TOKEN_BUDGETS = _load_budgets()
+
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def count_tokens(text: str) -> int:
+    """Cheap local token estimate: words cost ~1 token per 4 letters, symbols 1 each."""
+    if not text:
+        return 0
+    total = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        total += (len(piece) + 3) // 4 if piece[0].isalnum() else 1
+    return total
+
+
+def collapse_whitespace(text: str, keep_indentation: bool = True) -> str:
+    """Drop trailing spaces and repeated blank lines; for prose also squeeze inner runs.
+
+    Tabs are kept: they can be significant (Makefiles, Go, tab-indented Python).
+    """
+    lines = []
+    blank = False
+    for line in text.replace("\r\n", "\n").split("\n"):
+        line = line.rstrip()
+        if not keep_indentation:
+            line = re.sub(r"\s+", " ", line.strip())
+        if not line:
+            if blank:
+                continue
+            blank = True
+        else:
+            blank = False
+        lines.append(line)
+    return "\n".join(lines).strip("\n")
+
+
+# Short lines that are real code: "x;", "i++", "});", "(a", "end"
+_SHORT_CODE = re.compile(r"[({\[]?[\w$]+(\+\+|--)?[;,:)\]}]*")
+
+
+def _is_ocr_garbage(line: str) -> bool:
+    stripped = line.strip()
+    if not stripped:
+        return False
+    meaningful = sum(ch.isalnum() for ch in stripped)
+    if meaningful == 0:
+        # Lone braces/brackets are real code; runs of noise symbols are not
+        return not re.fullmatch(r"[{}()\[\];:,.]{1,3}", stripped)
+    if len(stripped) <= 2 and not _SHORT_CODE.fullmatch(stripped):
+        return True
+    return meaningful / len(stripped) < 0.3 and len(stripped) > 3
+
+
+def strip_ocr_garbage(text: str) -> str:
+    """Remove lines that are mostly OCR noise (stray symbols, speckles, scan artefacts)."""
+    return "\n".join(line for line in text.splitlines() if not _is_ocr_garbage(line))
+
+
+def merge_ocr_frames(frames: List[str]) -> List[str]:
+    """Drop repeated frames and the overlap between consecutive scrolled frames."""
+    merged: List[str] = []
+    previous: List[str] = []
+    seen = set()
+    for frame in frames:
+        lines = frame.splitlines()
+        key = "\n".join(line.strip() for line in lines if line.strip())
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        # Longest suffix of the previous frame that reappears as this frame's prefix
+        overlap = 0
+        normalized_prev = [line.strip() for line in previous]
+        normalized = [line.strip() for line in lines]
+        for size in range(min(len(previous), len(lines)), 0, -1):
+            if normalized_prev[-size:] == normalized[:size]:
+                overlap = size
+                break
+        merged.append("\n".join(lines[overlap:]))
+        previous = lines
+    return [frame for frame in merged if frame.strip()]
+
+
+_COMMIT_START = re.compile(r"^(commit [0-9a-f]{7,40}\b|[*|\\/ ]*[0-9a-f]{7,40} )")
+
+
+def trim_git_log(log: str, max_entries: int = GIT_LOG_MAX_ENTRIES) -> str:
+    """Keep the most recent max_entries commits (git log prints newest first)."""
+    lines = log.splitlines()
+    starts = [i for i, line in enumerate(lines) if _COMMIT_START.match(line)]
+    if len(starts) <= max_entries:
+        return log
+    kept = "\n".join(lines[:starts[max_entries]]).rstrip()
+    return f"{kept}\n[... {len(starts) - max_entries} older commits omitted ...]"
+
+
+def _truncate_chars(text: str, budget: int, head_ratio: float) -> str:
+    total = count_tokens(text)
+    # Characters per token for this text, shrunk until the slices fit
+    keep = len(text) * budget // total
+    while True:
+        head_chars = int(keep * head_ratio)
+        tail_chars = keep - head_chars
+        head, tail = text[:head_chars], text[len(text) - tail_chars:] if tail_chars else ""
+        if keep <= 0 or count_tokens(head) + count_tokens(tail) <= budget:
+            break
+        keep = keep * 9 // 10
+    omitted = total - count_tokens(head) - count_tokens(tail)
+    marker = f"[... truncated ~{omitted} tokens to fit the input budget ...]"
+    return "\n".join(part for part in (head, marker, tail) if part)
+
+
+def truncate_to_budget(text: str, budget: int, head_ratio: float = 0.7) -> str:
+    """Cut the middle out of text so it fits budget tokens, leaving a visible marker."""
+    total = count_tokens(text)
+    if total <= budget:
+        return text
+    lines = text.splitlines()
+    head_budget = int(budget * head_ratio)
+    tail_budget = budget - head_budget
+
+    head, used = [], 0
+    for line in lines:
+        cost = count_tokens(line) + 1
+        if used + cost > head_budget:
+            break
+        head.append(line)
+        used += cost
+
+    tail, used = [], 0
+    for line in reversed(lines[len(head):]):
+        cost = count_tokens(line) + 1
+        if used + cost > tail_budget:
+            break
+        tail.insert(0, line)
+        used += cost
+
+    if not head and not tail:
+        # One huge line (minified code, a pasted blob): slice characters instead
+        return _truncate_chars(text, budget, head_ratio)
+
+    omitted = total - count_tokens("\n".join(head + tail))
+    marker = f"[... truncated ~{omitted} tokens to fit the input budget ...]"
+    return "\n".join(head + [marker] + tail)
+
+
+class TokenDiet:
+    """Normalizes prompt inputs for one request and keeps a tokens-saved tally.
+
+    The feature's budget covers the whole request: every field applied counts against it.
+
+    Usage:
+        diet = TokenDiet("gitops")
+        fields = diet.apply_all({"git_log": (request.git_log, "git_log"), "pr_diff": (request.pr_diff, "code")})
+        metadata["token_diet"] = diet.report()
+    """
+
+    def __init__(self, feature: str, budget: Optional[int] = None):
+        self.feature = feature
+        self.budget = budget or TOKEN_BUDGETS.get(feature, 8000)
+        self.before = 0
+        self.after = 0
+        self.truncated: List[str] = []
+
+    @staticmethod
+    def _normalize(text: str, kind: str) -> str:
+        if kind == "prose":
+            return collapse_whitespace(text, keep_indentation=False)
+        if kind == "ocr":
+            return collapse_whitespace(strip_ocr_garbage(text))
+        if kind == "git_log":
+            return collapse_whitespace(trim_git_log(text))
+        return collapse_whitespace(text)
+
+    def apply(self, name: str, text: Optional[str], kind: str = "code") -> Optional[str]:
+        """Normalize one field and fit it into what is left of the request's budget."""
+        return self.apply_all({name: (text, kind)})[name]
+
+    def apply_all(self, fields: Dict[str, Tuple[Optional[str], str]]) -> Dict[str, Optional[str]]:
+        """Normalize several fields, given as name: (text, kind), and fit them into what is left of the budget.
+
+        Fields within an equal share of the remainder are kept whole; the largest are cut
+        down to split what the others leave.
+        """
+        results = {name: text for name, (text, _) in fields.items()}
+        normalized = {}
+        for name, (text, kind) in fields.items():
+            if text:
+                self.before += count_tokens(text)
+                normalized[name] = self._normalize(text, kind)
+        sizes = {name: count_tokens(text) for name, text in normalized.items()}
+        left = max(self.budget - self.after, 0)
+        ordered = sorted(normalized, key=sizes.get)
+        for i, name in enumerate(ordered):
+            result = normalized[name]
+            share = left // (len(ordered) - i)
+            if sizes[name] > share:
+                # Logs are newest-first, so only their head is worth keeping
+                result = truncate_to_budget(result, share, head_ratio=1.0 if fields[name][1] == "git_log" else 0.7)
+                self.truncated.append(name)
+            used = count_tokens(result)
+            left = max(left - used, 0)
+            self.after += used
+            results[name] = result
+        return results
+
+    def report(self) -> dict:
+        report = {
+            "tokens_before": self.before,
+            "tokens_after": self.after,
+            "tokens_saved": self.before - self.after,
+            "truncated": self.truncated,
+        }
+        if report["tokens_saved"] > 0:
+            logger.info(f"[Token Diet] {self.feature}: saved {report['tokens_saved']} of {self.before} input tokens")
+        return report
@@ -0,0 +1,134 @@
+import contextvars
+import os
+import re
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from typing import List, Optional
+
+# Also store each request's spans in its history document's metadata
+TRACE_IN_HISTORY = os.getenv("TRACE_IN_HISTORY", "false").lower() == "true"
+# A runaway loop of spans should not grow a request without bound
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
+
+_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+_depth: contextvars.ContextVar[int] = contextvars.ContextVar("span_depth", default=0)
+
+
+class Span:
+    __slots__ = ("name", "start_ms", "duration_ms", "depth", "attrs")
+
+    def __init__(self, name: str, start_ms: float, duration_ms: float, depth: int, attrs: dict):
+        self.name = name
+        self.start_ms = start_ms
+        self.duration_ms = duration_ms
+        self.depth = depth
+        self.attrs = attrs
+
+    def to_dict(self) -> dict:
+        entry = {"name": self.name, "start_ms": round(self.start_ms, 2), "duration_ms": round(self.duration_ms, 2), "depth": self.depth}
+        if self.attrs:
+            entry.update(self.attrs)
+        return entry
+
+
+class Trace:
+    """Spans recorded during one request; OCR worker threads append to it too."""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.spans: List[Span] = []
+        self.dropped = 0
+        self._lock = Lock()
+
+    def add(self, name: str, start: float, duration: float, depth: int, attrs: dict) -> None:
+        with self._lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped += 1
+                return
+            self.spans.append(Span(name, (start - self.started) * 1000, duration * 1000, depth, attrs))
+
+    def totals(self) -> "OrderedDict[str, tuple]":
+        """name -> (total ms, count), in order of first appearance."""
+        totals: "OrderedDict[str, tuple]" = OrderedDict()
+        with self._lock:
+            spans = list(self.spans)
+        for s in sorted(spans, key=lambda s: s.start_ms):
+            total, count = totals.get(s.name, (0.0, 0))
+            totals[s.name] = (total + s.duration_ms, count + 1)
+        return totals
+
+    def server_timing(self) -> str:
+        entries = []
+        for name, (total, count) in self.totals().items():
+            entry = f"{_metric_name(name)};dur={total:.1f}"
+            if count > 1:
+                entry += f';desc="x{count}"'
+            entries.append(entry)
+        entries.append(f"total;dur={(perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def to_metadata(self) -> dict:
+        with self._lock:
+            spans = [s.to_dict() for s in sorted(self.spans, key=lambda s: s.start_ms)]
+        return {"spans": spans, "dropped": self.dropped}
+
+
+def _metric_name(name: str) -> str:
+    # Server-Timing metric names are HTTP tokens
+    return re.sub(r"[^A-Za-z0-9!#$%&'*+\-.^_`|~]", "_", name)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a span of the current request's trace; free when nothing is tracing."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        _depth.reset(token)
+        trace.add(name, start, perf_counter() - start, depth, attrs)
+
+
+def record_span(name: str, duration: float, **attrs) -> None:
+    """Record a span that ended just now and lasted `duration` seconds (e.g. a queue wait)."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(name, perf_counter() - duration, duration, _depth.get(), attrs)
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware: a trace per request, summarised in a Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = Trace()
+        token = _trace.set(trace)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", trace.server_timing().encode("latin-1")),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
@@ -0,0 +1,72 @@
+import hashlib
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+from shared_state import SharedState, shared_state
+
+# Refactored units are small, so a few thousand entries stay well under a few MB
+UNIT_CACHE_SIZE = int(os.getenv("REFACTOR_UNIT_CACHE_SIZE", "5000"))
+# How long a unit stays in the cache shared by all workers
+UNIT_CACHE_TTL = float(os.getenv("REFACTOR_UNIT_CACHE_TTL", str(7 * 24 * 3600)))
+# Whole files refactored by /refactor/batch are larger, so fewer are kept in process
+FILE_CACHE_SIZE = int(os.getenv("REFACTOR_FILE_CACHE_SIZE", "500"))
+
+
+def unit_key(source: str, mode: str, target_language: str, model: str) -> str:
+    """Content hash of a unit body together with everything that changes its refactoring."""
+    digest = hashlib.sha256()
+    for part in (mode, target_language, model, source.strip()):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class UnitCache:
+    """Unit hash -> refactor result (summary + code): a bounded in-process LRU in front of shared state.
+
+    Keys are content hashes, so entries never change and the local copy cannot go stale;
+    a unit refactored on one worker is reused by every other.
+    """
+
+    NAMESPACE = "refactor-unit"
+
+    def __init__(self, max_entries: int = UNIT_CACHE_SIZE, shared: Optional[SharedState] = None, ttl: float = UNIT_CACHE_TTL,
+                 namespace: str = NAMESPACE):
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.shared = shared or shared_state
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = Lock()
+
+    def _remember(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = await self.shared.aget(self.namespace, key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    async def set(self, key: str, value: dict) -> None:
+        self._remember(key, value)
+        await self.shared.aset(self.namespace, key, value, ttl=self.ttl)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+unit_cache = UnitCache()
+# Same keys (unit_key of the whole file), kept apart from units
+file_cache = UnitCache(FILE_CACHE_SIZE, namespace="refactor-file")
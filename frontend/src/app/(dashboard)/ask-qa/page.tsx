@@ -120,6 +120,10 @@ export default function AskQA() {
   const [response, setResponse] = useState<string>('');
   // State to indicate if the request is loading
   const [isLoading, setIsLoading] = useState(false);
+  // Conversation id so follow-up questions reuse the server-side context
+  const [sessionId] = useState(() => crypto.randomUUID());
+  // Code the server already holds for this session; unchanged code is not resent
+  const [sentCode, setSentCode] = useState('');
 
   // Handles form submission to send question/code to backend
   const handleSubmit = async (e: React.FormEvent) => {
@@ -129,24 +133,37 @@ export default function AskQA() {
 
     try {
       // Send POST request to the local API proxy for AskQA
-      const res = await fetch('/api/ask-qa', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ question, code }),
-      });
+      const send = async (withCode: boolean) => {
+        const res = await fetch('/api/ask-qa', {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({
+            question,
+            code: withCode ? code : '',
+            session_id: sessionId,
+          }),
+        });
 
-      if (!res.ok) {
-        throw new Error('Network response was not ok');
-      }
+        if (!res.ok) {
+          throw new Error('Network response was not ok');
+        }
+
+        // Debug: Check what we're actually getting
+        const contentType = res.headers.get('content-type');
+        console.log('Content-Type:', contentType);
+        return res.json();
+      };
 
-      // Debug: Check what we're actually getting
-      const contentType = res.headers.get('content-type');
-      console.log('Content-Type:', contentType);
-      
       // Parse the response and clean up code block markers
-      const data = await res.json();
+      let data = await send(code !== sentCode);
+      // The server lost the session's code and could not restore it: send it again
+      if (data.code_required && code) {
+        data = await send(true);
+      }
+      // Resend the code next time if the server lost the session context
+      setSentCode(data.has_code_context ? code : '');
       const raw = data.response || data.message || '';
       const cleaned = raw.replace(/```/g, "'''");  // retain newline structure
       setResponse(cleaned);
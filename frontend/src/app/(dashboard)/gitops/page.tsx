@@ -17,6 +17,7 @@ interface GitScenario {
 export default function GitOpsPage() {
   const [task, setTask] = useState('');
   const [command, setCommand] = useState('');
+  const [commands, setCommands] = useState<string[]>([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
   const [copied, setCopied] = useState(false);
@@ -42,6 +43,7 @@ export default function GitOpsPage() {
     setLoading(true);
     setError('');
     setCommand('');
+    setCommands([]);
     setCopied(false);
     setSteps([]);
     setBeginnerExplanation('');
@@ -83,15 +85,11 @@ export default function GitOpsPage() {
         setError(data.warnings.join('\n'));
       }
       
-      if (data.command) {
-        setCommand(data.command);
-      } else if (data.summary) {
-        setCommand(data.summary);
-      } else if (data.suggestions && data.suggestions.length > 0) {
-        setCommand(data.suggestions.join('\n'));
-      } else {
-        setCommand('No command generated.');
-      }
+      // Structured answer: the summary, then the commands to run as one code block
+      const answerCommands: string[] = data.commands || [];
+      const commandBlock = answerCommands.length > 0 ? '```bash\n' + answerCommands.join('\n') + '\n```' : '';
+      setCommands(answerCommands);
+      setCommand([data.summary, commandBlock].filter(Boolean).join('\n\n') || 'No command generated.');
 
       if (data.steps && data.steps.length > 0) {
         setSteps(data.steps);
@@ -110,7 +108,7 @@ export default function GitOpsPage() {
 
   const handleCopy = () => {
     if (command) {
-      navigator.clipboard.writeText(command);
+      navigator.clipboard.writeText(commands.length > 0 ? commands.join('\n') : command);
       setCopied(true);
       setTimeout(() => setCopied(false), 1200);
     }
@@ -119,6 +117,7 @@ export default function GitOpsPage() {
   const handleReset = () => {
     setTask('');
     setCommand('');
+    setCommands([]);
     setError('');
     setCopied(false);
     setSelectedScenario('');
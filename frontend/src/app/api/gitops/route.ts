@@ -4,6 +4,9 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { getApiUrl } from '../../../lib/api-config';
 
+// Sent to the backend so it stops working on requests we have given up on
+const REQUEST_TIMEOUT_SECONDS = 60;
+
 /**
  * Handles POST requests to /api/gitops
  * Forwards the request to the FastAPI backend to get a Git command.
@@ -17,8 +20,11 @@ export async function POST(req: NextRequest) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        'X-Request-Timeout': String(REQUEST_TIMEOUT_SECONDS),
       },
       body: JSON.stringify(body),
+      // Abort the backend call when the browser disconnects or we time out
+      signal: AbortSignal.any([req.signal, AbortSignal.timeout(REQUEST_TIMEOUT_SECONDS * 1000)]),
     });
 
     if (!apiResponse.ok) {
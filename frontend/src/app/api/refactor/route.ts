@@ -1,6 +1,9 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { getApiUrl } from '../../../lib/api-config';
 
+// Sent to the backend so it stops working on requests we have given up on
+const REQUEST_TIMEOUT_SECONDS = 120;
+
 export async function POST(req: NextRequest) {
   try {
     const body = await req.json();
@@ -10,8 +13,11 @@ export async function POST(req: NextRequest) {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        'X-Request-Timeout': String(REQUEST_TIMEOUT_SECONDS),
       },
       body: JSON.stringify(body),
+      // Abort the backend call when the browser disconnects or we time out
+      signal: AbortSignal.any([req.signal, AbortSignal.timeout(REQUEST_TIMEOUT_SECONDS * 1000)]),
     });
 
     if (!apiResponse.ok) {